@@ -0,0 +1,85 @@
+__all__ = ["TTLCache", "on_change", "publish_change"]
+
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Callable, Hashable
+
+MISSING = object()
+
+# Callbacks dropping the cached data of a collection. They get the `_id` of the
+# changed document, or None when any document may have changed, and the
+# top-level fields an update changed, or None when unknown.
+invalidation_handlers: dict[str, list[Callable[[Any, frozenset[str] | None], None]]] = defaultdict(list)
+
+
+class TTLCache:
+    """
+    Bounded in-process LRU cache whose entries expire `ttl` seconds after being set.
+
+    Not shared between workers: keep TTLs short for data other workers can change.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key, MISSING)
+        if entry is not MISSING:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.pop(key, MISSING)
+        return default if entry is MISSING else entry[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+def on_change(*collection_names: str):
+    """
+    Registers the decorated function as invalidation handler of the collections,
+    called for every change another worker (or this one) makes to them.
+    """
+
+    def register(handler: Callable[[Any, frozenset[str] | None], None]):
+        for name in collection_names:
+            invalidation_handlers[name].append(handler)
+        return handler
+
+    return register
+
+
+def publish_change(collection_name: str, id: Any = None, fields: frozenset[str] | None = None):
+    for handler in invalidation_handlers.get(collection_name, ()):
+        handler(id, fields)
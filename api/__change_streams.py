@@ -0,0 +1,140 @@
+__all__ = ["ChangeStreamListener", "change_listener"]
+
+import asyncio
+import time
+from typing import Any
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from .__cache import publish_change
+from .config import mongo, logger
+
+# "only supported on replica sets", and IllegalOperation on older servers.
+UNSUPPORTED_CODES = {40573, 20}
+# The stored resume token is too old (or invalid) to resume from.
+HISTORY_LOST_CODES = {260, 280, 286}
+RETRY_SECONDS = 5
+SAVE_TOKEN_SECONDS = 1
+
+
+class ChangeStreamListener:
+    """
+    Watches collections with a MongoDB change stream and calls their
+    invalidation handlers (see `on_change`) for every changed document, so
+    each worker's in-process caches see the writes of all the others.
+
+    The resume token is stored in `change_stream_tokens`, so after a restart
+    or a dropped connection the listener replays what it missed. If nothing
+    can be resumed the caches of the watched collections are cleared instead.
+    Without change stream support (standalone servers) it stops and caches
+    fall back to their TTL.
+    """
+
+    def __init__(self, collections: list[str], name: str = "cache_invalidation"):
+        self.collections = collections
+        self.name = name
+        self.resume_token: dict | None = None
+        self.state = "stopped"
+        self.events = 0
+        self.resets = 0
+        self.last_event_at: float | None = None
+        self._saved_at = 0.0
+
+    @property
+    def tokens(self):
+        return mongo.db["change_stream_tokens"]
+
+    async def run(self):
+        try:
+            stored = await self.tokens.find_one({"_id": self.name})
+            self.resume_token = stored["token"] if stored else None
+        except PyMongoError as e:
+            logger.error(f"Could not read change stream resume token: {e}")
+        try:
+            while True:
+                try:
+                    await self.watch()
+                except OperationFailure as e:
+                    if e.code in UNSUPPORTED_CODES:
+                        self.state = "unavailable"
+                        logger.warn(f"Change streams unavailable ({e}), caches will only expire by TTL.")
+                        return
+                    if e.code in HISTORY_LOST_CODES:
+                        logger.warn(f"Change stream can not resume ({e}), clearing caches.")
+                        self.resume_token = None
+                        continue
+                    self.state = "retrying"
+                    logger.error(f"Change stream failed: {e}")
+                except PyMongoError as e:
+                    self.state = "retrying"
+                    logger.error(f"Change stream failed: {e}")
+                await asyncio.sleep(RETRY_SECONDS)
+        finally:
+            if self.state != "unavailable":
+                self.state = "stopped"
+            await self.save_token(force=True)
+
+    async def watch(self):
+        pipeline = [{"$match": {"ns.coll": {"$in": self.collections}}}]
+        async with mongo.db.watch(pipeline, start_after=self.resume_token) as stream:
+            if self.resume_token is None:
+                # Changes made before the stream opened were never seen.
+                self.reset()
+            self.state = "watching"
+            async for change in stream:
+                self.handle(change)
+                self.resume_token = stream.resume_token
+                await self.save_token()
+
+    def handle(self, change: dict[str, Any]):
+        self.events += 1
+        self.last_event_at = time.time()
+        collection_name = change.get("ns", {}).get("coll")
+        if "documentKey" in change:
+            publish_change(collection_name, change["documentKey"]["_id"], self.changed_fields(change))
+        elif collection_name:
+            # drop, rename...: anything in the collection may have changed.
+            publish_change(collection_name)
+
+    @staticmethod
+    def changed_fields(change: dict[str, Any]) -> frozenset[str] | None:
+        """
+        Top-level fields an update changed, None for other operations.
+        """
+        if change.get("operationType") != "update" or "updateDescription" not in change:
+            return None
+        description = change["updateDescription"]
+        paths = [*description.get("updatedFields", {}), *description.get("removedFields", [])]
+        paths += [truncated["field"] for truncated in description.get("truncatedArrays", [])]
+        return frozenset(path.split(".")[0] for path in paths)
+
+    def reset(self):
+        self.resets += 1
+        for collection_name in self.collections:
+            publish_change(collection_name)
+
+    async def save_token(self, force: bool = False):
+        # Stored at most once per SAVE_TOKEN_SECONDS; replaying a few events
+        # after a restart only invalidates some extra entries.
+        if self.resume_token is None or (not force and time.monotonic() - self._saved_at < SAVE_TOKEN_SECONDS):
+            return
+        self._saved_at = time.monotonic()
+        try:
+            await self.tokens.update_one(
+                {"_id": self.name}, {"$set": {"token": self.resume_token}}, upsert=True
+            )
+        except PyMongoError as e:
+            logger.error(f"Could not store change stream resume token: {e}")
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "collections": self.collections,
+            "events": self.events,
+            "resets": self.resets,
+            "last_event_at": self.last_event_at,
+            "resumable": self.resume_token is not None,
+        }
+
+
+change_listener = ChangeStreamListener(["products", "users", "orders"])
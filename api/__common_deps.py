@@ -1,11 +1,47 @@
 __all__ = ["QueryParamsDependency", "QueryParams", "SearchEngineDependency", "SearchEngine"]
 
-from fastapi import Depends
-from pymongo.collection import Collection
-from pymongo.cursor import Cursor
-from typing import Annotated, Literal
+import base64
+import binascii
+import math
+import re
+from datetime import datetime
+from functools import lru_cache
+
+import bson
+from bson import ObjectId
+from bson.errors import BSONError
+from fastapi import Depends, HTTPException, status
+from motor.motor_asyncio import (
+    AsyncIOMotorCollection,
+    AsyncIOMotorCommandCursor,
+    AsyncIOMotorCursor,
+)
+from typing import Annotated, Literal, NamedTuple
 from dataclasses import dataclass
 
+from .__cache import TTLCache
+from .search import product_search, tokenize, AUTOCOMPLETE_FIELDS
+
+# Fields each collection can be filtered on through `QueryParams.filter`, with
+# the type their values are parsed as (see `format_value`).
+FILTERABLE_FIELDS: dict[str, dict[str, type]] = {
+    "products": {
+        "_id": ObjectId, "name": str, "description": str, "price": float,
+        "old_price": float, "stock": int, "sku": str, "image": str, "category": str,
+        "tags": str, "details.sizes": str, "staff_id": ObjectId, "sales_count": int,
+        "created_at": datetime, "modified_at": datetime,
+    },
+    "orders": {
+        "_id": ObjectId, "customer_id": ObjectId, "products.product_id": ObjectId,
+        "status": str, "total_price": float, "created_at": datetime,
+        "modified_at": datetime,
+    },
+    "users": {
+        "_id": ObjectId, "username": str, "email": str, "role": str, "firstname": str,
+        "lastname": str, "is_active": bool, "created_at": datetime, "modified_at": datetime,
+    },
+}
+
 op_map = {
     ">=": "$gte",
     "<=": "$lte",
@@ -15,27 +51,162 @@ op_map = {
     "=": "$eq",
     "~": "$regex",
 }
+# Operators taking a "|" separated list of values.
+list_op_map = {"$eq": "$in", "$ne": "$nin"}
 
-def format_value(v: str, regex=False):
-    return (
-        int(v)
-        if v.strip().isdigit()
-        else float(v) if v.strip().isdecimal()
-        else f"(?i){v.strip()}(?-i)" if regex
-        else v.strip()
-    )
-    
-def get_filter_query(filter_item: str):
-    op = ""
-    for o in op_map:
-        if o in filter_item:
-            op = o
-            break
-    if not op:
-        return {}
-
-    k, v = filter_item.split(op)
-    return {k.strip(): {op_map[op]: format_value(v, regex=(op=="~"))}}
+filter_item_pattern = re.compile(r"^\s*([\w.]+)\s*(>=|<=|!=|>|<|=|~)(.*)$", re.DOTALL)
+# A value starting like an operator means a mistyped one, as in "price>>3".
+operator_chars = frozenset("<>=!~")
+
+
+class FilterClause(NamedTuple):
+    field: str
+    op: str
+    value: object
+
+
+def invalid_filter(detail: str) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+
+
+def format_value(field: str, field_type: type, v: str):
+    """
+    `v` parsed as the declared type of `field`, so "sku=12345" stays a string
+    and "price=abc" is rejected instead of compared as text.
+    """
+    v = v.strip()
+    try:
+        if field_type is str:
+            return v
+        if field_type is ObjectId:
+            return ObjectId(v)
+        if field_type is bool:
+            return {"true": True, "false": False}[v]
+        if field_type is datetime:
+            return datetime.fromisoformat(v)
+        value = field_type(v)
+        if isinstance(value, float) and not math.isfinite(value):
+            raise ValueError(v)
+        return value
+    except (BSONError, KeyError, TypeError, ValueError):
+        raise invalid_filter(f"Valor inválido para '{field}': '{v}'")
+
+
+def parse_filter(raw_filter: str, field_types: dict[str, type]) -> tuple[FilterClause, ...]:
+    """
+    Parses "price>=10,price<=50,category=calzado|accesorios" into clauses,
+    with the values of each field parsed as its type in `field_types`.
+    `=` and `!=` with "|" separated values become `$in` / `$nin`.
+    """
+    clauses = []
+    for filter_item in raw_filter.split(","):
+        if not filter_item.strip():
+            continue
+        if not (match := filter_item_pattern.match(filter_item)):
+            raise invalid_filter(f"Filtro inválido: '{filter_item.strip()}'")
+        field, op, raw_value = match.groups()
+        if field not in field_types:
+            raise invalid_filter(f"No se puede filtrar por '{field}'.")
+        if raw_value.strip()[:1] in operator_chars:
+            raise invalid_filter(f"Operador inválido: '{filter_item.strip()}'")
+        field_type = field_types[field]
+        op = op_map[op]
+        if op == "$regex":
+            if field_type is not str:
+                raise invalid_filter(f"'{field}' no es un campo de texto.")
+            try:
+                re.compile(raw_value.strip())
+            except re.error:
+                raise invalid_filter(f"Expresión regular inválida: '{raw_value.strip()}'")
+            value = raw_value.strip()
+        elif op in list_op_map and "|" in raw_value:
+            op = list_op_map[op]
+            value = tuple(format_value(field, field_type, v) for v in raw_value.split("|"))
+        else:
+            value = format_value(field, field_type, raw_value)
+        clauses.append(FilterClause(field, op, value))
+    return tuple(clauses)
+
+
+def compile_clauses(clauses: tuple[FilterClause, ...]) -> dict:
+    filter_dict: dict[str, dict] = {}
+    for clause in clauses:
+        conditions = filter_dict.setdefault(clause.field, {})
+        if clause.op in conditions:
+            raise invalid_filter(f"Operador repetido para '{clause.field}'.")
+        if clause.op == "$regex":
+            conditions.update({"$regex": clause.value, "$options": "i"})
+        else:
+            conditions[clause.op] = list(clause.value) if isinstance(clause.value, tuple) else clause.value
+    return filter_dict
+
+
+# Documents fetched per round trip when streaming a listing.
+STREAM_BATCH_SIZE = 500
+
+# Filtered totals, keyed by (collection, compiled filter). Kept short so new
+# documents show up quickly; unfiltered totals come from collection metadata.
+count_cache = TTLCache(maxsize=1024, ttl=30)
+
+
+@lru_cache(maxsize=1024)
+def compile_filter(raw_filter: str, collection_name: str) -> dict:
+    """
+    Validated MongoDB filter for a raw `filter` string, cached by string.
+    The returned dict is shared between requests: do not mutate it.
+    """
+    return compile_clauses(parse_filter(raw_filter, FILTERABLE_FIELDS.get(collection_name, {})))
+
+
+@lru_cache(maxsize=1024)
+def compile_projection(raw_projection: str) -> dict:
+    """
+    MongoDB projection for a raw "name=1,price=1" string, cached by string.
+    The returned dict is shared between requests: copy it before changing it.
+    """
+    projection_dict = {}
+    for projection_item in raw_projection.split(","):
+        if not projection_item.strip():
+            continue
+        k, _, v = projection_item.partition("=")
+        if not re.fullmatch(r"[\w.]+", k.strip()) or not v.strip().lstrip("-").isdigit():
+            raise invalid_filter(f"Proyección inválida: '{projection_item.strip()}'")
+        projection_dict[k.strip()] = int(v) > 0
+    return projection_dict
+
+
+def check_sort_by(sort_by: str, collection_name: str) -> None:
+    """
+    Only fields that can be filtered on can be sorted on: the sort key of the
+    last document goes in `next_cursor`, and the order alone gives away values.
+    """
+    if sort_by not in FILTERABLE_FIELDS.get(collection_name, {}):
+        raise invalid_filter(f"No se puede ordenar por '{sort_by}'.")
+
+
+def encode_cursor(sort_value, last_id) -> str:
+    # BSON keeps the original types (ObjectId, datetime, float...) of the sort key.
+    return base64.urlsafe_b64encode(bson.encode({"v": sort_value, "id": last_id})).decode()
+
+def get_path(document: dict, path: str):
+    """
+    Value of a dotted `path` in `document`, None if any part of it is missing.
+    """
+    for key in path.split("."):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(key)
+    return document
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        decoded = bson.decode(base64.urlsafe_b64decode(cursor.encode()))
+        return decoded["v"], decoded["id"]
+    except (binascii.Error, BSONError, KeyError, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cursor de paginación inválido.",
+        )
 
 @dataclass
 class QueryParams:
@@ -45,33 +216,150 @@ class QueryParams:
     sort_by: str = "_id"
     sort_dir: Literal["asc", "desc"] = "asc"
     projection: str = ""
-    
-    def query_collection(self, collection: Collection) -> Cursor:
-        filter_dict = {}
-        filter_item_list = self.filter.split(",")
+    # "cursor" pages with a range predicate on (sort_by, _id) instead of skip(offset),
+    # so deep pages cost the same as the first one. Pass the `next_cursor` of the
+    # previous response as `cursor` to get the following page.
+    pagination: Literal["offset", "cursor"] = "offset"
+    cursor: str = ""
+    # Adds the total number of matching documents to the response.
+    count: bool = False
+    # Streams the listing as NDJSON (same as `Accept: application/x-ndjson`).
+    stream: bool = False
+
+    def query_collection(self, collection: AsyncIOMotorCollection) -> AsyncIOMotorCursor:
+        check_sort_by(self.sort_by, collection.name)
+        filter_dict = compile_filter(self.filter, collection.name)
+        projection_dict = dict(compile_projection(self.projection))
+
+        if self.pagination == "cursor":
+            return self.keyset_query(collection, filter_dict, projection_dict)
 
-        for filter_item in filter_item_list:
-            filter_dict.update(get_filter_query(filter_item))
-        
-        projection_dict = (
-            {
-                k.strip(): True if int(v) > 0 else False
-                for k, v in map(lambda x: x.split("="), self.projection.split(","))
-            }
-            if self.projection
-            else {}
-        )
-        
         return (
             collection.find(filter_dict, projection_dict)
             .limit(self.limit)
             .skip(self.offset)
             .sort(self.sort_by, 1 if self.sort_dir == "asc" else -1)
         )
+
+    def stream_collection(self, collection: AsyncIOMotorCollection) -> AsyncIOMotorCursor:
+        return self.query_collection(collection).batch_size(STREAM_BATCH_SIZE)
+
+    def keyset_query(
+        self,
+        collection: AsyncIOMotorCollection,
+        filter_dict: dict,
+        projection_dict: dict,
+    ) -> AsyncIOMotorCursor:
+        if range_filter := self.keyset_filter():
+            filter_dict = {"$and": [filter_dict, range_filter]} if filter_dict else range_filter
+        return (
+            collection.find(filter_dict, self.keyset_projection(projection_dict))
+            .sort(self.keyset_sort())
+            .limit(self.limit)
+        )
+
+    def keyset_filter(self) -> dict | None:
+        """
+        Documents after the `cursor`, in sort order.
+
+        MongoDB sorts null and missing values before any other, but range
+        operators never match them, so that bracket is handled apart: first
+        in ascending order, last in descending order.
+        """
+        if not self.cursor:
+            return None
+        last_value, last_id = decode_cursor(self.cursor)
+        ascending = self.sort_dir == "asc"
+        op = "$gt" if ascending else "$lt"
+        if self.sort_by == "_id":
+            return {"_id": {op: last_id}}
+        same_value = {self.sort_by: last_value, "_id": {op: last_id}}
+        if last_value is None:
+            if not ascending:
+                return same_value
+            return {"$or": [same_value, {self.sort_by: {"$ne": None}}]}
+        after = [{self.sort_by: {op: last_value}}, same_value]
+        if not ascending:
+            after.append({self.sort_by: None})
+        return {"$or": after}
+
+    def keyset_projection(self, projection_dict: dict) -> dict:
+        # The sort key and _id must come back to build the next cursor.
+        if any(projection_dict.values()):
+            projection_dict[self.sort_by] = True
+        else:
+            projection_dict.pop(self.sort_by, None)
+        projection_dict.pop("_id", None)
+        return projection_dict
+
+    def keyset_sort(self) -> list[tuple[str, int]]:
+        direction = 1 if self.sort_dir == "asc" else -1
+        sort = [(self.sort_by, direction)]
+        if self.sort_by != "_id":
+            sort.append(("_id", direction))
+        return sort
+
+    async def count_documents(self, collection: AsyncIOMotorCollection) -> int:
+        filter_dict = compile_filter(self.filter, collection.name)
+        if not filter_dict:
+            return await collection.estimated_document_count()
+        key = (collection.name, repr(filter_dict))
+        if (total := count_cache.get(key)) is None:
+            total = await collection.count_documents(filter_dict)
+            count_cache.set(key, total)
+        return total
+
+    def cache_key(self, collection_name: str) -> tuple:
+        """
+        Hashable key of the page these params select, equal for requests that
+        only differ in how they spell the same query.
+        """
+        filter_dict = compile_filter(self.filter, collection_name)
+        projection = tuple(sorted(compile_projection(self.projection).items()))
+        page = self.cursor if self.pagination == "cursor" else self.offset
+        return (
+            collection_name, repr(filter_dict), projection, self.sort_by,
+            self.sort_dir, self.limit, self.pagination, page, self.count,
+        )
+
+    def next_cursor(self, last_document: dict | None, count: int) -> str | None:
+        """
+        Continuation token for the page ending in `last_document`, or None
+        if the page was not full (there is nothing after it).
+        """
+        if last_document is None or count < self.limit:
+            return None
+        return encode_cursor(get_path(last_document, self.sort_by), last_document["_id"])
         
-    def aggregate_collection(self, collection: Collection) -> Cursor:
-        pass    
-        # TODO: Define custom MongoDB aggregation pipeline
+    def aggregate_collection(
+        self, collection: AsyncIOMotorCollection, facets: dict[str, list[dict]]
+    ) -> AsyncIOMotorCommandCursor:
+        """
+        One `$facet` aggregation over the filtered documents, giving a single
+        document with the page these params select as "results", the number
+        of matching documents as "total" (`[{"count": n}]`, or `[]` for none)
+        and the output of each of the `facets` pipelines.
+        """
+        check_sort_by(self.sort_by, collection.name)
+        filter_dict = compile_filter(self.filter, collection.name)
+        projection_dict = dict(compile_projection(self.projection))
+
+        # Sorted before `$facet`, which can not use indexes, so the sort can;
+        # the facet pipelines do not depend on the order of their input.
+        if self.pagination == "cursor":
+            sort = dict(self.keyset_sort())
+            page = [{"$match": range_filter}] if (range_filter := self.keyset_filter()) else []
+            page.append({"$limit": self.limit})
+            projection_dict = self.keyset_projection(projection_dict)
+        else:
+            sort = {self.sort_by: 1 if self.sort_dir == "asc" else -1}
+            page = [{"$skip": self.offset}, {"$limit": self.limit}]
+        if projection_dict:
+            page.append({"$project": projection_dict})
+
+        pipeline = [{"$match": filter_dict}] if filter_dict else []
+        pipeline += [{"$sort": sort}, {"$facet": {"results": page, "total": [{"$count": "count"}], **facets}}]
+        return collection.aggregate(pipeline)
 
 @dataclass
 class SearchEngine:
@@ -79,7 +367,7 @@ class SearchEngine:
     param: str = "name"
     limit: int = 10
     
-    def atlas_search(self, collection: Collection) -> Cursor:
+    def atlas_search(self, collection: AsyncIOMotorCollection) -> AsyncIOMotorCommandCursor:
         pipeline = [
             {
                 "$search": {
@@ -97,8 +385,24 @@ class SearchEngine:
         ]
         
         return collection.aggregate(pipeline)
+
+    def cache_key(self) -> tuple:
+        """
+        Hashable key of the results, equal for queries that only differ in
+        case, accents, punctuation or spacing.
+        """
+        return (" ".join(tokenize(self.query)), self.param, self.limit)
+
+    async def local_search(self, collection: AsyncIOMotorCollection) -> list[dict]:
+        """
+        Same as `atlas_search` with the in-process index: ranks the ids there
+        and reads the documents with one `$in` query.
+        """
+        ids = await product_search.search(self.query, self.limit)
+        documents = {document["_id"]: document async for document in collection.find({"_id": {"$in": ids}})}
+        return [documents[id] for id in ids if id in documents]
     
-    def autocomplete(self, collection: Collection) -> list[dict]:
+    async def autocomplete(self, collection: AsyncIOMotorCollection) -> list[dict]:
         pipeline = [
             {
                 "$search": {
@@ -120,8 +424,19 @@ class SearchEngine:
                 "id": str(doc["_id"]),
                 self.param: doc[self.param]
             }
-            for doc in cursor
+            async for doc in cursor
         ]
+
+    async def local_autocomplete(self) -> list[dict]:
+        """
+        Same as `autocomplete` from the in-process prefix index, best sellers first.
+        """
+        if self.param not in AUTOCOMPLETE_FIELDS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Solo se puede autocompletar por {', '.join(AUTOCOMPLETE_FIELDS)}.",
+            )
+        return await product_search.autocomplete(self.query, self.param, self.limit)
     
 
 SearchEngineDependency = Annotated[SearchEngine, Depends()]
@@ -0,0 +1,273 @@
+__all__ = ["CompressedStaticFiles"]
+
+import gzip
+import hashlib
+import os
+import re
+from mimetypes import guess_type
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Receive, Scope, Send
+
+from .config import logger
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Images and fonts are compressed already.
+COMPRESSIBLE_TYPES = {
+    "application/javascript",
+    "application/json",
+    "application/xml",
+    "image/svg+xml",
+    "text/css",
+    "text/html",
+    "text/javascript",
+    "text/plain",
+}
+MIN_COMPRESS_SIZE = 256
+# Content-Encoding and file suffix of the variants, in order of preference.
+ENCODINGS = {"gzip": ".gz"} if brotli is None else {"br": ".br", "gzip": ".gz"}
+# Also the ones written while brotli was installed.
+VARIANT_SUFFIXES = (".br", ".gz")
+COMPRESSORS = {
+    "br": lambda data: brotli.compress(data, quality=11),
+    "gzip": lambda data: gzip.compress(data, compresslevel=9, mtime=0),
+}
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "public, no-cache"
+# "index.3f9a0c12e4b1.css" for "index.css".
+FINGERPRINT_PATTERN = re.compile(r"(?P<stem>.+)\.(?P<hash>[0-9a-f]{12})(?P<suffix>\.[^.]+)")
+NO_QUALITY_PATTERN = re.compile(r"\s*q\s*=\s*0(\.0*)?\s*")
+
+
+def is_compressible(path: str) -> bool:
+    media_type, encoding = guess_type(path)
+    return encoding is None and media_type in COMPRESSIBLE_TYPES
+
+
+def is_variant(path: str) -> bool:
+    """
+    Whether `path` is a compressed variant written by `precompress`.
+    """
+    stem, suffix = os.path.splitext(path)
+    return suffix in VARIANT_SUFFIXES and is_compressible(stem)
+
+
+def accepted_encodings(accept_encoding: str) -> set[str]:
+    accepted = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        if not NO_QUALITY_PATTERN.fullmatch(params):
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def parse_range(range_header: str, size: int) -> tuple[int, int] | None:
+    """
+    First and last byte of a single `bytes=` range. None when the header should
+    be ignored (other units, several ranges, malformed); a start past the end
+    of the file means the range can not be satisfied.
+    """
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in ranges:
+        return None
+    first, _, last = ranges.strip().partition("-")
+    try:
+        if not first:
+            suffix = int(last)
+            return (max(size - suffix, 0), size - 1) if suffix else (size, size - 1)
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    return None if end < start and start < size else (start, end)
+
+
+def precompress(full_path: str, source_stat: os.stat_result) -> dict[str, tuple[str, os.stat_result]]:
+    """
+    Writes (or refreshes) the compressed variants of a file next to it and
+    returns them by encoding. Variants not smaller than the file are dropped.
+    """
+    variants = {}
+    data = None
+    for encoding, suffix in ENCODINGS.items():
+        variant_path = full_path + suffix
+        try:
+            variant_stat = os.stat(variant_path)
+            if variant_stat.st_mtime < source_stat.st_mtime:
+                raise FileNotFoundError
+        except FileNotFoundError:
+            if data is None:
+                with open(full_path, "rb") as file:
+                    data = file.read()
+            compressed = COMPRESSORS[encoding](data)
+            if len(compressed) >= len(data):
+                continue
+            # Written aside and renamed, so no request sees half a file.
+            with open(variant_path + ".tmp", "wb") as file:
+                file.write(compressed)
+            os.replace(variant_path + ".tmp", variant_path)
+            variant_stat = os.stat(variant_path)
+        variants[encoding] = (variant_path, variant_stat)
+    return variants
+
+
+class RangeFileResponse(FileResponse):
+    """
+    Streams bytes `start` to `end` (inclusive) of a file as a 206 response.
+    """
+
+    def __init__(self, path: str, start: int, end: int, stat_result: os.stat_result, **kwargs):
+        headers = dict(kwargs.pop("headers", None) or {})
+        headers["content-range"] = f"bytes {start}-{end}/{stat_result.st_size}"
+        headers["content-length"] = str(end - start + 1)
+        super().__init__(path, status_code=206, headers=headers, stat_result=stat_result, **kwargs)
+        self.start = start
+        self.end = end
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            remaining = self.end - self.start + 1
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                # A file truncated meanwhile ends the body early.
+                remaining = remaining - len(chunk) if chunk else 0
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+
+
+class CompressedStaticFiles(StaticFiles):
+    """
+    StaticFiles that serves the gzip (and, with the `brotli` package, br)
+    variant of text assets the client accepts, and answers `Range` and
+    conditional requests straight from disk.
+
+    `prepare` (run at startup) writes the compressed variants and fingerprints
+    those assets: `fingerprinted("css/index.css")` gives a path like
+    "css/index.3f9a0c12e4b1.css", served with far-future immutable caching.
+    Files under `immutable_paths` (uploads with random names, which are never
+    rewritten) are cached the same way. Everything else must be revalidated.
+    """
+
+    def __init__(self, *, directory: str, immutable_paths: tuple[str, ...] = (), **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.immutable_paths = tuple(os.path.normpath(path) + os.sep for path in immutable_paths)
+        self.fingerprints: dict[str, str] = {}
+        self.variants: dict[str, tuple[float, dict[str, tuple[str, os.stat_result]]]] = {}
+
+    def prepare(self):
+        """
+        Fingerprints and precompresses the text assets. Files that can not be
+        read or compressed (e.g. a read-only directory) are served as they are.
+        """
+        root = os.path.realpath(self.directory)
+        failed = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            relative_dir = os.path.relpath(dirpath, root)
+            # Uploads are not text and can be many, skip them.
+            dirnames[:] = [
+                name for name in dirnames
+                if not self.is_immutable(os.path.normpath(os.path.join(relative_dir, name)) + os.sep)
+            ]
+            for filename in filenames:
+                full_path = os.path.join(dirpath, filename)
+                if not is_compressible(full_path):
+                    continue
+                relative_path = os.path.relpath(full_path, root).replace(os.sep, "/")
+                try:
+                    source_stat = os.stat(full_path)
+                    with open(full_path, "rb") as file:
+                        self.fingerprints[relative_path] = hashlib.blake2b(file.read(), digest_size=6).hexdigest()
+                    if source_stat.st_size >= MIN_COMPRESS_SIZE:
+                        variants = precompress(full_path, source_stat)
+                        self.variants[full_path] = (source_stat.st_mtime, variants)
+                except OSError as e:
+                    failed.append(f"{relative_path}: {e}")
+        if failed:
+            logger.warning(f"Static files in {self.directory} not prepared ({len(failed)}), e.g. {failed[0]}")
+        logger.info(f"Static files in {self.directory}: {len(self.fingerprints)} fingerprinted, {len(self.variants)} compressed.")
+
+    def is_immutable(self, relative_path: str) -> bool:
+        return relative_path.startswith(self.immutable_paths)
+
+    def fingerprinted(self, path: str) -> str:
+        """
+        Content-addressed path of a static file, for long-lived caching. Paths
+        it does not know are returned as they are.
+        """
+        relative_path = path.lstrip("/")
+        if (digest := self.fingerprints.get(relative_path)) is None:
+            return path
+        stem, suffix = os.path.splitext(path)
+        return f"{stem}.{digest}{suffix}"
+
+    def lookup_path(self, path: str) -> tuple[str, os.stat_result | None]:
+        # Variants are only served with their Content-Encoding, see `file_response`.
+        if is_variant(path):
+            return "", None
+        full_path, stat_result = super().lookup_path(path)
+        if stat_result is None and (match := FINGERPRINT_PATTERN.fullmatch(path.replace(os.sep, "/"))):
+            original = match["stem"] + match["suffix"]
+            # Only the current content: an outdated hash must not be cached as immutable.
+            if self.fingerprints.get(original) == match["hash"]:
+                return super().lookup_path(original)
+        return full_path, stat_result
+
+    def file_response(
+        self,
+        full_path: str,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        relative_path = os.path.relpath(full_path, os.path.realpath(self.directory))
+        requested_name = scope["path"].rsplit("/", 1)[-1]
+        fingerprinted = requested_name != os.path.basename(full_path) and FINGERPRINT_PATTERN.fullmatch(requested_name)
+        headers = {
+            "accept-ranges": "bytes",
+            "cache-control": IMMUTABLE if fingerprinted or self.is_immutable(relative_path) else REVALIDATE,
+        }
+        media_type = guess_type(full_path)[0] or "text/plain"
+        if is_compressible(full_path):
+            headers["vary"] = "Accept-Encoding"
+            source_mtime, variants = self.variants.get(full_path, (None, {}))
+            # Ignored if the file changed after `prepare`.
+            if source_mtime == stat_result.st_mtime:
+                accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+                for encoding in ENCODINGS:
+                    if encoding in accepted and encoding in variants:
+                        full_path, stat_result = variants[encoding]
+                        headers["content-encoding"] = encoding
+                        break
+
+        response = FileResponse(
+            full_path, status_code=status_code, headers=headers, media_type=media_type, stat_result=stat_result
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        range_header = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if (
+            status_code != 200
+            or range_header is None
+            or if_range not in (None, response.headers["etag"], response.headers["last-modified"])
+            or (byte_range := parse_range(range_header, stat_result.st_size)) is None
+        ):
+            return response
+        start, end = byte_range
+        if start >= stat_result.st_size:
+            return Response(
+                status_code=416, headers={**headers, "content-range": f"bytes */{stat_result.st_size}"}
+            )
+        return RangeFileResponse(full_path, start, end, stat_result, headers=headers, media_type=media_type)
@@ -16,6 +16,28 @@ __all__ = [
     "APP_TITLE",
     "API_ENV",
     "RESEND_API_KEY",
+    "MONGODB_MAX_POOL_SIZE",
+    "MONGODB_MIN_POOL_SIZE",
+    "MONGODB_MAX_CONNECTING",
+    "MONGODB_MAX_IDLE_TIME_MS",
+    "MONGODB_WAIT_QUEUE_TIMEOUT_MS",
+    "TRUSTED_READS",
+    "TRUSTED_READS_SAMPLE_RATE",
+    "RESERVATION_TTL_SECONDS",
+    "RESERVATION_SWEEP_SECONDS",
+    "RESERVATION_RETENTION_SECONDS",
+    "IDEMPOTENCY_TTL_SECONDS",
+    "PRODUCT_CACHE_SIZE",
+    "PRODUCT_CACHE_TTL_SECONDS",
+    "CHANGE_STREAMS_ENABLED",
+    "CATALOG_CACHE_SIZE",
+    "CATALOG_CACHE_TTL_SECONDS",
+    "CATALOG_MAX_AGE_SECONDS",
+    "SEARCH_BACKEND",
+    "SEARCH_CACHE_SIZE",
+    "SEARCH_CACHE_TTL_SECONDS",
+    "PRICE_FACET_BOUNDARIES",
+    "TAG_FACET_LIMIT",
 ]
 
 import logging
@@ -54,6 +76,59 @@ MAIL_PORT = int(os.environ.get("MAIL_PORT", "1025"))
 MAIL_SERVER = os.environ.get("MAIL_SERVER", "smtp")
 RESEND_API_KEY = os.environ.get("RESEND_API_KEY", "")
 
+# MongoDB connection pool, tune per deployment against the cluster connection limit
+# (roughly workers * MONGODB_MAX_POOL_SIZE connections per host). Zero means no limit.
+MONGODB_MAX_POOL_SIZE = int(os.environ.get("MONGODB_MAX_POOL_SIZE", "100"))
+MONGODB_MIN_POOL_SIZE = int(os.environ.get("MONGODB_MIN_POOL_SIZE", "0"))
+MONGODB_MAX_CONNECTING = int(os.environ.get("MONGODB_MAX_CONNECTING", "2"))
+MONGODB_MAX_IDLE_TIME_MS = int(os.environ.get("MONGODB_MAX_IDLE_TIME_MS", "0")) or None
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "0")) or None
+
+# Documents read from our own collections were validated on write, so list endpoints
+# can skip full validation and only check a random sample of them.
+TRUSTED_READS = os.environ.get("TRUSTED_READS", "false").lower() == "true"
+TRUSTED_READS_SAMPLE_RATE = float(os.environ.get("TRUSTED_READS_SAMPLE_RATE", "0.05"))
+
+# Pending orders hold their stock for RESERVATION_TTL_SECONDS. Expired holds are
+# released every RESERVATION_SWEEP_SECONDS, and released reservations are kept
+# RESERVATION_RETENTION_SECONDS before MongoDB deletes them.
+RESERVATION_TTL_SECONDS = int(os.environ.get("RESERVATION_TTL_SECONDS", "900"))
+RESERVATION_SWEEP_SECONDS = float(os.environ.get("RESERVATION_SWEEP_SECONDS", "30"))
+RESERVATION_RETENTION_SECONDS = int(os.environ.get("RESERVATION_RETENTION_SECONDS", "86400"))
+
+# How long a response stored for an Idempotency-Key can be replayed.
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "86400"))
+
+# Per-worker cache of single products. Writes made by other workers are only
+# seen once the entry expires, so keep the TTL short.
+PRODUCT_CACHE_SIZE = int(os.environ.get("PRODUCT_CACHE_SIZE", "10000"))
+PRODUCT_CACHE_TTL_SECONDS = float(os.environ.get("PRODUCT_CACHE_TTL_SECONDS", "30"))
+
+# Invalidate in-process caches from a MongoDB change stream, so writes from other
+# workers are seen right away. Needs a replica set; without one, caches only expire.
+CHANGE_STREAMS_ENABLED = os.environ.get("CHANGE_STREAMS_ENABLED", "true").lower() == "true"
+
+# Rendered pages of the public product listing, by query. Product writes drop them
+# at once; clients may reuse a page CATALOG_MAX_AGE_SECONDS before revalidating it.
+CATALOG_CACHE_SIZE = int(os.environ.get("CATALOG_CACHE_SIZE", "512"))
+CATALOG_CACHE_TTL_SECONDS = float(os.environ.get("CATALOG_CACHE_TTL_SECONDS", "30"))
+CATALOG_MAX_AGE_SECONDS = int(os.environ.get("CATALOG_MAX_AGE_SECONDS", "0"))
+
+# "local" searches products with the in-process index (see api/search), "atlas" with
+# Atlas Search, falling back to the local index where $search is not available.
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "local").lower()
+
+# Search results by normalized query. Product writes drop them at once, like catalog pages.
+SEARCH_CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", "1024"))
+SEARCH_CACHE_TTL_SECONDS = float(os.environ.get("SEARCH_CACHE_TTL_SECONDS", "30"))
+
+# Lower bounds of the price ranges counted by /products/facets; the last range is open.
+PRICE_FACET_BOUNDARIES = sorted(
+    float(boundary) for boundary in os.environ.get("PRICE_FACET_BOUNDARIES", "0,5000,10000,25000,50000,100000").split(",")
+)
+# Most used tags listed by /products/facets.
+TAG_FACET_LIMIT = int(os.environ.get("TAG_FACET_LIMIT", "30"))
+
 
 logger = logging.getLogger("uvicorn")
 # logger.setLevel(logging.DEBUG)
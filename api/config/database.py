@@ -1,35 +1,367 @@
-__all__ = ["db", "COLLECTIONS"]
+__all__ = [
+    "COLLECTIONS",
+    "INDEXES",
+    "mongo",
+    "MongoCollection",
+    "pool_metrics",
+    "connect_to_mongo",
+    "close_mongo_connection",
+    "sync_indexes",
+    "log_index_report",
+]
 
-from pymongo.mongo_client import MongoClient
+import statistics
+import time
+from collections import deque
+
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection, AsyncIOMotorDatabase
+from pymongo import ASCENDING, IndexModel, monitoring
+from pymongo.errors import OperationFailure, PyMongoError
 from pymongo.server_api import ServerApi
 
-from .__base import MONGODB_URI, logger
+from .__base import (
+    MONGODB_URI,
+    MONGODB_MAX_POOL_SIZE,
+    MONGODB_MIN_POOL_SIZE,
+    MONGODB_MAX_CONNECTING,
+    MONGODB_MAX_IDLE_TIME_MS,
+    MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+    RESERVATION_RETENTION_SECONDS,
+    IDEMPOTENCY_TTL_SECONDS,
+    logger,
+)
 
 DB_NAME = "bootcamp_eCommerce_app"
-COLLECTIONS = ["products", "users", "orders"]
+COLLECTIONS = [
+    "products",
+    "users",
+    "orders",
+    "reservations",
+    "idempotency_keys",
+    "change_stream_tokens",
+    "sales_rollups",
+]
+
+# Indexes every collection should have. Missing ones are created at startup by
+# `sync_indexes`; changed ones are only rebuilt with `python -m scripts.sync_indexes
+# --rebuild`. The default `_id_` index is implied.
+INDEXES: dict[str, list[IndexModel]] = {
+    "products": [
+        # Products without SKU are allowed, so only string SKUs must be unique.
+        IndexModel(
+            [("sku", ASCENDING)],
+            name="sku_unique",
+            unique=True,
+            partialFilterExpression={"sku": {"$type": "string"}},
+        ),
+        IndexModel([("staff_id", ASCENDING)], name="staff_id"),
+    ],
+    "users": [
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "orders": [
+        IndexModel([("customer_id", ASCENDING)], name="customer_id"),
+        IndexModel([("products.product_id", ASCENDING)], name="products_product_id"),
+    ],
+    "reservations": [
+        # Used by the sweeper looking for expired active holds.
+        IndexModel([("status", ASCENDING), ("expires_at", ASCENDING)], name="status_expires_at"),
+        # Only released or consumed reservations have `released_at`, so active
+        # holds are never deleted before their stock is given back.
+        IndexModel(
+            [("released_at", ASCENDING)],
+            name="released_at_ttl",
+            expireAfterSeconds=RESERVATION_RETENTION_SECONDS,
+        ),
+    ],
+    "idempotency_keys": [
+        IndexModel(
+            [("created_at", ASCENDING)],
+            name="created_at_ttl",
+            expireAfterSeconds=IDEMPOTENCY_TTL_SECONDS,
+        ),
+    ],
+}
+# Index options compared against the server definition, besides the keys.
+INDEX_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """
+    Connection pool listener keeping counters and recent checkout wait times.
+
+    Registered on the client so `/api/metrics/db_pool` can report how many
+    connections are open and in use, and how long requests wait to get one.
+    """
+
+    def __init__(self, window: int = 1000):
+        self.started_at = time.time()
+        self.open = 0
+        self.in_use = 0
+        self.max_in_use = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+        self.wait_times_ms: deque[float] = deque(maxlen=window)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self.pool_clears += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.open -= 1
+
+    def connection_check_out_started(self, event):
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+
+    def connection_check_out_failed(self, event):
+        self.waiting -= 1
+        self.checkout_failures += 1
+        if event.duration is not None:
+            self.wait_times_ms.append(event.duration * 1000)
+
+    def connection_checked_out(self, event):
+        self.waiting -= 1
+        self.in_use += 1
+        self.max_in_use = max(self.max_in_use, self.in_use)
+        self.checkouts += 1
+        if event.duration is not None:
+            self.wait_times_ms.append(event.duration * 1000)
+
+    def connection_checked_in(self, event):
+        self.in_use -= 1
+
+    def snapshot(self) -> dict:
+        wait_times = sorted(self.wait_times_ms)
+        percentiles = (
+            statistics.quantiles(wait_times, n=100, method="inclusive")
+            if len(wait_times) > 1
+            else wait_times * 99
+        )
+        return {
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "config": {
+                "max_pool_size": MONGODB_MAX_POOL_SIZE,
+                "min_pool_size": MONGODB_MIN_POOL_SIZE,
+                "max_connecting": MONGODB_MAX_CONNECTING,
+                "max_idle_time_ms": MONGODB_MAX_IDLE_TIME_MS,
+                "wait_queue_timeout_ms": MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+            },
+            "connections_open": self.open,
+            "connections_in_use": self.in_use,
+            "max_connections_in_use": self.max_in_use,
+            "waiting_for_checkout": self.waiting,
+            "max_waiting_for_checkout": self.max_waiting,
+            "checkouts": self.checkouts,
+            "checkout_failures": self.checkout_failures,
+            "pool_clears": self.pool_clears,
+            "checkout_wait_ms": {
+                "samples": len(wait_times),
+                "p50": round(percentiles[49], 3) if wait_times else None,
+                "p95": round(percentiles[94], 3) if wait_times else None,
+                "p99": round(percentiles[98], 3) if wait_times else None,
+                "max": round(wait_times[-1], 3) if wait_times else None,
+            },
+        }
+
+
+class MongoConnection:
+    """
+    Holds the client created in the app lifespan (see `connect_to_mongo`).
+    """
+
+    client: AsyncIOMotorClient | None = None
+    # Multi-document transactions need a replica set or a sharded cluster (Atlas
+    # always is one). None until the server answered, see `transactions_supported`.
+    supports_transactions: bool | None = None
+
+    @property
+    def db(self) -> AsyncIOMotorDatabase:
+        if self.client is None:
+            raise RuntimeError("MongoDB client is not connected. Call connect_to_mongo() first.")
+        return self.client[DB_NAME]
+
+    async def transactions_supported(self) -> bool:
+        """
+        Whether the deployment supports multi-document transactions. Asks the
+        server until it answers once, so a failed check on connection is not
+        taken for a standalone server.
+        """
+        if self.supports_transactions is None:
+            hello = await self.client.admin.command("hello")
+            self.supports_transactions = "setName" in hello or hello.get("msg") == "isdbgrid"
+        return self.supports_transactions
+
+
+class MongoCollection:
+    """
+    Class attribute resolving to a collection of the lifespan-managed client.
+
+    Lets services keep using `cls.collection` even though the client does not
+    exist yet when their classes are defined.
+    """
+
+    def __init__(self, name: str):
+        assert name in COLLECTIONS, f"Collection (table) {name} does not exist in database"
+        self.name = name
+
+    def __get__(self, instance, owner) -> AsyncIOMotorCollection:
+        return mongo.db[self.name]
+
+
+mongo = MongoConnection()
+pool_metrics = PoolMetrics()
+
+
+async def connect_to_mongo():
+    mongo.client = AsyncIOMotorClient(
+        MONGODB_URI,
+        server_api=ServerApi("1"),
+        maxPoolSize=MONGODB_MAX_POOL_SIZE,
+        minPoolSize=MONGODB_MIN_POOL_SIZE,
+        maxConnecting=MONGODB_MAX_CONNECTING,
+        maxIdleTimeMS=MONGODB_MAX_IDLE_TIME_MS,
+        waitQueueTimeoutMS=MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+        event_listeners=[pool_metrics],
+    )
+    mongo.supports_transactions = None
+    # Send a ping to confirm a successful connection
+    try:
+        await mongo.transactions_supported()
+        logger.info("Pinged your deployment. You successfully connected to MongoDB!")
+    except PyMongoError as e:
+        logger.error(f"Could not reach MongoDB, transaction support will be checked again on first use: {e}")
+
+
+def close_mongo_connection():
+    if mongo.client is not None:
+        mongo.client.close()
+        mongo.client = None
+
+
+def _same_index(model: IndexModel, existing: dict) -> bool:
+    wanted = model.document
+    if list(wanted["key"].items()) != [(k, v) for k, v in existing["key"]]:
+        return False
+    return all(wanted.get(option) == existing.get(option) for option in INDEX_OPTIONS)
+
+
+def _existing_model(name: str, existing: dict) -> IndexModel:
+    options = {option: existing[option] for option in INDEX_OPTIONS if option in existing}
+    return IndexModel(list(existing["key"]), name=name, **options)
+
+
+async def _rebuild_index(collection: AsyncIOMotorCollection, model: IndexModel, existing: dict):
+    """
+    Replaces an index with the registry definition, putting the old one back
+    if the new one cannot be built (e.g. duplicated values for a unique index).
+    """
+    name = model.document["name"]
+    await collection.drop_index(name)
+    try:
+        await collection.create_indexes([model])
+    except OperationFailure:
+        await collection.create_indexes([_existing_model(name, existing)])
+        raise
+
+
+async def sync_indexes(rebuild: bool = False, drop_extra: bool = False) -> dict:
+    """
+    Reconciles `INDEXES` with the database. Safe to run repeatedly, and from
+    several processes at once.
+
+    Missing indexes are created. Indexes whose definition changed are only
+    reported, unless `rebuild`, and indexes not in the registry are reported
+    (and dropped only when `drop_extra`). Every worker runs it at startup with
+    the defaults, so dropping is left to `python -m scripts.sync_indexes`.
+    Returns a report per collection.
+    """
+    report = {}
+    for collection_name, models in INDEXES.items():
+        collection = mongo.db[collection_name]
+        existing = await collection.index_information()
+        result = {"created": [], "changed": [], "rebuilt": [], "extra": [], "dropped": [], "failed": []}
+        for model in models:
+            name = model.document["name"]
+            try:
+                if name not in existing:
+                    await collection.create_indexes([model])
+                    result["created"].append(name)
+                elif _same_index(model, existing[name]):
+                    continue
+                elif rebuild:
+                    await _rebuild_index(collection, model, existing[name])
+                    result["rebuilt"].append(name)
+                else:
+                    result["changed"].append(name)
+            except OperationFailure as e:
+                # e.g. duplicated values preventing a unique index, or another
+                # process dropping or creating it meanwhile
+                result["failed"].append(f"{name}: {e}")
+        wanted_names = {model.document["name"] for model in models}
+        for name in existing:
+            if name == "_id_" or name in wanted_names:
+                continue
+            if not drop_extra:
+                result["extra"].append(name)
+                continue
+            try:
+                await collection.drop_index(name)
+                result["dropped"].append(name)
+            except OperationFailure as e:
+                result["failed"].append(f"{name}: {e}")
+        report[collection_name] = result
+    return report
 
-# Create a new client and connect to the server
-client = MongoClient(MONGODB_URI, server_api=ServerApi("1"))
 
-# Send a ping to confirm a successful connection
-try:
-    client.admin.command("ping")
-    logger.info("Pinged your deployment. You successfully connected to MongoDB!")
-except Exception as e:
-    print(e)
+def log_index_report(report: dict):
+    for collection_name, result in report.items():
+        for name in result["created"]:
+            logger.info(f"\tIndex '{collection_name}.{name}' created.")
+        for name in result["changed"]:
+            logger.warn(
+                f"\tIndex '{collection_name}.{name}' differs from the registry, "
+                "rebuild it with `python -m scripts.sync_indexes --rebuild`."
+            )
+        for name in result["rebuilt"]:
+            logger.warn(f"\tIndex '{collection_name}.{name}' rebuilt with the registry definition.")
+        for name in result["dropped"]:
+            logger.warn(f"\tIndex '{collection_name}.{name}' dropped.")
+        for name in result["extra"]:
+            logger.warn(f"\tIndex '{collection_name}.{name}' is not in the registry.")
+        for error in result["failed"]:
+            logger.error(f"\tIndex '{collection_name}.{error}'")
 
-db = client[DB_NAME]
 
-def create_collections():
+async def create_collections():
     logger.warn("")
     logger.info("Initializing collections...")
+    existing_collections = await mongo.db.list_collection_names()
     for collection in COLLECTIONS:
-        if collection not in db.list_collection_names():
-            db.create_collection(collection)
+        if collection not in existing_collections:
+            await mongo.db.create_collection(collection)
             logger.warn(f"\tCollection '{collection}' created.")
         else:
             logger.info(f"\tCollection '{collection}' already exists.")
     logger.warn("")
 
 # Create Collections (optional)
-# create_collections()
\ No newline at end of file
+# await create_collections()
@@ -1,3 +1,4 @@
 from .products import *
 from .users import *
-from .orders import *
\ No newline at end of file
+from .orders import *
+from .batch import *
\ No newline at end of file
@@ -0,0 +1,110 @@
+__all__ = ["validate_batch"]
+
+import random
+from functools import lru_cache
+from types import UnionType
+from typing import Any, Union, get_args, get_origin
+
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+from ..config import TRUSTED_READS, TRUSTED_READS_SAMPLE_RATE
+
+
+@lru_cache(maxsize=None)
+def list_adapter(model: type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(list[model])
+
+
+def validate_each(model: type[BaseModel], documents: list[dict]) -> tuple[list[dict], list[str]]:
+    """
+    Validates the whole list in one call, falling back to per-document
+    validation only for the documents reported as invalid.
+    """
+    adapter = list_adapter(model)
+    try:
+        return adapter.dump_python(adapter.validate_python(documents)), []
+    except ValidationError as e:
+        invalid = {error["loc"][0] for error in e.errors()}
+    errors = []
+    for index in sorted(invalid):
+        try:
+            model.model_validate(documents[index])
+        except ValidationError as e:
+            errors.append(f"Validation error: {e}")
+    valid_documents = [doc for index, doc in enumerate(documents) if index not in invalid]
+    return adapter.dump_python(adapter.validate_python(valid_documents)), errors
+
+
+def construct_value(annotation: Any, value: Any) -> Any:
+    """
+    `value` as validation would leave it, assuming it is valid: nested models
+    constructed with their defaults, and ints turned into the declared floats.
+    """
+    if value is None:
+        return None
+    if get_origin(annotation) in (Union, UnionType):
+        options = [arg for arg in get_args(annotation) if arg is not type(None)]
+        models = [arg for arg in options if isinstance(arg, type) and issubclass(arg, BaseModel)]
+        if isinstance(value, dict) and len(models) > 1:
+            # Like validation, the model with the most fields set wins.
+            return construct(max(models, key=lambda m: len(m.model_fields.keys() & value.keys())), value)
+        if len(options) == 1:
+            return construct_value(options[0], value)
+        return value
+    if get_origin(annotation) is list and isinstance(value, list):
+        (item,) = get_args(annotation)
+        return [construct_value(item, v) for v in value]
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel) and isinstance(value, dict):
+        return construct(annotation, value)
+    if annotation is float and type(value) is int:
+        return float(value)
+    return value
+
+
+def construct(model: type[BaseModel], document: dict) -> BaseModel:
+    values = {}
+    for name, field in model.model_fields.items():
+        key = field.alias or name
+        if key in document:
+            values[key] = construct_value(field.annotation, document[key])
+    return model.model_construct(**values)
+
+
+def construct_sampled(
+    model: type[BaseModel], documents: list[dict], sample_rate: float
+) -> tuple[list[dict], list[str]] | None:
+    """
+    Builds models without validation, checking only a random sample.
+    Returns None if a sampled document is invalid, or an unchecked one cannot
+    even be built or dumped, so the caller validates everything.
+    """
+    sample = [doc for doc in documents if random.random() < sample_rate]
+    try:
+        list_adapter(model).validate_python(sample)
+    except ValidationError:
+        return None
+    try:
+        constructed = [construct(model, doc) for doc in documents]
+        return list_adapter(model).dump_python(constructed, warnings=False), []
+    except Exception:
+        # e.g. a document without `stock`, read by the `available_stock` computed field
+        return None
+
+
+def validate_batch(
+    model: type[BaseModel],
+    documents: list[dict],
+    *,
+    trusted: bool = TRUSTED_READS,
+    sample_rate: float = TRUSTED_READS_SAMPLE_RATE,
+) -> tuple[list[dict], list[str]]:
+    """
+    Validates and dumps a list of database documents in one pass.
+
+    Returns the dumped documents and a "Validation error: ..." message for each
+    invalid document, which is left out. With `trusted`, documents are built
+    with `model_construct` and only a `sample_rate` fraction is validated.
+    """
+    if trusted and (result := construct_sampled(model, documents, sample_rate)):
+        return result
+    return validate_each(model, documents)
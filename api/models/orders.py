@@ -6,6 +6,7 @@ __all__ = [
     "OrderStatus",
     "OrderProduct",
     "CompletedOrderProduct",
+    "ReservationStatus",
 ]
 
 from pydantic import BaseModel, Field
@@ -20,6 +21,14 @@ class OrderStatus(str, Enum):
     cancelled = "cancelled"
 
 
+class ReservationStatus(str, Enum):
+    # Stock being reserved without a transaction, see ReservationsService.hold.
+    pending = "pending"
+    active = "active"
+    released = "released"
+    consumed = "consumed"
+
+
 class OrderProduct(BaseModel):
     product_id: PydanticObjectId
     quantity: int = Field(gt=0)
@@ -46,6 +55,7 @@ class OrderUpdateData(BaseOrder):
     products: list[OrderProduct | CompletedOrderProduct] | None = None
     total_price: float | None = Field(ge=0, default=None)
     status: OrderStatus = OrderStatus.pending
+    reserved_until: datetime | None = None
 
 
 class OrderFromDB(BaseOrder):
@@ -54,4 +64,6 @@ class OrderFromDB(BaseOrder):
     created_at: datetime
     total_price: float | None = Field(ge=0, default=None)
     status: OrderStatus
+    # Until when the stock of a pending order is held, see ReservationsService.
+    reserved_until: datetime | None = None
     modified_at: datetime | None = None
@@ -7,7 +7,7 @@ __all__ = [
     "DeletedProductFromDB",
 ]
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, computed_field
 from pydantic_mongo import PydanticObjectId
 from datetime import datetime
 from ..config.constants import Size, Category
@@ -49,9 +49,16 @@ class ProductFromDB(BaseProduct):
     id: PydanticObjectId = Field(alias="_id")
     staff_id: PydanticObjectId
     sales_count: int | None = None
+    # Units held by pending orders, see ReservationsService.
+    reserved: int = Field(ge=0, default=0)
     created_at: datetime
     modified_at: datetime | None = None
 
+    @computed_field
+    @property
+    def available_stock(self) -> int:
+        return max(self.stock - self.reserved, 0)
+
 
 class DeletedProductFromDB(ProductFromDB):
     deleted_at: datetime
@@ -0,0 +1,131 @@
+__all__ = [
+    "MongoJSONResponse",
+    "NDJSONResponse",
+    "json_dumps",
+    "wants_ndjson",
+    "make_etag",
+    "cached_response",
+    "version_headers",
+    "is_conditional",
+    "not_modified",
+    "not_modified_response",
+]
+
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any
+
+import orjson
+from bson import ObjectId
+from fastapi import Request
+from fastapi import Response, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+
+def default(obj: Any):
+    # orjson already encodes datetime, Enum (Category, Size, OrderStatus...) and
+    # dataclasses natively; this only covers what it does not know.
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def json_dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class MongoJSONResponse(JSONResponse):
+    """
+    App-wide JSON response rendered with orjson.
+
+    Accepts models, ObjectIds and datetimes as they come from the services.
+    Returning it directly from a route skips FastAPI's `jsonable_encoder`, so
+    list endpoints are encoded exactly once.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return json_dumps(content)
+
+
+class NDJSONResponse(StreamingResponse):
+    """
+    Streams one JSON document per line, as the content iterator yields them.
+    """
+
+    media_type = "application/x-ndjson"
+
+
+def wants_ndjson(request: Request, stream: bool = False) -> bool:
+    return stream or NDJSONResponse.media_type in request.headers.get("accept", "")
+
+
+def make_etag(body: bytes) -> str:
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def version_headers(document: dict | BaseModel, *fields: str, private: bool = False) -> dict[str, str]:
+    """
+    `ETag` and `Last-Modified` of a stored document, from its `modified_at`
+    (or `created_at`) plus any other `fields` its representation depends on.
+    Works on the raw document as well as on its model, so a projection of
+    just those fields is enough to answer a conditional request.
+    """
+    if isinstance(document, BaseModel):
+        document = {field: getattr(document, field) for field in ("created_at", "modified_at", *fields)}
+    changed_at: datetime = document.get("modified_at") or document["created_at"]
+    # MongoDB keeps milliseconds, so documents and their models agree on it.
+    version = "-".join([f"{round(changed_at.timestamp() * 1000):x}", *(str(document.get(f)) for f in fields)])
+    return {
+        "ETag": f'W/"{version}"',
+        "Last-Modified": format_datetime(changed_at.astimezone(timezone.utc), usegmt=True),
+        "Cache-Control": f"{'private' if private else 'public'}, no-cache",
+    }
+
+
+def is_conditional(request: Request) -> bool:
+    return "if-none-match" in request.headers or "if-modified-since" in request.headers
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    # Weak comparison, as If-None-Match requires.
+    tags = {tag.strip().removeprefix("W/") for tag in request.headers["if-none-match"].split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+def not_modified(request: Request, headers: dict[str, str]) -> bool:
+    """
+    Whether the client's copy, as described by its `If-None-Match` or (only
+    without it) `If-Modified-Since` header, is still the one in `headers`.
+    """
+    if "if-none-match" in request.headers:
+        return etag_matches(request, headers["ETag"])
+    if "if-modified-since" not in request.headers or "Last-Modified" not in headers:
+        return False
+    try:
+        since = parsedate_to_datetime(request.headers["if-modified-since"])
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return parsedate_to_datetime(headers["Last-Modified"]) <= since
+
+
+def not_modified_response(headers: dict[str, str]) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+
+def cached_response(request: Request, body: bytes, etag: str, max_age: int = 0) -> Response:
+    """
+    JSON response clients can cache and revalidate: 304 without a body when
+    the request's `If-None-Match` already has `etag`.
+    """
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={max_age}, must-revalidate"}
+    if "if-none-match" in request.headers and etag_matches(request, etag):
+        return not_modified_response(headers)
+    return Response(body, media_type="application/json", headers=headers)
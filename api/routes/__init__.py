@@ -2,7 +2,9 @@ __all__ = ["api_router", "auth_router"]
 
 from fastapi import APIRouter
 
+from .analytics import analytics_router
 from .auth import auth_router
+from .metrics import metrics_router
 from .orders import orders_router
 from .products import products_router
 from .users import users_router
@@ -10,4 +12,6 @@ from .users import users_router
 api_router = APIRouter(prefix="/api")
 api_router.include_router(orders_router)
 api_router.include_router(products_router)
-api_router.include_router(users_router)
\ No newline at end of file
+api_router.include_router(users_router)
+api_router.include_router(metrics_router)
+api_router.include_router(analytics_router)
\ No newline at end of file
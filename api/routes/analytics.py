@@ -0,0 +1,68 @@
+__all__ = ["analytics_router"]
+
+from fastapi import APIRouter
+from pydantic_mongo import PydanticObjectId
+from datetime import date
+
+from ..config import Category
+from ..responses import MongoJSONResponse
+from ..services import SalesRollupsServiceDependency, SecurityDependency
+
+analytics_router = APIRouter(prefix="/analytics", tags=["Analytics"])
+
+
+@analytics_router.get("/sales/products/{id}")
+async def get_product_sales(
+    id: PydanticObjectId, security: SecurityDependency, rollups: SalesRollupsServiceDependency
+):
+    """
+    Staff members and admins only!
+    Revenue, units and orders of a product, from its sales rollup.
+    """
+    security.is_staff_or_raise
+    return MongoJSONResponse(await rollups.get_one("product", id))
+
+
+@analytics_router.get("/sales/staff/{id}")
+async def get_staff_sales(
+    id: PydanticObjectId, security: SecurityDependency, rollups: SalesRollupsServiceDependency
+):
+    """
+    Authenticated staff member only!
+    Revenue, units and orders of the products of a staff member.
+    """
+    security.check_user_permission(id)
+    return MongoJSONResponse(await rollups.get_one("staff", id))
+
+
+@analytics_router.get("/sales/categories")
+async def get_sales_by_category(security: SecurityDependency, rollups: SalesRollupsServiceDependency):
+    """
+    Staff members and admins only!
+    """
+    security.is_staff_or_raise
+    return MongoJSONResponse(await rollups.get_categories())
+
+
+@analytics_router.get("/sales/categories/{category}")
+async def get_category_sales(
+    category: Category, security: SecurityDependency, rollups: SalesRollupsServiceDependency
+):
+    """
+    Staff members and admins only!
+    """
+    security.is_staff_or_raise
+    return MongoJSONResponse(await rollups.get_one("category", category.value))
+
+
+@analytics_router.get("/sales/days")
+async def get_sales_by_day(
+    start: date, end: date, security: SecurityDependency, rollups: SalesRollupsServiceDependency
+):
+    """
+    Admins only!
+    One rollup per day from `start` to `end` (both included, up to a year),
+    days without sales included.
+    """
+    security.is_admin_or_raise
+    return MongoJSONResponse(await rollups.get_days(start, end))
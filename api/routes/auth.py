@@ -33,9 +33,9 @@ async def register(
 ):
     user.role = "customer"
     hash_password = auth.get_password_hash(user.password)
-    result = users.create_one(user, hash_password)
+    result = await users.create_one(user, hash_password)
    
-    if new_user := users.get_one(id=result.inserted_id, with_password=True):
+    if new_user := await users.get_one(id=result.inserted_id, with_password=True):
         print(f"user created with id: {new_user.id}")
         await send_account_verification_email(user=new_user, background_tasks=background_tasks)
     else:
@@ -52,7 +52,7 @@ async def verify_user_account(
     users: UsersServiceDependency,
     auth: AuthServiceDependency,
 ):
-    user_from_db = users.get_one(email=verify_request.email, with_password=True)
+    user_from_db = await users.get_one(email=verify_request.email, with_password=True)
     if not user_from_db:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -67,7 +67,7 @@ async def verify_user_account(
     context_string = f"{user_from_db.hash_password}{context_time.strftime('%d/%m/%Y,%H:%M:%S')}-verify" 
     try:
         if auth.verify_password(context_string, verify_request.token):
-            if users.update_one(
+            if await users.update_one(
                 user_from_db.id,
                 UserUpdateData(is_active=True)
                 ):
@@ -96,7 +96,7 @@ async def login_with_cookie(
     """
     Login with username or email
     """
-    user_from_db = users.get_one(
+    user_from_db = await users.get_one(
         username=user.input if "@" not in user.input else None,
         email=user.input if "@" in user.input else None,
         with_password=True
@@ -131,7 +131,7 @@ async def refresh_credentials(
     refresh: RefreshCredentials
     ):
     user_id = PydanticObjectId(refresh["id"])
-    user_from_db = users.get_one(id=user_id)
+    user_from_db = await users.get_one(id=user_id)
     if not user_from_db or not user_from_db.is_active:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -145,7 +145,7 @@ async def user_forgot_password(
     users: UsersServiceDependency,
     background_tasks: BackgroundTasks
 ):
-    user_from_db: PrivateUserFromDB = users.get_one(email=email, with_password=True)
+    user_from_db: PrivateUserFromDB = await users.get_one(email=email, with_password=True)
     if not user_from_db or not user_from_db.is_active:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -160,7 +160,7 @@ async def user_reset_password(
     auth: AuthServiceDependency,
     users: UsersServiceDependency
 ):
-    user_from_db: PrivateUserFromDB = users.get_one(email=verify_request.email, with_password=True)
+    user_from_db: PrivateUserFromDB = await users.get_one(email=verify_request.email, with_password=True)
     if not user_from_db.is_active:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -174,7 +174,7 @@ async def user_reset_password(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Link expirado o inválido"
             )
-        users.update_password(user_from_db.id, auth.get_password_hash(verify_request.new_password))
+        await users.update_password(user_from_db.id, auth.get_password_hash(verify_request.new_password))
         return JSONResponse({"message": "¡Nueva contraseña generada!"})
     except UnknownHashError:
         raise HTTPException(
@@ -0,0 +1,52 @@
+__all__ = ["metrics_router"]
+
+from fastapi import APIRouter
+from fastapi.concurrency import run_in_threadpool
+
+from ..__change_streams import change_listener
+from ..config import pool_metrics
+from ..search import product_search
+from ..services import SecurityDependency, ProductsService
+
+metrics_router = APIRouter(prefix="/metrics", tags=["Metrics"])
+
+
+@metrics_router.get("/db_pool")
+async def get_db_pool_metrics(security: SecurityDependency):
+    """
+    Admins only!
+    MongoDB connection pool usage and checkout wait times for this worker.
+    """
+    security.is_admin_or_raise
+    return pool_metrics.snapshot()
+
+
+@metrics_router.get("/product_cache")
+async def get_product_cache_metrics(security: SecurityDependency):
+    """
+    Admins only!
+    Hit ratio and size of this worker's product, catalog page and search result
+    caches, to tune their *_CACHE_SIZE and *_CACHE_TTL_SECONDS settings.
+    """
+    security.is_admin_or_raise
+    return ProductsService.cache_stats()
+
+
+@metrics_router.get("/change_stream")
+async def get_change_stream_metrics(security: SecurityDependency):
+    """
+    Admins only!
+    State of this worker's cache invalidation change stream.
+    """
+    security.is_admin_or_raise
+    return change_listener.snapshot()
+
+
+@metrics_router.get("/search_index")
+async def get_search_index_metrics(security: SecurityDependency):
+    """
+    Admins only!
+    Size and build state of this worker's product search index.
+    """
+    security.is_admin_or_raise
+    return await run_in_threadpool(product_search.snapshot)
@@ -1,14 +1,29 @@
 __all__ = ["orders_router"]
 
-from fastapi import APIRouter, status, BackgroundTasks, HTTPException
+import asyncio
+from contextlib import suppress
+from fastapi import APIRouter, status, BackgroundTasks, HTTPException, Request
 from pydantic_mongo import PydanticObjectId
 
 from ..__common_deps import QueryParamsDependency
+from ..responses import (
+    MongoJSONResponse,
+    NDJSONResponse,
+    wants_ndjson,
+    version_headers,
+    is_conditional,
+    not_modified,
+    not_modified_response,
+)
 from ..models import BaseOrder, OrderStatus, OrderUpdateData, OrderFromDB
 from ..services import (
     OrdersServiceDependency,
     ProductsServiceDependency,
+    ProductLoaderDependency,
+    ReservationsServiceDependency,
+    IdempotencyDependency,
     UsersServiceDependency,
+    SalesRollupsServiceDependency,
     SecurityDependency,
     send_order_completion_email,
 )
@@ -18,26 +33,40 @@ orders_router = APIRouter(prefix="/orders", tags=["Orders"])
 
 @orders_router.get("/get_all")
 async def get_all_orders(
+    request: Request,
     orders: OrdersServiceDependency,
     security: SecurityDependency,
     params: QueryParamsDependency,
 ):
     """
     Admins only!
+    Streams one order per line with `stream=true` or `Accept: application/x-ndjson`.
     """
     security.is_admin_or_raise
-    return orders.get_all(params)
+    if wants_ndjson(request, params.stream):
+        return NDJSONResponse(orders.stream_all(params))
+    return MongoJSONResponse(await orders.get_all(params))
 
 
 @orders_router.get("/{id}")
 async def get_order_by_id(
-    id: PydanticObjectId, security: SecurityDependency, orders: OrdersServiceDependency
+    id: PydanticObjectId,
+    request: Request,
+    security: SecurityDependency,
+    orders: OrdersServiceDependency,
 ):
     """
     Staff members and admins only!
+    Sent with `ETag` and `Last-Modified`: requests with a matching
+    `If-None-Match` or `If-Modified-Since` get 304 Not Modified.
     """
     security.is_staff_or_raise
-    return orders.get_one(id).model_dump()
+    if is_conditional(request) and (version := await orders.find_version(id)):
+        headers = version_headers(version, private=True)
+        if not_modified(request, headers):
+            return not_modified_response(headers)
+    order = await orders.get_one(id)
+    return MongoJSONResponse(order, headers=version_headers(order, private=True))
 
 
 @orders_router.get("/get_by_customer/{id}")
@@ -48,10 +77,10 @@ async def get_orders_by_customer_id(
     Authenticated customer only!
     """
     security.check_user_permission(id)
-    user_orders = orders.find_from_customer_id(id)
+    user_orders = await orders.find_from_customer_id(id)
 
     if len(user_orders) > 0:
-        return orders.find_from_customer_id(id)
+        return MongoJSONResponse(user_orders)
     else:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -67,7 +96,7 @@ async def get_orders_by_product_id(
     Staff members and admins only!
     """
     security.is_staff_or_raise
-    return orders.find_from_product_id(id)
+    return MongoJSONResponse(await orders.find_from_product_id(id))
 
 
 @orders_router.get("/get_by_staff/{id}")
@@ -78,7 +107,7 @@ async def get_orders_by_staff_id(
     Authenticated staff member only!
     """
     security.check_user_permission(id)
-    return orders.find_from_staff_id(id)
+    return MongoJSONResponse(await orders.find_from_staff_id(id))
 
 
 # Generate order from Cart with multiple products.
@@ -86,23 +115,30 @@ async def get_orders_by_staff_id(
 async def create_order(
     order: BaseOrder,
     orders: OrdersServiceDependency,
-    products: ProductsServiceDependency,
+    reservations: ReservationsServiceDependency,
+    loader: ProductLoaderDependency,
     security: SecurityDependency,
+    idempotency: IdempotencyDependency,
 ):
     """
     Customers only!
-    Generate order from Cart with multiple products.
+    Generate order from Cart with multiple products. Their stock is held
+    until `reserved_until`, then released if the order was not completed.
+    Retries with the same `Idempotency-Key` header get the first response.
     """
     security.is_customer_or_raise
 
-    result = orders.create_one(order, security.auth_user_id, products)
-    if result.acknowledged:
-        return {"message": "¡Orden creada!", "inserted_id": f"{result.inserted_id}"}
-    else:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Error inesperado actualizando órden",
-        )
+    async def create():
+        result = await orders.create_one(order, security.auth_user_id, reservations, loader)
+        if result.acknowledged:
+            return {"message": "¡Orden creada!", "inserted_id": f"{result.inserted_id}"}
+        else:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Error inesperado actualizando órden",
+            )
+
+    return await idempotency.run(create, status.HTTP_201_CREATED)
 
 
 @orders_router.put("/update/{id}")
@@ -111,29 +147,48 @@ async def update_order(
     order: BaseOrder,
     security: SecurityDependency,
     orders: OrdersServiceDependency,
+    reservations: ReservationsServiceDependency,
+    loader: ProductLoaderDependency,
 ):
     """
     Authenticated customer only!
     """
-    existing_order = orders.get_one(id)
+    existing_order = await orders.get_one(id)
     security.check_user_permission(existing_order.customer_id)
     if existing_order.status != OrderStatus.pending:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail=f"La orden {id} con status {existing_order.status} no puede ser modificada.",
         )
-    result: OrderFromDB = orders.update_one(id, order)
-    return {"message": "¡Orden modificada!", "order": result.model_dump()}
+    # The lines change first, and only while the order is pending, so a
+    # completion meanwhile is never overwritten nor held for again.
+    await orders.update_one(id, OrderUpdateData(products=order.products), loader, pending_only=True)
+    try:
+        reserved_until = await reservations.hold(id, order.products, loader)
+    except BaseException:
+        # The hold is unchanged, so are the lines.
+        with suppress(HTTPException):
+            await orders.update_one(
+                id, OrderUpdateData(products=existing_order.products), loader, pending_only=True
+            )
+        raise
+    result: OrderFromDB = await orders.update_one(
+        id, OrderUpdateData(reserved_until=reserved_until), pending_only=True
+    )
+    return {"message": "¡Orden modificada!", "order": result}
 
 
 @orders_router.put("/cancel/{id}", status_code=status.HTTP_200_OK)
 async def cancel_order(
-    id: PydanticObjectId, security: SecurityDependency, orders: OrdersServiceDependency
+    id: PydanticObjectId,
+    security: SecurityDependency,
+    orders: OrdersServiceDependency,
+    reservations: ReservationsServiceDependency,
 ):
     """
     Authenticated customer only!
     """
-    existing_order = orders.get_one(id)
+    existing_order = await orders.get_one(id)
     security.check_user_permission(existing_order.customer_id)
 
     if existing_order.status != OrderStatus.pending:
@@ -141,10 +196,12 @@ async def cancel_order(
             status_code=status.HTTP_409_CONFLICT,
             detail=f"La orden {id} con status {existing_order.status} no puede ser cancelada.",
         )
-    result: OrderFromDB = orders.update_one(
-        id, OrderUpdateData(status=OrderStatus.cancelled)
+    # Cancelled only if still pending, and only then is its stock given back.
+    result: OrderFromDB = await orders.update_one(
+        id, OrderUpdateData(status=OrderStatus.cancelled), pending_only=True
     )
-    return {"message": "Order cancelled!", "order": result.model_dump()}
+    await reservations.release(id)
+    return {"message": "Order cancelled!", "order": result}
 
 
 @orders_router.put("/complete/{id}", status_code=status.HTTP_200_OK)
@@ -153,43 +210,39 @@ async def complete_order(
     security: SecurityDependency,
     orders: OrdersServiceDependency,
     products: ProductsServiceDependency,
+    reservations: ReservationsServiceDependency,
+    loader: ProductLoaderDependency,
     users: UsersServiceDependency,
+    rollups: SalesRollupsServiceDependency,
     background_tasks: BackgroundTasks,
+    idempotency: IdempotencyDependency,
 ):
     """
     Authenticated customer only!
+    Retries with the same `Idempotency-Key` header get the first response.
+    The order is added to the sales rollups once the response is sent.
     """
-    existing_order = orders.get_one(id)
-    security.check_user_permission(existing_order.customer_id)
-    # Check order is not yet completed or cancelled, and user is active.
 
-    if existing_order.status != OrderStatus.pending:
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail=f"La orden {id} con status {existing_order.status} no puede ser completada.",
+    async def complete():
+        summary, user_from_db = await asyncio.gather(
+            orders.get_completion_summary(id), users.get_one(id=security.auth_user_id)
         )
-    user_from_db = users.get_one(id=security.auth_user_id)
-    if not user_from_db:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Usuario {security.auth_user_id} no encontrado. La cuenta no existe o fue suspendida.",
+        security.check_user_permission(summary["customer_id"])
+        if not user_from_db:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Usuario {security.auth_user_id} no encontrado. La cuenta no existe o fue suspendida.",
+            )
+        # Continue with order completion protocol.
+        completed_order, product_details = await orders.complete(id, summary, products, reservations, loader)
+        # Only runs for the request completing the order, never for its retries.
+        background_tasks.add_task(rollups.record_order, id)
+        await send_order_completion_email(
+            user=user_from_db,
+            order=completed_order,
+            product_details=product_details,
+            background_tasks=background_tasks,
         )
-    # Continue with order completion protocol.
-    products.check_and_update_stock(existing_order.products)
-    total_price = orders.calculate_total_price(id)
-    product_details = orders.get_order_products_with_details(id)
-    completed_order: OrderFromDB = orders.update_one(
-        id,
-        OrderUpdateData(
-            status=OrderStatus.completed,
-            products=product_details,
-            total_price=total_price[0] if len(total_price) > 0 else None,
-        ),
-    )
-    await send_order_completion_email(
-        user=user_from_db,
-        order=completed_order,
-        product_details=product_details,
-        background_tasks=background_tasks,
-    )
-    return {"message": "Orden completada existosamente.", "order": completed_order}
+        return {"message": "Orden completada existosamente.", "order": completed_order}
+
+    return await idempotency.run(complete)
@@ -1,13 +1,22 @@
 __all__ = ["products_router"]
 
-from fastapi import File, UploadFile, status, Response
+from fastapi import File, HTTPException, Request, UploadFile, status, Response
 from fastapi.responses import JSONResponse
 from fastapi.routing import APIRouter
 from pydantic_mongo import PydanticObjectId
+from typing import Literal
 import os
 import uuid
 
-from ..config import PUBLIC_HOST_URL
+from ..config import PUBLIC_HOST_URL, CATALOG_MAX_AGE_SECONDS
+from ..responses import (
+    MongoJSONResponse,
+    cached_response,
+    version_headers,
+    is_conditional,
+    not_modified,
+    not_modified_response,
+)
 from ..models import BaseProduct, ProductUpdateData, ProductDetails
 from ..services import ProductsServiceDependency, SecurityDependency
 from ..__common_deps import QueryParamsDependency, SearchEngineDependency
@@ -17,16 +26,34 @@ products_router = APIRouter(prefix="/products", tags=["Products"])
 
 @products_router.get("/")
 async def list_products(
-    products: ProductsServiceDependency, params: QueryParamsDependency
+    request: Request, products: ProductsServiceDependency, params: QueryParamsDependency
 ):
-    return products.get_all(params)
+    """
+    Pages are cached until the next product write and sent with an `ETag`:
+    requests with a matching `If-None-Match` get 304 Not Modified.
+    """
+    body, etag = await products.get_catalog_page(params)
+    return cached_response(request, body, etag, CATALOG_MAX_AGE_SECONDS)
+
+
+@products_router.get("/facets")
+async def list_products_with_facets(
+    request: Request, products: ProductsServiceDependency, params: QueryParamsDependency
+):
+    """
+    Same page as `/products/`, plus the total and the number of matching
+    products per category, size, price range and tag, for filter sidebars.
+    Cached and sent with an `ETag` like `/products/`.
+    """
+    body, etag = await products.get_catalog_page(params, facets=True)
+    return cached_response(request, body, etag, CATALOG_MAX_AGE_SECONDS)
 
 
 @products_router.get("/search")
 async def search_products(
     products: ProductsServiceDependency, search: SearchEngineDependency
 ):
-    return products.search(search)
+    return MongoJSONResponse(await products.search(search))
 
 
 @products_router.get("/autocomplete")
@@ -35,13 +62,24 @@ async def autocomplete_products(
     search: SearchEngineDependency,
     response: Response,
 ):
-    results = products.autocomplete(search=search, response=response)
+    results = await products.autocomplete(search=search, response=response)
     return {"results": results}
 
 
 @products_router.get("/{id}")
-async def get_product(id: PydanticObjectId, products: ProductsServiceDependency):
-    return products.get_one(id).model_dump()
+async def get_product(
+    id: PydanticObjectId, request: Request, products: ProductsServiceDependency
+):
+    """
+    Sent with `ETag` and `Last-Modified`: requests with a matching
+    `If-None-Match` or `If-Modified-Since` get 304 Not Modified.
+    """
+    if is_conditional(request) and (version := await products.find_version(id)):
+        headers = version_headers(version, "reserved")
+        if not_modified(request, headers):
+            return not_modified_response(headers)
+    product = await products.get_one(id)
+    return MongoJSONResponse(product, headers=version_headers(product, "reserved"))
 
 
 @products_router.get("/get_by_staff/{id}")
@@ -54,7 +92,7 @@ async def get_products_by_staff_id(
     Authenticaded staff members and admins only!
     """
     security.check_user_permission(id)
-    return products.find_from_staff_id(id)
+    return MongoJSONResponse(await products.find_from_staff_id(id))
 
 
 @products_router.post("/", status_code=status.HTTP_201_CREATED)
@@ -69,7 +107,7 @@ async def create_product(
     # Check current authenticated user is staff or admin
     security.is_staff_or_raise
 
-    result = products.create_one(product, PydanticObjectId(security.auth_user_id))
+    result = await products.create_one(product, PydanticObjectId(security.auth_user_id))
     if result.acknowledged:
         return {
             "message": "Product succesfully created",
@@ -82,6 +120,33 @@ async def create_product(
         )
 
 
+@products_router.post("/import", status_code=status.HTTP_200_OK)
+async def import_products(
+    products: ProductsServiceDependency,
+    security: SecurityDependency,
+    file: UploadFile = File(...),
+    format: Literal["csv", "ndjson"] | None = None,
+):
+    """
+    Staff members and admins only!
+    Bulk creates products from a CSV (with header row) or NDJSON file. The format
+    is taken from `format` or the file extension (.csv, .ndjson, .jsonl).
+    CSV list columns (tags, sizes, image_list) are "|" separated.
+    Returns how many products were inserted and the errors per row.
+    """
+    security.is_staff_or_raise
+    extension = os.path.splitext(file.filename or "")[1].lower()
+    format = format or {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson"}.get(extension)
+    if not format:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Formato de archivo no soportado. Usá CSV o NDJSON.",
+        )
+    return await products.import_many(
+        file.file, format, PydanticObjectId(security.auth_user_id)
+    )
+
+
 @products_router.patch("/{id}", status_code=status.HTTP_202_ACCEPTED)
 async def update_product(
     id: PydanticObjectId,
@@ -92,9 +157,9 @@ async def update_product(
     """
     Authenticaded staff members and admins only!
     """
-    existing_product = products.get_one(id)
+    existing_product = await products.get_one(id)
     security.check_user_permission(existing_product.staff_id)
-    result = products.update_one(id, product)
+    result = await products.update_one(id, product)
     return {"message": "Product succesfully updated", "product": result}
 
 
@@ -108,7 +173,7 @@ async def upload_product_image(
     """
     Authenticaded staff members and admins only!
     """
-    existing_product = products.get_one(id)
+    existing_product = await products.get_one(id, cached=False)
     security.check_user_permission(existing_product.staff_id)
     image_name = f"{uuid.uuid4()}.jpg"
     save_directory = os.path.join(
@@ -138,7 +203,7 @@ async def upload_product_image(
             "image_list": [*existing_product_details["image_list"], image_url],
         },
     )
-    return products.update_one(id=id, product=updated_product)
+    return await products.update_one(id=id, product=updated_product)
 
 
 @products_router.delete("/{id}", status_code=status.HTTP_202_ACCEPTED)
@@ -151,5 +216,5 @@ async def delete_product(
     Admins only!
     """
     security.check_user_permission(security.auth_user_id)
-    result = products.delete_one(id)
+    result = await products.delete_one(id)
     return {"message": "Product succesfully deleted", "product": result}
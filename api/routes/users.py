@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, status, File, UploadFile
+from fastapi import APIRouter, HTTPException, status, File, UploadFile, Request
 from fastapi.responses import JSONResponse
 from pydantic_mongo import PydanticObjectId
 import uuid
@@ -8,6 +8,15 @@ from ..config import PUBLIC_HOST_URL
 from ..models import UserUpdateData, AdminRegisterData, AdminUpdateData
 from ..services import UsersServiceDependency, AuthServiceDependency, SecurityDependency
 from ..__common_deps import QueryParamsDependency
+from ..responses import (
+    MongoJSONResponse,
+    NDJSONResponse,
+    wants_ndjson,
+    version_headers,
+    is_conditional,
+    not_modified,
+    not_modified_response,
+)
 from fastapi import Depends
 from fastapi import Depends
 from fastapi import Depends
@@ -17,27 +26,40 @@ users_router = APIRouter(prefix="/Users", tags=["Users"])
 
 @users_router.get("/")
 async def get_all_users(
+    request: Request,
     users: UsersServiceDependency,
     params: QueryParamsDependency,
     security: SecurityDependency,
 ):
     """
     Admins only!
+    Streams one user per line with `stream=true` or `Accept: application/x-ndjson`.
     """
     security.is_admin_or_raise
-    return users.get_all(params)
+    if wants_ndjson(request, params.stream):
+        return NDJSONResponse(users.stream_all(params))
+    return MongoJSONResponse(await users.get_all(params))
 
 
 @users_router.get("/{id}")
 async def get_one_user_by_id(
-    id: PydanticObjectId, users: UsersServiceDependency, security: SecurityDependency
+    id: PydanticObjectId,
+    request: Request,
+    users: UsersServiceDependency,
+    security: SecurityDependency,
 ):
     """
     Authenticated user only!
+    Sent with `ETag` and `Last-Modified`: requests with a matching
+    `If-None-Match` or `If-Modified-Since` get 304 Not Modified.
     """
     security.check_user_permission(id)
-    if user := users.get_one(id=id):
-        return user.model_dump()
+    if is_conditional(request) and (version := await users.find_version(id)):
+        headers = version_headers(version, private=True)
+        if not_modified(request, headers):
+            return not_modified_response(headers)
+    if user := await users.get_one(id=id):
+        return MongoJSONResponse(user, headers=version_headers(user, private=True))
     else:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=f"Usuario {id} no encontrado."
@@ -56,7 +78,7 @@ async def create_user(
     """
     security.is_admin_or_raise
     hash_password = auth.get_password_hash(user.password)
-    result = users.create_one(user, hash_password)
+    result = await users.create_one(user, hash_password)
     if result.acknowledged:
         return {
             "message": "New user succesfully created",
@@ -80,7 +102,7 @@ async def make_user_admin(
     Admins only!
     """
     security.is_admin_or_raise
-    return users.update_one(id=id, user=user)
+    return await users.update_one(id=id, user=user)
 
 
 @users_router.put("/{id}")
@@ -94,7 +116,7 @@ async def update_user(
     Authenticated user only!
     """
     security.check_user_permission(id)
-    return users.update_one(id=id, user=user)
+    return await users.update_one(id=id, user=user)
 
 
 @users_router.post("/upload_image/{id}")
@@ -120,7 +142,7 @@ async def upload_user_image(
     updated_user = UserUpdateData(
         image=f"{PUBLIC_HOST_URL}/static/images/users/{image_name}"
     )
-    return users.update_one(id=id, user=updated_user)
+    return await users.update_one(id=id, user=updated_user)
 
 
 @users_router.delete("/{id}")
@@ -131,5 +153,5 @@ async def delete_user(
     Admins only!
     """
     security.is_admin_or_raise
-    result = users.delete_one(id=id)
+    result = await users.delete_one(id=id)
     return {"message": "User succesfully deleted", "deleted user": result}
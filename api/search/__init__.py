@@ -0,0 +1,5 @@
+from .text import *
+from .index import *
+from .prefix import *
+from .facets import *
+from .products import *
@@ -0,0 +1,45 @@
+__all__ = ["FacetCounts"]
+
+from collections import Counter
+from typing import Any, Callable, Hashable, Iterable
+
+
+class FacetCounts:
+    """
+    Number of documents per value of some facets, kept current one document
+    at a time. Each facet is a function giving the values of a document
+    (repeated values count once).
+
+    The values counted for every document are kept, so re-adding or removing
+    it only updates the counters it was counted in.
+    """
+
+    def __init__(self, facets: dict[str, Callable[[dict], Iterable[Hashable]]]):
+        self.facets = facets
+        self.counts: dict[str, Counter] = {name: Counter() for name in facets}
+        self.values: dict[Hashable, tuple[tuple[Hashable, ...], ...]] = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, key: Hashable, document: dict):
+        self.remove(key)
+        values = tuple(tuple(dict.fromkeys(values_of(document))) for values_of in self.facets.values())
+        self.values[key] = values
+        for counter, facet_values in zip(self.counts.values(), values):
+            counter.update(facet_values)
+
+    def remove(self, key: Hashable):
+        if (values := self.values.pop(key, None)) is None:
+            return
+        for counter, facet_values in zip(self.counts.values(), values):
+            for value in facet_values:
+                counter[value] -= 1
+                if not counter[value]:
+                    del counter[value]
+
+    def most_common(self, limit: int | None = None) -> dict[str, list[tuple[Any, int]]]:
+        """
+        (value, count) of every facet, most common first.
+        """
+        return {name: counter.most_common(limit) for name, counter in self.counts.items()}
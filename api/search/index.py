@@ -0,0 +1,181 @@
+__all__ = ["InvertedIndex"]
+
+import heapq
+import math
+from collections import Counter, defaultdict
+from typing import Hashable
+
+from .text import tokenize, trigrams, edit_distance
+
+
+class InvertedIndex:
+    """
+    In-process full-text index with BM25 ranking.
+
+    Documents are dicts whose `fields` (strings or lists of strings) are
+    tokenized with accent and case folding; each occurrence counts the weight
+    of its field. Query words missing from the vocabulary are matched to the
+    closest indexed words (by trigrams, then edit distance), so typos still
+    find results.
+
+    Documents get a compact int id internally and can be re-added or removed
+    at any time, which keeps the index current without rebuilding it.
+    """
+
+    k1 = 1.2
+    b = 0.75
+    # Typos are matched to the indexed words with the fewest edits, up to
+    # `max_edits`, among the `fuzzy_candidates` most similar by trigrams. The
+    # `fuzzy_expansions` most frequent of them are searched.
+    max_edits = 2
+    fuzzy_threshold = 0.3
+    fuzzy_candidates = 30
+    fuzzy_expansions = 3
+    # Words in more than this share of the documents ("de", "para"...) only
+    # rerank the documents the rarer words of the query matched.
+    common_fraction = 0.2
+    # Length norms are recomputed once the average length drifts this much.
+    norm_tolerance = 0.05
+
+    def __init__(self, fields: dict[str, int]):
+        self.fields = fields
+        self.postings: dict[str, dict[int, int]] = {}
+        self.term_trigrams: dict[str, set[str]] = defaultdict(set)
+        self.doc_ids: dict[Hashable, int] = {}
+        self.keys: dict[int, Hashable] = {}
+        self.doc_terms: dict[int, tuple[str, ...]] = {}
+        self.doc_lengths: dict[int, int] = {}
+        self.total_length = 0
+        self.next_id = 0
+        # BM25 length normalization of each document, for `norm_average`.
+        self.norms: dict[int, float] = {}
+        self.norm_average = 0.0
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __contains__(self, key: Hashable):
+        return key in self.doc_ids
+
+    def term_frequencies(self, document: dict) -> Counter:
+        frequencies = Counter()
+        for field, weight in self.fields.items():
+            value = document.get(field)
+            if not value:
+                continue
+            for text in [value] if isinstance(value, str) else value:
+                for term in tokenize(str(text)):
+                    frequencies[term] += weight
+        return frequencies
+
+    def add(self, key: Hashable, document: dict):
+        """
+        Indexes the document, replacing what was indexed for `key` before.
+        """
+        self.remove(key)
+        frequencies = self.term_frequencies(document)
+        if not frequencies:
+            return
+        doc_id = self.doc_ids[key] = self.next_id
+        self.next_id += 1
+        self.keys[doc_id] = key
+        for term, frequency in frequencies.items():
+            if term not in self.postings:
+                self.postings[term] = {}
+                for trigram in trigrams(term):
+                    self.term_trigrams[trigram].add(term)
+            self.postings[term][doc_id] = frequency
+        self.doc_terms[doc_id] = tuple(frequencies)
+        self.doc_lengths[doc_id] = length = sum(frequencies.values())
+        self.total_length += length
+        if not self.norm_average:
+            self.norm_average = length
+        self.norms[doc_id] = self.norm(length)
+
+    def remove(self, key: Hashable):
+        if (doc_id := self.doc_ids.pop(key, None)) is None:
+            return
+        del self.keys[doc_id]
+        for term in self.doc_terms.pop(doc_id):
+            postings = self.postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self.postings[term]
+                for trigram in trigrams(term):
+                    self.term_trigrams[trigram].discard(term)
+                    if not self.term_trigrams[trigram]:
+                        del self.term_trigrams[trigram]
+        self.total_length -= self.doc_lengths.pop(doc_id)
+        del self.norms[doc_id]
+
+    def norm(self, length: int) -> float:
+        return self.k1 * (1 - self.b + self.b * length / self.norm_average)
+
+    def refresh_norms(self):
+        average_length = self.total_length / len(self.doc_ids)
+        if abs(average_length - self.norm_average) > self.norm_tolerance * self.norm_average:
+            self.norm_average = average_length
+            self.norms = {doc_id: self.norm(length) for doc_id, length in self.doc_lengths.items()}
+
+    def expand(self, term: str) -> list[tuple[str, float]]:
+        """
+        Indexed words to look up for a query word, with the weight of each.
+        """
+        if term in self.postings:
+            return [(term, 1.0)]
+        query_trigrams = trigrams(term)
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(self.term_trigrams.get(trigram, ()))
+        similar = []
+        for candidate, count in shared.items():
+            # A word of n letters has (at most) n padded trigrams.
+            similarity = count / (len(query_trigrams) + len(candidate) - count)
+            if similarity >= self.fuzzy_threshold:
+                similar.append((similarity, candidate))
+        # One edit for short words, as any short word is two edits from many others.
+        max_edits = 1 if len(term) <= 4 else self.max_edits
+        by_distance = defaultdict(list)
+        for _, candidate in heapq.nlargest(self.fuzzy_candidates, similar):
+            if (distance := edit_distance(term, candidate)) <= max_edits:
+                by_distance[distance].append(candidate)
+        if not by_distance:
+            return []
+        distance = min(by_distance)
+        closest = heapq.nlargest(self.fuzzy_expansions, by_distance[distance], key=lambda term: len(self.postings[term]))
+        return [(term, 1 / (1 + distance)) for term in closest]
+
+    def search(self, query: str, limit: int = 10) -> list[tuple[Hashable, float]]:
+        """
+        Keys of the best `limit` documents for the query, with their scores.
+        """
+        if not self.doc_ids:
+            return []
+        self.refresh_norms()
+        count = len(self.doc_ids)
+        terms = [
+            (indexed_term, weight, self.postings[indexed_term])
+            for term in dict.fromkeys(tokenize(query))
+            for indexed_term, weight in self.expand(term)
+        ]
+        scores: dict[int, float] = defaultdict(float)
+        norms = self.norms
+        # Rarest first, so common words find candidates to rerank.
+        for indexed_term, weight, postings in sorted(terms, key=lambda term: len(term[2])):
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            factor = weight * idf * (self.k1 + 1)
+            if scores and len(postings) > self.common_fraction * count:
+                matches = [(doc_id, postings[doc_id]) for doc_id in scores if doc_id in postings]
+            else:
+                matches = postings.items()
+            for doc_id, frequency in matches:
+                scores[doc_id] += factor * frequency / (frequency + norms[doc_id])
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [(self.keys[doc_id], score) for doc_id, score in best]
+
+    def stats(self) -> dict:
+        return {
+            "documents": len(self.doc_ids),
+            "terms": len(self.postings),
+            "postings": sum(len(postings) for postings in self.postings.values()),
+        }
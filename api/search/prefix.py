@@ -0,0 +1,122 @@
+__all__ = ["PrefixIndex"]
+
+import heapq
+from bisect import bisect_left, insort
+from typing import Hashable, Iterable, Iterator
+
+from .text import tokenize
+
+
+class PrefixIndex:
+    """
+    Autocomplete over one text field: a sorted list of the folded text from
+    every word on ("zapatilla running", "running"), so the documents whose
+    field has a word starting with the query are one binary search away.
+
+    Matches are ranked by the number given to `add` (sales, for products).
+    Ranking a short prefix means ranking a large part of the catalog, so the
+    top of prefixes matching more than `scan_limit` entries is kept, and
+    updated in place when a rank grows. The shortest prefixes, the slowest to
+    rank, are ranked ahead when the index is built.
+    """
+
+    scan_limit = 500
+    cached_top = 50
+    max_cached_prefixes = 4096
+    warm_length = 3
+
+    def __init__(self):
+        self.entries: list[tuple[str, Hashable]] = []
+        # key -> (text, rank, its entries)
+        self.values: dict[Hashable, tuple[str, int, tuple[str, ...]]] = {}
+        # Best ranked keys of the prefixes with many matches, best first.
+        self.top: dict[str, list[Hashable]] = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    @staticmethod
+    def suffixes(text: str) -> tuple[str, ...]:
+        words = tokenize(text)
+        return tuple(dict.fromkeys(" ".join(words[i:]) for i in range(len(words))))
+
+    def add(self, key: Hashable, text: str, rank: int = 0):
+        suffixes = self.suffixes(text)
+        previous = self.values.get(key)
+        if previous and previous[2] == suffixes:
+            # Same words, so only the ranking can change.
+            self.values[key] = (text, rank, suffixes)
+            self.rerank(key, suffixes, rank, previous[1])
+            return
+        self.remove(key)
+        for suffix in suffixes:
+            insort(self.entries, (suffix, key))
+        self.values[key] = (text, rank, suffixes)
+        self.forget(suffixes)
+
+    def add_many(self, items: Iterable[tuple[Hashable, str, int]]):
+        """
+        Loads new keys with a single sort, for building the index.
+        """
+        for key, text, rank in items:
+            suffixes = self.suffixes(text)
+            self.entries.extend((suffix, key) for suffix in suffixes)
+            self.values[key] = (text, rank, suffixes)
+        self.entries.sort()
+        self.top.clear()
+        for prefix in sorted({suffix[:end] for suffix, _ in self.entries for end in range(1, self.warm_length + 1)}):
+            self.search(prefix, self.cached_top)
+
+    def remove(self, key: Hashable):
+        if (value := self.values.pop(key, None)) is None:
+            return
+        for suffix in value[2]:
+            del self.entries[bisect_left(self.entries, (suffix, key))]
+        self.forget(value[2])
+
+    def cached_prefixes(self, suffixes: tuple[str, ...]) -> Iterator[str]:
+        for suffix in suffixes:
+            for end in range(1, len(suffix) + 1):
+                if suffix[:end] in self.top:
+                    yield suffix[:end]
+
+    def forget(self, suffixes: tuple[str, ...]):
+        for prefix in list(self.cached_prefixes(suffixes)):
+            self.top.pop(prefix, None)
+
+    def rerank(self, key: Hashable, suffixes: tuple[str, ...], rank: int, previous_rank: int):
+        for prefix in list(dict.fromkeys(self.cached_prefixes(suffixes))):
+            top = self.top[prefix]
+            if key in top and rank < previous_rank:
+                # What should replace it is not in the top.
+                del self.top[prefix]
+            elif key in top or rank > self.values[top[-1]][1]:
+                if key not in top:
+                    top.append(key)
+                top.sort(key=lambda key: self.values[key][1], reverse=True)
+                del top[self.cached_top :]
+
+    def search(self, query: str, limit: int = 10) -> list[tuple[Hashable, str]]:
+        """
+        Keys and texts of the best ranked `limit` matches of the query.
+        """
+        prefix = " ".join(tokenize(query))
+        if not prefix:
+            return []
+        start = bisect_left(self.entries, (prefix,))
+        # Folded text has no characters past this one.
+        end = bisect_left(self.entries, (prefix + "\uffff",), start)
+        if end - start > self.scan_limit and limit <= self.cached_top:
+            if (top := self.top.get(prefix)) is None:
+                if len(self.top) >= self.max_cached_prefixes:
+                    # Drops the oldest one.
+                    del self.top[next(iter(self.top))]
+                top = self.top[prefix] = self.rank(start, end, self.cached_top)
+            top = top[:limit]
+        else:
+            top = self.rank(start, end, limit)
+        return [(key, self.values[key][0]) for key in top]
+
+    def rank(self, start: int, end: int, limit: int) -> list[Hashable]:
+        keys = {key for _, key in self.entries[start:end]}
+        return heapq.nlargest(limit, keys, key=lambda key: self.values[key][1])
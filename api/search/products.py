@@ -0,0 +1,310 @@
+__all__ = [
+    "ProductSearchIndex",
+    "SearchUnavailable",
+    "AUTOCOMPLETE_FIELDS",
+    "FACET_PIPELINES",
+    "format_facets",
+    "product_search",
+]
+
+import asyncio
+import threading
+import time
+from bisect import bisect_right
+from typing import Any, Iterable
+
+from fastapi.concurrency import run_in_threadpool
+from pydantic_mongo import PydanticObjectId
+from pymongo.errors import PyMongoError
+
+from ..__cache import on_change
+from ..config import mongo, logger, PRICE_FACET_BOUNDARIES, TAG_FACET_LIMIT
+from .facets import FacetCounts
+from .index import InvertedIndex
+from .prefix import PrefixIndex
+
+# Indexed product fields and the weight of a word found in each.
+SEARCH_FIELDS = {"name": 3, "tags": 2, "category": 2, "description": 1}
+# Fields products can be autocompleted by, ranked by sales_count.
+AUTOCOMPLETE_FIELDS = ("name", "sku")
+PROJECTION = dict.fromkeys([*SEARCH_FIELDS, *AUTOCOMPLETE_FIELDS, "sales_count", "price", "details.sizes"], 1)
+# Top-level fields whose writes change the results; sales_count only ranks.
+INDEXED_FIELDS = frozenset(path.split(".")[0] for path in PROJECTION) - {"sales_count"}
+BUILD_BATCH_SIZE = 1000
+
+
+def price_range(price: Any) -> float:
+    """
+    Lower bound of the price range of a price, same as the `$bucket` of FACET_PIPELINES.
+    """
+    i = bisect_right(PRICE_FACET_BOUNDARIES, price) - 1 if isinstance(price, (int, float)) else -1
+    return PRICE_FACET_BOUNDARIES[i] if 0 <= i < len(PRICE_FACET_BOUNDARIES) - 1 else PRICE_FACET_BOUNDARIES[-1]
+
+
+# Values each product is counted in, for the facets of the whole catalog...
+FACETS = {
+    "category": lambda product: [product["category"]] if product.get("category") else [],
+    "sizes": lambda product: (product.get("details") or {}).get("sizes") or [],
+    "price": lambda product: [price_range(product.get("price"))],
+    "tags": lambda product: product.get("tags") or [],
+}
+
+
+COUNT_BY_VALUE = [{"$group": {"_id": "$value", "count": {"$sum": 1}}}, {"$sort": {"count": -1, "_id": 1}}]
+
+
+def distinct_values(path: str) -> list[dict]:
+    return [
+        {"$project": {"value": {"$setUnion": [{"$ifNull": [path, []]}]}}},
+        {"$unwind": "$value"},
+        *COUNT_BY_VALUE,
+    ]
+
+
+# ...and the same counts in a `$facet`, for filtered listings.
+FACET_PIPELINES = {
+    "category": [{"$match": {"category": {"$nin": [None, ""]}}}, {"$project": {"value": "$category"}}, *COUNT_BY_VALUE],
+    "sizes": distinct_values("$details.sizes"),
+    # Prices out of the ranges go to the last, open one.
+    "price": [
+        {"$bucket": {"groupBy": "$price", "boundaries": PRICE_FACET_BOUNDARIES, "default": PRICE_FACET_BOUNDARIES[-1]}}
+    ],
+    "tags": [*distinct_values("$tags"), {"$limit": TAG_FACET_LIMIT}],
+}
+
+
+def format_facets(counts: dict[str, list[tuple[Any, int]]]) -> dict[str, list[dict]]:
+    """
+    Facets as returned by the API from (value, count) pairs, most common
+    first. Every price range is listed, with `max` None for the last one.
+    """
+    listed = {
+        name: [
+            {"value": value, "count": count}
+            for value, count in sorted(counts[name], key=lambda item: (-item[1], str(item[0])))
+        ]
+        for name in ("category", "sizes", "tags")
+    }
+    listed["tags"] = listed["tags"][:TAG_FACET_LIMIT]
+    prices = dict(counts["price"])
+    listed["price"] = [
+        {"min": low, "max": high, "count": prices.get(low, 0)}
+        for low, high in zip(PRICE_FACET_BOUNDARIES, [*PRICE_FACET_BOUNDARIES[1:], None])
+    ]
+    return listed
+
+
+class SearchUnavailable(Exception):
+    pass
+
+
+class ProductSearchIndex:
+    """
+    Full-text and autocomplete indexes of the products collection kept in this
+    worker's memory, used by `/products/search` and `/products/autocomplete`
+    instead of (or when it fails, as fallback for) Atlas Search. Also counts
+    the products of the whole catalog per facet, for `/products/facets`.
+
+    Built in the background at startup. Writes through ProductsService, and
+    changes other workers make (seen through the change stream), are reindexed
+    shortly after in batches: the changed ids are fetched with one `$in` query.
+
+    Tokenizing and BM25 scoring take long enough to stall every request, so
+    the full-text index is only written and queried in the threadpool, one
+    thread at a time (see `lock`). A build fills new indexes, the autocomplete
+    ones in the threadpool too, and swaps them in when done.
+    """
+
+    def __init__(self):
+        self.index = InvertedIndex(SEARCH_FIELDS)
+        self.prefixes = {field: PrefixIndex() for field in AUTOCOMPLETE_FIELDS}
+        self.facets = FacetCounts(FACETS)
+        self.ready = False
+        self.builder: asyncio.Task | None = None
+        self.pending: set[PydanticObjectId] = set()
+        # Of those, the ones whose sales_count alone changed.
+        self.pending_ranks: set[PydanticObjectId] = set()
+        self.refreshing: asyncio.Task | None = None
+        self.build_seconds: float | None = None
+        self.refreshed = 0
+        # Bumped whenever the results may change, for caches of them.
+        self.version = 0
+        # Held by the threads writing or querying the full-text index.
+        self.lock = threading.Lock()
+
+    @property
+    def collection(self):
+        return mongo.db["products"]
+
+    @property
+    def building(self) -> bool:
+        return self.builder is not None and not self.builder.done()
+
+    def start(self) -> asyncio.Task:
+        """
+        Builds the index in the background, unless it is being built already.
+        """
+        if not self.building:
+            self.builder = asyncio.ensure_future(self.build())
+        return self.builder
+
+    async def build(self):
+        try:
+            start = time.perf_counter()
+            index = InvertedIndex(SEARCH_FIELDS)
+            prefixes = {field: PrefixIndex() for field in AUTOCOMPLETE_FIELDS}
+            facets = FacetCounts(FACETS)
+            completions = {field: [] for field in AUTOCOMPLETE_FIELDS}
+            batch = []
+            async for document in self.collection.find({}, PROJECTION).batch_size(BUILD_BATCH_SIZE):
+                batch.append(document)
+                facets.add(document["_id"], document)
+                for field in AUTOCOMPLETE_FIELDS:
+                    if document.get(field):
+                        completions[field].append((document["_id"], document[field], document.get("sales_count") or 0))
+                if len(batch) == BUILD_BATCH_SIZE:
+                    await run_in_threadpool(self.write_index, index, batch, [])
+                    batch = []
+            await run_in_threadpool(self.write_index, index, batch, [])
+            for field, prefix_index in prefixes.items():
+                # Sorting and ranking the whole catalog, not shared until the swap.
+                await run_in_threadpool(prefix_index.add_many, completions[field])
+            # Queries running meanwhile finish on the old index.
+            self.index, self.prefixes, self.facets = index, prefixes, facets
+            self.version += 1
+            self.build_seconds = round(time.perf_counter() - start, 3)
+            self.ready = True
+            logger.info(f"Product search index built: {len(index)} products in {self.build_seconds}s.")
+        except PyMongoError as e:
+            logger.error(f"Could not build the product search index: {e}")
+        # Writes made while building may be missing from what the cursor read.
+        if (self.pending or self.pending_ranks) and (self.refreshing is None or self.refreshing.done()):
+            self.refreshing = asyncio.ensure_future(self.refresh_pending())
+
+    def write_index(self, index: InvertedIndex, documents: list[dict], removed: list[PydanticObjectId]):
+        """
+        Reindexes the documents and drops the `removed` ids from the full-text
+        index. Blocking, run in the threadpool.
+        """
+        with self.lock:
+            for document in documents:
+                index.add(document["_id"], document)
+            for id in removed:
+                index.remove(id)
+            # Here rather than in the first query after the writes.
+            if index:
+                index.refresh_norms()
+
+    def write_counts(self, documents: list[dict], removed: list[PydanticObjectId]):
+        """
+        Same as `write_index` for the facets and autocomplete, quick enough
+        for the event loop.
+        """
+        for document in documents:
+            self.facets.add(document["_id"], document)
+            for field, prefix_index in self.prefixes.items():
+                if document.get(field):
+                    prefix_index.add(document["_id"], document[field], document.get("sales_count") or 0)
+                else:
+                    prefix_index.remove(document["_id"])
+        for id in removed:
+            self.facets.remove(id)
+            for prefix_index in self.prefixes.values():
+                prefix_index.remove(id)
+
+    def refresh(self, ids: Iterable[PydanticObjectId], ranks_only: bool = False):
+        """
+        Reindexes the products soon, or drops them if they no longer exist.
+        With `ranks_only`, for writes of sales_count (and other fields not
+        indexed), only their autocomplete ranking is updated.
+        """
+        ids = set(ids)
+        if ranks_only:
+            self.pending_ranks.update(ids - self.pending)
+        else:
+            self.pending.update(ids)
+            self.pending_ranks -= ids
+        idle = not self.building and (self.refreshing is None or self.refreshing.done())
+        if (self.pending or self.pending_ranks) and idle:
+            self.refreshing = asyncio.ensure_future(self.refresh_pending())
+
+    async def refresh_pending(self):
+        # Lets the writes of the current tick join this batch.
+        await asyncio.sleep(0)
+        while self.pending or self.pending_ranks:
+            ids, ranked = list(self.pending), list(self.pending_ranks)
+            self.pending.clear()
+            self.pending_ranks.clear()
+            try:
+                documents = await self.collection.find({"_id": {"$in": ids + ranked}}, PROJECTION).to_list(None)
+            except PyMongoError as e:
+                # Kept for the next refresh.
+                self.pending.update(ids)
+                self.pending_ranks.update(ranked)
+                logger.error(f"Could not refresh the product search index: {e}")
+                return
+            found = {document["_id"] for document in documents}
+            removed = [id for id in ids + ranked if id not in found]
+            pending = set(ids)
+            reindexed = [document for document in documents if document["_id"] in pending]
+            if reindexed or removed:
+                await run_in_threadpool(self.write_index, self.index, reindexed, removed)
+            self.write_counts(documents, removed)
+            self.refreshed += len(ids) + len(ranked)
+            # Autocomplete is not cached, so ranks alone keep the version.
+            if reindexed or removed:
+                self.version += 1
+
+    async def wait_ready(self):
+        if not self.ready:
+            # Waits for the first build, or retries it if it failed.
+            await asyncio.shield(self.start())
+            if not self.ready:
+                raise SearchUnavailable()
+
+    def rank(self, query: str, limit: int) -> list[PydanticObjectId]:
+        with self.lock:
+            return [id for id, _ in self.index.search(query, limit)]
+
+    async def search(self, query: str, limit: int = 10) -> list[PydanticObjectId]:
+        await self.wait_ready()
+        return await run_in_threadpool(self.rank, query, limit)
+
+    async def autocomplete(self, query: str, field: str, limit: int = 10) -> list[dict]:
+        """
+        Best selling products with a word of `field` starting with the query,
+        as `{"id": ..., field: ...}`. Never queries MongoDB once built.
+        """
+        await self.wait_ready()
+        return [{"id": str(id), field: text} for id, text in self.prefixes[field].search(query, limit)]
+
+    def snapshot(self) -> dict:
+        """
+        Blocking while the index is written, run in the threadpool.
+        """
+        with self.lock:
+            stats = self.index.stats()
+        return {
+            **stats,
+            "autocomplete": {field: len(prefix_index) for field, prefix_index in self.prefixes.items()},
+            "facets": {name: len(counter) for name, counter in self.facets.counts.items()},
+            "ready": self.ready,
+            "building": self.building,
+            "build_seconds": self.build_seconds,
+            "pending": len(self.pending) + len(self.pending_ranks),
+            "refreshed": self.refreshed,
+            "version": self.version,
+        }
+
+
+product_search = ProductSearchIndex()
+
+
+@on_change("products")
+def refresh_searched_product(id: PydanticObjectId | None, fields: frozenset[str] | None):
+    if id is None:
+        product_search.start()
+    elif fields is None or fields & INDEXED_FIELDS:
+        product_search.refresh([id])
+    elif "sales_count" in fields:
+        product_search.refresh([id], ranks_only=True)
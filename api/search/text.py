@@ -0,0 +1,42 @@
+__all__ = ["fold", "tokenize", "trigrams", "edit_distance"]
+
+import re
+import unicodedata
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def fold(text: str) -> str:
+    """
+    Lowercase text without accents, so "Camión" and "camion" are the same word.
+    """
+    if text.isascii():
+        return text.lower()
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_PATTERN.findall(fold(text))
+
+
+def trigrams(term: str) -> set[str]:
+    # Padded, so short words and the ends of words count as well.
+    padded = f"${term}$"
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a: str, b: str) -> int:
+    """
+    Insertions, deletions, substitutions and swaps of adjacent letters that
+    turn `a` into `b` (optimal string alignment distance).
+    """
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+    return current[-1]
@@ -1,5 +1,8 @@
 from .products import *
+from .reservations import *
 from .auth import *
+from .idempotency import *
 from .users import *
+from .analytics import *
 from .orders import *
 from .email import *
\ No newline at end of file
@@ -0,0 +1,178 @@
+__all__ = ["SalesRollupsServiceDependency", "SalesRollupsService"]
+
+from fastapi import Depends, HTTPException, status
+from pydantic_mongo import PydanticObjectId
+from pymongo.errors import PyMongoError
+from typing import Annotated, Any, Literal
+from datetime import date, datetime, timedelta
+
+from ..config import MongoCollection, Category, logger
+from ..models import OrderStatus
+
+RollupDimension = Literal["product", "staff", "category", "day"]
+MAX_DAYS = 366
+DAY_FORMAT = "%Y-%m-%d"
+
+
+class SalesRollupsService:
+    """
+    Revenue, units and number of orders of the completed orders, per product,
+    staff member (owner of the products), category and day, materialized in
+    `sales_rollups` with `$merge`.
+
+    Each rollup is one document with `_id: {"by": <dimension>, "key": <value>}`,
+    so reads fetch one document per product, staff member, category or day
+    instead of going through the orders. Completing an order adds its lines
+    (see `record_order`); `python -m scripts.backfill_sales_rollups` rebuilds
+    everything from the orders.
+    """
+
+    collection = MongoCollection("sales_rollups")
+    orders = MongoCollection("orders")
+
+    @staticmethod
+    def rollup_stages(match: dict) -> list[dict]:
+        """
+        Rollups of the orders matching `match`, as {_id, revenue, units, orders}.
+        """
+        # Completed orders are not modified anymore, so this is the completion date.
+        completed_at = {"$ifNull": ["$modified_at", "$created_at"]}
+        return [
+            {"$match": {**match, "status": OrderStatus.completed}},
+            {"$unwind": "$products"},
+            {
+                "$lookup": {
+                    "from": "products",
+                    "localField": "products.product_id",
+                    "foreignField": "_id",
+                    "pipeline": [{"$project": {"staff_id": 1, "category": 1}}],
+                    "as": "product",
+                }
+            },
+            {"$unwind": {"path": "$product", "preserveNullAndEmptyArrays": True}},
+            {
+                "$project": {
+                    "revenue": {"$multiply": ["$products.price", "$products.quantity"]},
+                    "units": "$products.quantity",
+                    "rollups": [
+                        {"by": "product", "key": "$products.product_id"},
+                        {"by": "staff", "key": "$product.staff_id"},
+                        {"by": "category", "key": "$product.category"},
+                        {"by": "day", "key": {"$dateToString": {"format": DAY_FORMAT, "date": completed_at}}},
+                    ],
+                }
+            },
+            {"$unwind": "$rollups"},
+            # Lines of deleted products have no staff member or category.
+            {"$match": {"rollups.key": {"$ne": None}}},
+            # Once per order and rollup first, so each order counts once.
+            {
+                "$group": {
+                    "_id": {"order": "$_id", "rollup": "$rollups"},
+                    "revenue": {"$sum": "$revenue"},
+                    "units": {"$sum": "$units"},
+                }
+            },
+            {
+                "$group": {
+                    "_id": "$_id.rollup",
+                    "revenue": {"$sum": "$revenue"},
+                    "units": {"$sum": "$units"},
+                    "orders": {"$sum": 1},
+                }
+            },
+        ]
+
+    @classmethod
+    async def record_order(cls, order_id: PydanticObjectId):
+        """
+        Adds a just completed order to the rollups. Failures are only logged:
+        the order is completed anyway, and the backfill adds it later.
+        """
+        now = datetime.now()
+        merge = {
+            "$merge": {
+                "into": cls.collection.name,
+                "on": "_id",
+                "whenMatched": [
+                    {
+                        "$set": {
+                            "revenue": {"$add": ["$revenue", "$$new.revenue"]},
+                            "units": {"$add": ["$units", "$$new.units"]},
+                            "orders": {"$add": ["$orders", "$$new.orders"]},
+                            "updated_at": "$$new.updated_at",
+                        }
+                    }
+                ],
+                "whenNotMatched": "insert",
+            }
+        }
+        pipeline = [*cls.rollup_stages({"_id": order_id}), {"$set": {"updated_at": now}}, merge]
+        try:
+            await cls.orders.aggregate(pipeline).to_list(length=None)
+        except PyMongoError as e:
+            logger.error(f"Could not add order {order_id} to the sales rollups: {e}")
+
+    @classmethod
+    async def backfill(cls) -> int:
+        """
+        Rebuilds every rollup from the completed orders and returns how many
+        there are. Rollups no order adds to anymore are deleted.
+        """
+        started_at = datetime.now()
+        pipeline = [
+            *cls.rollup_stages({}),
+            {"$set": {"updated_at": started_at}},
+            {"$merge": {"into": cls.collection.name, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+        ]
+        await cls.orders.aggregate(pipeline, allowDiskUse=True).to_list(length=None)
+        await cls.collection.delete_many({"updated_at": {"$lt": started_at}})
+        return await cls.collection.count_documents({})
+
+    @staticmethod
+    def format_rollup(by: RollupDimension, key: Any, document: dict | None) -> dict:
+        document = document or {}
+        return {
+            "by": by,
+            "key": key,
+            "revenue": document.get("revenue", 0),
+            "units": document.get("units", 0),
+            "orders": document.get("orders", 0),
+            "updated_at": document.get("updated_at"),
+        }
+
+    @classmethod
+    async def get_one(cls, by: RollupDimension, key: Any) -> dict:
+        """
+        Rollup of a product, staff member, category or day, zero if it had no sales.
+        """
+        document = await cls.collection.find_one({"_id": {"by": by, "key": key}})
+        return cls.format_rollup(by, key, document)
+
+    @classmethod
+    async def get_many(cls, by: RollupDimension, keys: list) -> list[dict]:
+        ids = [{"by": by, "key": key} for key in keys]
+        documents = {document["_id"]["key"]: document async for document in cls.collection.find({"_id": {"$in": ids}})}
+        return [cls.format_rollup(by, key, documents.get(key)) for key in keys]
+
+    @classmethod
+    async def get_categories(cls) -> list[dict]:
+        return await cls.get_many("category", [category.value for category in Category])
+
+    @classmethod
+    async def get_days(cls, start: date, end: date) -> list[dict]:
+        """
+        Rollups of every day from `start` to `end`, both included.
+        """
+        days = (end - start).days + 1
+        if days < 1 or days > MAX_DAYS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"El rango de fechas debe tener entre 1 y {MAX_DAYS} días.",
+            )
+        return await cls.get_many(
+            "day", [(start + timedelta(days=i)).strftime(DAY_FORMAT) for i in range(days)]
+        )
+
+
+SalesRollupsServiceDependency = Annotated[SalesRollupsService, Depends()]
@@ -0,0 +1,160 @@
+__all__ = ["IdempotencyDependency", "IdempotencyService"]
+
+import asyncio
+import hashlib
+from bson import ObjectId
+from fastapi import Depends, Header, HTTPException, Request, Response, status
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from typing import Annotated, Any, Awaitable, Callable
+from datetime import datetime
+
+from ..__cache import TTLCache
+from ..config import MongoCollection, IDEMPOTENCY_TTL_SECONDS, logger
+from ..responses import json_dumps
+from .auth import SecurityDependency
+
+# Tries at storing a response whose side effects already ran, and the pause
+# before the next one (doubled each time).
+STORE_ATTEMPTS = 3
+STORE_RETRY_SECONDS = 0.2
+REPLAYED_HEADER = "Idempotent-Replayed"
+# Client errors that depend on the current state (out of stock, a hold changed
+# meanwhile...), so a retry may succeed: they free the key instead of being stored.
+RETRYABLE_STATUS_CODES = frozenset({status.HTTP_409_CONFLICT})
+
+response_cache = TTLCache(maxsize=4096, ttl=min(IDEMPOTENCY_TTL_SECONDS, 600))
+# Requests running in this worker, by key, so duplicates wait for them.
+in_flight: dict[str, asyncio.Future] = {}
+
+
+class IdempotencyService:
+    """
+    Makes a route safe to retry with an `Idempotency-Key` header.
+
+    The first response for a key (per user, method and path) is stored in the
+    `idempotency_keys` collection, with an in-process cache in front, and
+    replayed for every retry. Duplicates arriving while the first request runs
+    wait for it in this worker, or get 409 from any other one. Without the
+    header the route runs as usual.
+
+    A key is only freed by its own request failing. A lock left by a worker
+    that died, or whose response could not be stored, may hide side effects
+    already made, so it keeps answering 409 until the key expires
+    (IDEMPOTENCY_TTL_SECONDS).
+    """
+
+    collection = MongoCollection("idempotency_keys")
+
+    def __init__(
+        self,
+        request: Request,
+        security: SecurityDependency,
+        idempotency_key: Annotated[str | None, Header(max_length=255)] = None,
+    ):
+        self.request = request
+        self.key = (
+            f"{security.auth_user_id}:{request.method}:{request.url.path}:{idempotency_key}"
+            if idempotency_key
+            else None
+        )
+
+    async def run(
+        self, produce: Callable[[], Awaitable[Any]], status_code: int = status.HTTP_200_OK
+    ) -> Response:
+        """
+        Returns the stored response for the key, or awaits `produce()` and
+        stores its JSON rendering. 4xx errors are stored too, since retrying
+        would fail the same way; other errors, and the RETRYABLE_STATUS_CODES
+        ones, free the key for a retry.
+        """
+        if self.key is None:
+            return Response(json_dumps(await produce()), status_code, media_type="application/json")
+        fingerprint = hashlib.sha256(await self.request.body()).hexdigest()
+        while (running := in_flight.get(self.key)) is not None:
+            await asyncio.shield(running)
+        if stored := await self.find_stored():
+            return self.replay(stored, fingerprint)
+
+        in_flight[self.key] = asyncio.get_running_loop().create_future()
+        try:
+            lock_id = ObjectId()
+            # Outside the cleanup below: a 409 here means the key is another request's.
+            if stored := await self.lock(fingerprint, lock_id):
+                return self.replay(stored, fingerprint)
+            try:
+                try:
+                    body, status_code = json_dumps(await produce()), status_code
+                except HTTPException as e:
+                    if e.status_code >= 500 or e.status_code in RETRYABLE_STATUS_CODES:
+                        raise
+                    body, status_code = json_dumps({"detail": e.detail}), e.status_code
+            except BaseException:
+                await self.collection.delete_one(
+                    {"_id": self.key, "lock_id": lock_id, "status_code": {"$exists": False}}
+                )
+                raise
+            await self.store(lock_id, {"fingerprint": fingerprint, "status_code": status_code, "body": body})
+            return Response(body, status_code, media_type="application/json")
+        finally:
+            in_flight.pop(self.key).set_result(None)
+
+    async def find_stored(self) -> dict | None:
+        if stored := response_cache.get(self.key):
+            return stored
+        stored = await self.collection.find_one({"_id": self.key, "status_code": {"$exists": True}})
+        if stored:
+            response_cache.set(self.key, stored)
+        return stored
+
+    async def store(self, lock_id: ObjectId, stored: dict):
+        """
+        Stores the response of this request's lock, retrying: the side effects
+        ran, so the key must not be freed. If it still fails, the lock stays
+        (see the class docstring) and this worker replays from its cache.
+        """
+        response_cache.set(self.key, stored)
+        for attempt in range(STORE_ATTEMPTS):
+            try:
+                await self.collection.update_one({"_id": self.key, "lock_id": lock_id}, {"$set": stored})
+                return
+            except PyMongoError as e:
+                if attempt + 1 == STORE_ATTEMPTS:
+                    logger.error(f"Could not store the response for Idempotency-Key {self.key}, kept locked: {e}")
+                    return
+                await asyncio.sleep(STORE_RETRY_SECONDS * 2**attempt)
+
+    async def lock(self, fingerprint: str, lock_id: ObjectId) -> dict | None:
+        """
+        Claims the key for this request, as `lock_id`. Returns the stored
+        response instead if another request finished it meanwhile.
+        """
+        try:
+            await self.collection.insert_one(
+                {"_id": self.key, "lock_id": lock_id, "fingerprint": fingerprint, "created_at": datetime.now()}
+            )
+            return None
+        except DuplicateKeyError:
+            pass
+        if stored := await self.find_stored():
+            return stored
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Ya hay una solicitud en curso con esta Idempotency-Key.",
+        )
+
+    @staticmethod
+    def replay(stored: dict, fingerprint: str) -> Response:
+        if stored["fingerprint"] != fingerprint:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Esta Idempotency-Key ya se usó con otra solicitud.",
+            )
+        return Response(
+            stored["body"],
+            stored["status_code"],
+            media_type="application/json",
+            headers={REPLAYED_HEADER: "true"},
+        )
+
+
+IdempotencyDependency = Annotated[IdempotencyService, Depends()]
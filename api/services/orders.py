@@ -1,43 +1,74 @@
 __all__ = ["OrdersServiceDependency", "OrdersService"]
 
+import asyncio
 from fastapi import Depends, HTTPException, status
+from motor.motor_asyncio import AsyncIOMotorClientSession
 from pydantic_mongo import PydanticObjectId
 from pydantic_core import ValidationError
-from typing import Annotated
+from typing import Annotated, AsyncIterator
 from datetime import datetime
 
 from ..__common_deps import QueryParamsDependency
-from ..services import ProductsServiceDependency
-from ..config import COLLECTIONS, db
+from ..responses import json_dumps
+from ..services import ProductsServiceDependency, ProductLoader, ReservationsServiceDependency
+from ..config import MongoCollection, mongo
 from ..models import (
     BaseOrder,
     OrderStatus,
     OrderFromDB,
     OrderUpdateData,
     CompletedOrderProduct,
+    validate_batch,
 )
 
 
 class OrdersService:
-    assert (collection_name := "orders") in COLLECTIONS
-    collection = db[collection_name]
+    collection = MongoCollection("orders")
 
     @classmethod
-    def get_all(cls, params: QueryParamsDependency):
+    async def get_all(cls, params: QueryParamsDependency):
         response_dict = {"orders": [], "errors": []}
         results = params.query_collection(cls.collection)
-        for order in results:
-            try:
-                response_dict["orders"].append(
-                    OrderFromDB.model_validate(order).model_dump()
-                )
-            except ValidationError as e:
-                response_dict["errors"].append(f"Validation error: {e}")
+        # Runs alongside the page query.
+        total = (
+            asyncio.create_task(params.count_documents(cls.collection))
+            if params.count
+            else None
+        )
+        documents = await results.to_list(length=None)
+        response_dict["orders"], response_dict["errors"] = validate_batch(
+            OrderFromDB, documents
+        )
+        if params.pagination == "cursor":
+            response_dict["next_cursor"] = params.next_cursor(
+                documents[-1] if documents else None, len(documents)
+            )
+        if total:
+            response_dict["total"] = await total
         return response_dict
 
     @classmethod
-    def get_one(cls, id: PydanticObjectId):
-        if order_from_db := cls.collection.find_one({"_id": id}):
+    def stream_all(cls, params: QueryParamsDependency) -> AsyncIterator[bytes]:
+        """
+        Yields the listing as NDJSON lines while the cursor is iterated,
+        so memory does not grow with the number of documents.
+        The cursor is built right away: an invalid filter is a 400, not a
+        response that breaks after it started.
+        """
+        cursor = params.stream_collection(cls.collection)
+
+        async def lines():
+            async for document in cursor:
+                try:
+                    yield json_dumps(OrderFromDB.model_validate(document)) + b"\n"
+                except ValidationError as e:
+                    yield json_dumps({"error": f"Validation error: {e}"}) + b"\n"
+
+        return lines()
+
+    @classmethod
+    async def get_one(cls, id: PydanticObjectId):
+        if order_from_db := await cls.collection.find_one({"_id": id}):
             try:
                 return OrderFromDB.model_validate(order_from_db)
             except ValidationError as e:
@@ -52,17 +83,21 @@ class OrdersService:
             )
 
     @classmethod
-    def find_from_customer_id(cls, id: PydanticObjectId):
+    async def find_version(cls, id: PydanticObjectId) -> dict | None:
+        return await cls.collection.find_one({"_id": id}, {"created_at": 1, "modified_at": 1})
+
+    @classmethod
+    async def find_from_customer_id(cls, id: PydanticObjectId):
         cursor = cls.collection.find({"customer_id": id})
-        return [OrderFromDB.model_validate(order) for order in cursor]
+        return [OrderFromDB.model_validate(order) async for order in cursor]
 
     @classmethod
-    def find_from_product_id(cls, id: PydanticObjectId):
+    async def find_from_product_id(cls, id: PydanticObjectId):
         cursor = cls.collection.find({"products.product_id": id})
-        return [OrderFromDB.model_validate(order) for order in cursor]
+        return [OrderFromDB.model_validate(order) async for order in cursor]
 
     @classmethod
-    def find_from_staff_id(cls, staff_id: PydanticObjectId):
+    async def find_from_staff_id(cls, staff_id: PydanticObjectId):
         lookup = {
             "$lookup": {
                 "from": "products",
@@ -114,17 +149,21 @@ class OrdersService:
             }
         }
         cursor = cls.collection.aggregate([lookup, matches, projection])
-        return [OrderFromDB.model_validate(order).model_dump() for order in cursor]
+        order_list, _ = validate_batch(OrderFromDB, await cursor.to_list(length=None))
+        return order_list
 
     @classmethod
-    def create_one(
+    async def create_one(
         cls,
         order: BaseOrder,
         customer_id: PydanticObjectId,
-        products: ProductsServiceDependency,
+        reservations: ReservationsServiceDependency,
+        loader: ProductLoader | None = None,
     ):
-        products.check_stock(order.products)
+        order_id = PydanticObjectId()
+        reserved_until = await reservations.hold(order_id, order.products, loader)
         new_order: dict = {
+            "_id": order_id,
             "customer_id": PydanticObjectId(customer_id),
             "products": [
                 {
@@ -134,32 +173,54 @@ class OrdersService:
                 for product in order.products
             ],
             "status": OrderStatus.pending,
+            "reserved_until": reserved_until,
             "created_at": datetime.now(),
         }
-        return cls.collection.insert_one(new_order)
+        try:
+            return await cls.collection.insert_one(new_order)
+        except Exception:
+            await reservations.release(order_id)
+            raise
 
     @classmethod
-    def update_one(cls, order_id: PydanticObjectId, order: OrderUpdateData):
+    async def update_one(
+        cls,
+        order_id: PydanticObjectId,
+        order: OrderUpdateData,
+        loader: ProductLoader | None = None,
+        pending_only: bool = False,
+    ):
+        """
+        With `pending_only`, raises 409 unless the order is still pending, so a
+        completion or cancellation that got there first is never overwritten.
+        """
         modified_order: dict = order.model_dump(exclude_unset=True, exclude_none=True)
-        modified_order.update(
-            products=[
-                {
-                    "product_id": PydanticObjectId(product.product_id),
-                    "name": product.name,
-                    "price": product.price,
-                    "image": product.image,
-                    "quantity": product.quantity,
-                }
-                for product in order.products
-            ],
-            modified_at=datetime.now(),
-        )
-        if document := cls.collection.find_one_and_update(
-            {"_id": order_id},
+        if order.products is not None:
+            # Line details always come from the current products.
+            loader = loader or ProductLoader()
+            await loader.load_many(product.product_id for product in order.products)
+            order_products = []
+            for product in order.products:
+                product_from_db = await loader.get(product.product_id)
+                order_products.append(
+                    {
+                        "product_id": PydanticObjectId(product.product_id),
+                        "name": product_from_db.name,
+                        "price": product_from_db.price,
+                        "image": product_from_db.image,
+                        "quantity": product.quantity,
+                    }
+                )
+            modified_order["products"] = order_products
+        modified_order["modified_at"] = datetime.now()
+        if document := await cls.collection.find_one_and_update(
+            {"_id": order_id, **({"status": OrderStatus.pending} if pending_only else {})},
             {"$set": modified_order},
             return_document=True,
         ):
             return OrderFromDB.model_validate(document)
+        elif pending_only:
+            raise cls.changed_order(order_id)
         else:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -167,9 +228,14 @@ class OrdersService:
             )
 
     @classmethod
-    def calculate_total_price(cls, order_id: PydanticObjectId) -> list:
+    async def get_completion_summary(cls, order_id: PydanticObjectId) -> dict:
+        """
+        Order with its lines priced from the current products, and their total,
+        in one aggregation.
+        """
         match = {"$match": {"_id": order_id}}
-        unwind = {"$unwind": "$products"}
+        # Orders without lines and lines whose product no longer exists are kept.
+        unwind = {"$unwind": {"path": "$products", "preserveNullAndEmptyArrays": True}}
         lookup = {
             "$lookup": {
                 "from": "products",
@@ -178,45 +244,158 @@ class OrdersService:
                 "as": "productDetails",
             }
         }
-        prod_unwind = {"$unwind": "$productDetails"}
-        set = {
-            "$set": {
-                "productTotal": {
-                    "$multiply": ["$products.quantity", "$productDetails.price"]
-                }
+        prod_unwind = {"$unwind": {"path": "$productDetails", "preserveNullAndEmptyArrays": True}}
+        group = {
+            "$group": {
+                "_id": "$_id",
+                "customer_id": {"$first": "$customer_id"},
+                "status": {"$first": "$status"},
+                "products": {
+                    "$push": {
+                        "product_id": "$products.product_id",
+                        "quantity": "$products.quantity",
+                        "name": "$productDetails.name",
+                        "price": "$productDetails.price",
+                        "image": "$productDetails.image",
+                    }
+                },
+                "total_price": {
+                    "$sum": {"$multiply": ["$products.quantity", "$productDetails.price"]}
+                },
             }
         }
-        group = {"$group": {"_id": "$_id", "totalPrice": {"$sum": "$productTotal"}}}
-        cursor = cls.collection.aggregate(
-            [match, unwind, lookup, prod_unwind, set, group]
-        )
-        return [doc["totalPrice"] for doc in cursor]
+        cursor = cls.collection.aggregate([match, unwind, lookup, prod_unwind, group])
+        summaries = await cursor.to_list(length=1)
+        if not summaries:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Orden {order_id} no encontrada.",
+            )
+        summary = summaries[0]
+        summary["products"] = [line for line in summary["products"] if "product_id" in line]
+        for line in summary["products"]:
+            if "price" not in line:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"Producto {line['product_id']} no encontrado.",
+                )
+        return summary
 
     @classmethod
-    def get_order_products_with_details(cls, order_id: PydanticObjectId) -> list:
-        match = {"$match": {"_id": order_id}}
-        unwind = {"$unwind": "$products"}
-        lookup = {
-            "$lookup": {
-                "from": "products",
-                "localField": "products.product_id",
-                "foreignField": "_id",
-                "as": "productDetails",
-            }
-        }
-        prod_unwind = {"$unwind": "$productDetails"}
-        project = {
-            "$project": {
-                "_id": 0,
-                "product_id": "$products.product_id",
-                "quantity": "$products.quantity",
-                "name": "$productDetails.name",
-                "price": "$productDetails.price",
-                "image": "$productDetails.image",
-            }
-        }
-        cursor = cls.collection.aggregate([match, unwind, lookup, prod_unwind, project])
-        return [CompletedOrderProduct.model_validate(doc) for doc in cursor]
+    async def complete(
+        cls,
+        order_id: PydanticObjectId,
+        summary: dict,
+        products: ProductsServiceDependency,
+        reservations: ReservationsServiceDependency,
+        loader: ProductLoader | None = None,
+    ) -> tuple[OrderFromDB, list[CompletedOrderProduct]]:
+        """
+        Completes a pending order from its `get_completion_summary`: takes the
+        stock, consuming the order's hold, and stores the priced lines and total.
+        If the hold expired, the stock is taken from what is still available.
+
+        The status only changes if the order is still pending, so two concurrent
+        completions cannot both succeed. All three writes run in one transaction
+        when the deployment supports them; otherwise any failure puts the stock
+        and the hold back (see `complete_in_steps`).
+        """
+        if summary["status"] != OrderStatus.pending:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"La orden {order_id} con status {summary['status']} no puede ser completada.",
+            )
+        product_details = [CompletedOrderProduct.model_validate(line) for line in summary["products"]]
+        if not await mongo.transactions_supported():
+            document = await cls.complete_in_steps(order_id, summary, product_details, products, reservations, loader)
+            return OrderFromDB.model_validate(document), product_details
+        async with await mongo.client.start_session() as session:
+            document = await session.with_transaction(
+                lambda session: cls.complete_in_transaction(
+                    order_id, summary, product_details, products, reservations, loader, session
+                )
+            )
+        return OrderFromDB.model_validate(document), product_details
 
+    @classmethod
+    async def complete_in_transaction(
+        cls,
+        order_id: PydanticObjectId,
+        summary: dict,
+        product_details: list[CompletedOrderProduct],
+        products: ProductsServiceDependency,
+        reservations: ReservationsServiceDependency,
+        loader: ProductLoader | None,
+        session: AsyncIOMotorClientSession,
+    ) -> dict:
+        """
+        `complete` with the hold, the stock and the order written in one
+        transaction, aborted by any exception.
+        """
+        held = await reservations.consume(order_id, session)
+        await products.check_and_update_stock(product_details, loader, held, session)
+        if (document := await cls.mark_completed(order_id, summary, session)) is None:
+            raise cls.changed_order(order_id)
+        return document
+
+    @classmethod
+    async def complete_in_steps(
+        cls,
+        order_id: PydanticObjectId,
+        summary: dict,
+        product_details: list[CompletedOrderProduct],
+        products: ProductsServiceDependency,
+        reservations: ReservationsServiceDependency,
+        loader: ProductLoader | None,
+    ) -> dict:
+        """
+        `complete` without transactions. Until the order is marked completed,
+        any error (or cancellation) gives the stock back and restores the hold,
+        so the units are neither lost nor taken twice by a retry.
+        """
+        quantities = products.merge_quantities(product_details)
+        held = await reservations.consume(order_id)
+        taken = False
+        try:
+            await products.check_and_update_stock(product_details, loader, held)
+            taken = True
+            document = await cls.mark_completed(order_id, summary)
+        except BaseException:
+            if taken:
+                await products.release_stock(quantities, held)
+            if held:
+                await reservations.restore(order_id)
+            raise
+        if document is None:
+            # Completed or cancelled meanwhile, the hold is over anyway.
+            await products.release_stock(quantities)
+            raise cls.changed_order(order_id)
+        return document
+
+    @classmethod
+    async def mark_completed(
+        cls, order_id: PydanticObjectId, summary: dict, session: AsyncIOMotorClientSession | None = None
+    ) -> dict | None:
+        return await cls.collection.find_one_and_update(
+            {"_id": order_id, "status": OrderStatus.pending},
+            {
+                "$set": {
+                    "status": OrderStatus.completed,
+                    "products": summary["products"],
+                    "total_price": summary["total_price"],
+                    "modified_at": datetime.now(),
+                },
+                "$unset": {"reserved_until": ""},
+            },
+            return_document=True,
+            session=session,
+        )
+
+    @staticmethod
+    def changed_order(order_id: PydanticObjectId) -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"La orden {order_id} fue modificada por otra operación.",
+        )
 
 OrdersServiceDependency = Annotated[OrdersService, Depends()]
@@ -1,22 +1,194 @@
-__all__ = ["ProductsServiceDependency", "ProductsService"]
+__all__ = [
+    "ProductsServiceDependency",
+    "ProductsService",
+    "ProductLoaderDependency",
+    "ProductLoader",
+]
 
+import asyncio
+import csv
+import io
+import json
+from itertools import islice
 from fastapi import Depends, HTTPException, status, Response
+from fastapi.concurrency import run_in_threadpool
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClientSession
 from pydantic_mongo import PydanticObjectId
 from pydantic_core import ValidationError
-from typing import Annotated
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from typing import Annotated, Any, Awaitable, BinaryIO, Callable, Iterable, Iterator, Literal
 from datetime import datetime
 
-from ..config import COLLECTIONS, db
+from ..__cache import TTLCache, on_change
+from ..config import (
+    MongoCollection,
+    mongo,
+    PRODUCT_CACHE_SIZE,
+    PRODUCT_CACHE_TTL_SECONDS,
+    CATALOG_CACHE_SIZE,
+    CATALOG_CACHE_TTL_SECONDS,
+    SEARCH_BACKEND,
+    SEARCH_CACHE_SIZE,
+    SEARCH_CACHE_TTL_SECONDS,
+    logger,
+)
 from ..models import (
     BaseProduct,
     ProductCreateData,
     ProductUpdateData,
     ProductFromDB,
     OrderProduct,
+    validate_batch,
 )
+from ..models.batch import list_adapter
+from ..responses import json_dumps, make_etag
+from ..search import product_search, SearchUnavailable, FACET_PIPELINES, format_facets
 from ..__common_deps import QueryParamsDependency, SearchEngineDependency
 
 
+# Fields stock holds write. Listing pages showing a `reserved` (and so an
+# `available_stock`) up to CATALOG_CACHE_TTL_SECONDS old is cheaper than
+# evicting every page on each hold, so writes of only these keep the pages.
+HOLD_FIELDS = frozenset({"reserved", "pending_holds", "modified_at"})
+# Fields orders write. Same for search results, up to SEARCH_CACHE_TTL_SECONDS
+# old, and writes of only these keep them.
+STOCK_FIELDS = HOLD_FIELDS | {"stock", "sales_count"}
+# What the ETag and Last-Modified of a product come from. Every write of its
+# stock or reserved units moves modified_at too.
+VERSION_PROJECTION = {"created_at": 1, "modified_at": 1, "reserved": 1}
+
+
+class OutOfStock(Exception):
+    pass
+
+
+IMPORT_CHUNK_SIZE = 1000
+MAX_REPORTED_IMPORT_ERRORS = 1000
+# CSV columns holding "|" separated lists, and where they go in the product.
+CSV_LIST_COLUMNS = {"tags": ("tags",), "sizes": ("details", "sizes"), "image_list": ("details", "image_list")}
+CSV_DETAIL_COLUMNS = {"long_description"}
+
+
+def csv_row_to_product(row: dict) -> dict:
+    """
+    Maps a flat CSV row to the BaseProduct shape. Empty cells are left out,
+    list columns (tags, sizes, image_list) are "|" separated.
+    """
+    product: dict = {}
+    for column, value in row.items():
+        if column is None or value is None or not value.strip():
+            continue
+        value = value.strip()
+        if column in CSV_LIST_COLUMNS:
+            *parents, key = CSV_LIST_COLUMNS[column]
+            target = product.setdefault(parents[0], {}) if parents else product
+            target[key] = [item.strip() for item in value.split("|") if item.strip()]
+        elif column in CSV_DETAIL_COLUMNS:
+            product.setdefault("details", {})[column] = value
+        else:
+            product[column] = value
+    return product
+
+
+def read_import_rows(file: BinaryIO, format: Literal["csv", "ndjson"]) -> Iterator[dict | str]:
+    """
+    Yields one product dict per row (or an error message for unparseable rows),
+    reading the file lazily.
+    """
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    if format == "csv":
+        for row in csv.DictReader(text):
+            yield csv_row_to_product(row)
+        return
+    for line in text:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield f"JSON inválido: {e}"
+            continue
+        yield row if isinstance(row, dict) else "Cada línea debe ser un objeto JSON"
+
+
+class ProductLoader:
+    """
+    Request-scoped batching loader for products, in the style of DataLoader.
+
+    Ids requested while the rest of the request is still running are fetched
+    together with one `$in` query, and the results are memoized until the
+    request ends. Inject it with `ProductLoaderDependency` so every service
+    used by a route shares the same instance.
+    """
+
+    collection = MongoCollection("products")
+
+    def __init__(self):
+        self.queries = 0
+        self._futures: dict[PydanticObjectId, asyncio.Future] = {}
+        self._pending: list[PydanticObjectId] = []
+        self._dispatch: asyncio.Task | None = None
+
+    def load(self, id: PydanticObjectId) -> "asyncio.Future[ProductFromDB | None]":
+        future = self._futures.get(id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._futures[id] = future
+            self._pending.append(id)
+            if self._dispatch is None:
+                self._dispatch = asyncio.create_task(self._fetch_pending())
+        return future
+
+    async def load_many(self, ids: Iterable[PydanticObjectId]) -> list[ProductFromDB | None]:
+        return list(await asyncio.gather(*(self.load(id) for id in ids)))
+
+    async def get(self, id: PydanticObjectId) -> ProductFromDB:
+        if product := await self.load(id):
+            return product
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Producto {id} no encontrado",
+        )
+
+    def clear(self, ids: Iterable[PydanticObjectId]):
+        """
+        Forgets products after writing them, so the next load reads them again.
+        """
+        for id in ids:
+            if (future := self._futures.get(id)) is not None and future.done():
+                del self._futures[id]
+
+    async def _fetch_pending(self):
+        # Gives the other coroutines of the request one turn to queue their ids.
+        await asyncio.sleep(0)
+        ids, self._pending, self._dispatch = self._pending, [], None
+        futures = [self._futures[id] for id in ids]
+        try:
+            cursor = self.collection.find({"_id": {"$in": ids}})
+            documents = {document["_id"]: document async for document in cursor}
+            self.queries += 1
+        except Exception as e:
+            for id, future in zip(ids, futures):
+                del self._futures[id]
+                future.set_exception(e)
+            return
+        for id, future in zip(ids, futures):
+            if (document := documents.get(id)) is None:
+                future.set_result(None)
+                continue
+            try:
+                future.set_result(ProductFromDB.model_validate(document))
+            except ValidationError as e:
+                future.set_exception(
+                    HTTPException(
+                        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                        detail=f"Error de validación de producto: {e}",
+                    )
+                )
+
+
 class ProductsService:
     """
     This contains actual Mongo database CRUD methods.
@@ -24,51 +196,246 @@ class ProductsService:
     Will be injected as dependency in the API Routes.
     """
 
-    assert (
-        collection_name := "products"
-    ) in COLLECTIONS, f"Collection (table) {collection_name} does not exist in database"
-    collection = db[collection_name]
+    collection = MongoCollection("products")
+    # Validated products by id, shared by the requests of this worker. Entries
+    # are read-only and dropped by every write made through this service.
+    cache = TTLCache(maxsize=PRODUCT_CACHE_SIZE, ttl=PRODUCT_CACHE_TTL_SECONDS)
+    # Misses being fetched, so concurrent requests for the same id share one query.
+    loading: dict[PydanticObjectId, asyncio.Future] = {}
+    coalesced = 0
+    # Bumped on every invalidation, so a fetch that started before a write
+    # does not cache what it read.
+    cache_epoch = 0
+    # Rendered listing pages and their ETags, keyed by catalog version and query.
+    # Product writes bump the version (except holds, see HOLD_FIELDS), so older
+    # pages are never read again and just age out of the LRU.
+    catalog_cache = TTLCache(maxsize=CATALOG_CACHE_SIZE, ttl=CATALOG_CACHE_TTL_SECONDS)
+    catalog_version = 0
+    # Validated search results, keyed by search version, search index version
+    # (the local index catches up with writes shortly after them) and query.
+    # The search version is bumped by writes of more than STOCK_FIELDS.
+    search_cache = TTLCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL_SECONDS)
+    search_version = 0
+    # Searches running, so concurrent identical ones share one backend call.
+    searching: dict[tuple, asyncio.Future] = {}
+    search_coalesced = 0
 
     @classmethod
-    def get_all(cls, params: QueryParamsDependency):
+    def invalidate(cls, ids: Iterable[PydanticObjectId], listed: bool = True, searched: bool = True):
+        """
+        Drops the cached products. With `listed` False, for writes of only
+        HOLD_FIELDS, the catalog pages are kept, and with `searched` False, for
+        writes of only STOCK_FIELDS, the search results.
+        """
+        cls.cache_epoch += 1
+        if listed:
+            cls.catalog_version += 1
+        if listed and searched:
+            cls.search_version += 1
+        for id in ids:
+            cls.cache.pop(id)
+            cls.loading.pop(id, None)
+
+    @classmethod
+    def clear_cache(cls):
+        cls.cache_epoch += 1
+        cls.catalog_version += 1
+        cls.search_version += 1
+        cls.cache.clear()
+        cls.loading.clear()
+
+    @classmethod
+    def cache_stats(cls) -> dict:
+        return {
+            **cls.cache.stats(),
+            "coalesced": cls.coalesced,
+            "loading": len(cls.loading),
+            "catalog": {**cls.catalog_cache.stats(), "version": cls.catalog_version},
+            "search": {
+                **cls.search_cache.stats(),
+                "version": cls.search_version,
+                "coalesced": cls.search_coalesced,
+                "searching": len(cls.searching),
+            },
+        }
+
+    @classmethod
+    async def get_all(cls, params: QueryParamsDependency):
         response_dict = {"product_list": [], "errors": []}
         results = params.query_collection(cls.collection)
-        for product in results:
-            try:
-                response_dict["product_list"].append(
-                    ProductFromDB.model_validate(product).model_dump()
-                )
-            except ValidationError as e:
-                response_dict["errors"].append(f"Validation error: {e}")
+        # Runs alongside the page query.
+        total = (
+            asyncio.create_task(params.count_documents(cls.collection))
+            if params.count
+            else None
+        )
+        documents = await results.to_list(length=None)
+        response_dict["product_list"], response_dict["errors"] = validate_batch(
+            ProductFromDB, documents
+        )
+        if params.pagination == "cursor":
+            response_dict["next_cursor"] = params.next_cursor(
+                documents[-1] if documents else None, len(documents)
+            )
+        if total:
+            response_dict["total"] = await total
         return response_dict
 
     @classmethod
-    def search(cls, search: SearchEngineDependency):
+    async def get_facets(cls, params: QueryParamsDependency):
+        """
+        A page of products with the number of matching products per category,
+        size, price range and tag, in one aggregation. Counts of the whole
+        catalog are kept up to date by the search index, so unfiltered
+        requests only query the page.
+        """
         response_dict = {"product_list": [], "errors": []}
-        results = search.atlas_search(cls.collection)
-        for product in results:
-            try:
-                response_dict["product_list"].append(
-                    ProductFromDB.model_validate(product).model_dump()
-                )
-            except ValidationError as e:
-                response_dict["errors"].append(f"Validation error: {e}")
+        if not params.filter and product_search.ready:
+            documents = await params.query_collection(cls.collection).to_list(length=None)
+            total = len(product_search.facets)
+            counts = product_search.facets.most_common()
+        else:
+            result = await params.aggregate_collection(cls.collection, FACET_PIPELINES).next()
+            documents = result["results"]
+            total = result["total"][0]["count"] if result["total"] else 0
+            counts = {name: [(row["_id"], row["count"]) for row in result[name]] for name in FACET_PIPELINES}
+        response_dict["product_list"], response_dict["errors"] = validate_batch(
+            ProductFromDB, documents
+        )
+        if params.pagination == "cursor":
+            response_dict["next_cursor"] = params.next_cursor(
+                documents[-1] if documents else None, len(documents)
+            )
+        response_dict["total"] = total
+        response_dict["facets"] = format_facets(counts)
         return response_dict
 
     @classmethod
-    def autocomplete(
+    async def get_catalog_page(cls, params: QueryParamsDependency, facets: bool = False) -> tuple[bytes, str]:
+        """
+        `get_all` (or `get_facets`) rendered to JSON, with its ETag, from the
+        catalog cache.
+        """
+        # Read before querying: a write landing meanwhile moves the version on,
+        # so the page stored below is never served. Facets of the whole catalog
+        # come from the search index, which catches up with writes shortly after.
+        key = (
+            cls.catalog_version,
+            ("facets", product_search.version) if facets else None,
+            params.cache_key(cls.collection.name),
+        )
+        if (page := cls.catalog_cache.get(key)) is None:
+            body = json_dumps(await (cls.get_facets if facets else cls.get_all)(params))
+            page = (body, make_etag(body))
+            cls.catalog_cache.set(key, page)
+        return page
+
+    @classmethod
+    async def search(cls, search: SearchEngineDependency):
+        """
+        `run_search_query` from the search cache. Misses already being searched
+        wait for that search instead of starting another one.
+        """
+        key = (cls.search_version, product_search.version, *search.cache_key())
+        if (results := cls.search_cache.get(key)) is not None:
+            return results
+        if (future := cls.searching.get(key)) is not None:
+            cls.search_coalesced += 1
+        else:
+            future = cls.searching[key] = asyncio.ensure_future(cls.run_search_query(search))
+
+            def done(future: asyncio.Future):
+                if cls.searching.get(key) is future:
+                    del cls.searching[key]
+                # Failures are not cached, the next request retries.
+                if not future.cancelled() and future.exception() is None:
+                    cls.search_cache.set(key, future.result())
+
+            future.add_done_callback(done)
+        return await asyncio.shield(future)
+
+    @classmethod
+    async def run_search_query(cls, search: SearchEngineDependency):
+        response_dict = {"product_list": [], "errors": []}
+        documents = await cls.run_search(
+            lambda: search.atlas_search(cls.collection).to_list(length=None),
+            lambda: search.local_search(cls.collection),
+        )
+        response_dict["product_list"], response_dict["errors"] = validate_batch(
+            ProductFromDB, documents
+        )
+        return response_dict
+
+    @classmethod
+    async def autocomplete(
         cls,
         search: SearchEngineDependency,
         response: Response,
     ):
         response.headers["Access-Control-Allow-Origin"] = "*"
-        return search.autocomplete(cls.collection)
+        return await cls.run_search(
+            lambda: search.autocomplete(cls.collection), search.local_autocomplete
+        )
+
+    @staticmethod
+    async def run_search(atlas: Callable[[], Awaitable[Any]], local: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Runs the SEARCH_BACKEND version of a search. Atlas searches fall back
+        to the local index where `$search` is not available.
+        """
+        try:
+            if SEARCH_BACKEND == "atlas":
+                try:
+                    return await atlas()
+                except OperationFailure as e:
+                    logger.warn(f"Atlas Search failed ({e}), using the local search index.")
+            return await local()
+        except SearchUnavailable:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="El buscador no está disponible, intentá de nuevo en unos minutos.",
+            )
+
+    @classmethod
+    async def get_one(cls, id: PydanticObjectId, cached: bool = True) -> ProductFromDB:
+        """
+        Product by id, from the cache unless `cached` is False (for
+        read-modify-write flows, which need the stored document).
+        """
+        if not cached:
+            return await cls.fetch_one(id)
+        if (product := cls.cache.get(id)) is not None:
+            return product
+        if (future := cls.loading.get(id)) is not None:
+            cls.coalesced += 1
+        else:
+            future = cls.loading[id] = asyncio.ensure_future(cls.fetch_one(id, store=True))
+
+            def done(_):
+                if cls.loading.get(id) is future:
+                    del cls.loading[id]
+
+            future.add_done_callback(done)
+        return await asyncio.shield(future)
+
+    @classmethod
+    async def find_version(cls, id: PydanticObjectId) -> dict | None:
+        """
+        Just the fields the ETag of a product depends on, see `version_headers`.
+        """
+        version = await cls.collection.find_one({"_id": id}, VERSION_PROJECTION)
+        # Same default as ProductFromDB, so both render the same ETag.
+        return {"reserved": 0, **version} if version else None
 
     @classmethod
-    def get_one(cls, id: PydanticObjectId):
-        if product_from_db := cls.collection.find_one({"_id": id}):
+    async def fetch_one(cls, id: PydanticObjectId, store: bool = False) -> ProductFromDB:
+        epoch = cls.cache_epoch
+        if product_from_db := await cls.collection.find_one({"_id": id}):
             try:
-                return ProductFromDB.model_validate(product_from_db)
+                product = ProductFromDB.model_validate(product_from_db)
+                if store and epoch == cls.cache_epoch:
+                    cls.cache.set(id, product)
+                return product
             except ValidationError as e:
                 raise HTTPException(
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -81,16 +448,17 @@ class ProductsService:
             )
 
     @classmethod
-    def find_from_staff_id(cls, staff_id: PydanticObjectId):
-        cursor = cursor = cls.collection.find({"staff_id": staff_id})
-        return [
-            ProductFromDB.model_validate(product).model_dump() for product in cursor
-        ]
+    async def find_from_staff_id(cls, staff_id: PydanticObjectId):
+        cursor = cls.collection.find({"staff_id": staff_id})
+        product_list, _ = validate_batch(
+            ProductFromDB, await cursor.to_list(length=None)
+        )
+        return product_list
 
     @classmethod
-    def create_one(cls, product: BaseProduct, staff_id: PydanticObjectId):
+    async def create_one(cls, product: BaseProduct, staff_id: PydanticObjectId):
         # Check if product already exist in database.
-        if product.sku and cls.collection.find_one({"sku": product.sku}):
+        if product.sku and await cls.collection.find_one({"sku": product.sku}):
             raise HTTPException(
                 status_code=status.HTTP_409_CONFLICT,
                 detail=f"El producto {product.sku} ya existe.",
@@ -101,18 +469,97 @@ class ProductsService:
             "created_at": datetime.now(),
         }
         ProductCreateData.model_validate(new_product)
-        return cls.collection.insert_one(new_product) or None
+        try:
+            result = await cls.collection.insert_one(new_product)
+            cls.catalog_version += 1
+            product_search.refresh([result.inserted_id])
+            return result or None
+        except DuplicateKeyError:
+            # Lost a race against a concurrent insert of the same SKU.
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"El producto {product.sku} ya existe.",
+            )
+
+    @classmethod
+    async def import_many(
+        cls,
+        file: BinaryIO,
+        format: Literal["csv", "ndjson"],
+        staff_id: PydanticObjectId,
+    ) -> dict:
+        """
+        Bulk inserts products from a CSV or NDJSON file, `IMPORT_CHUNK_SIZE` rows
+        at a time with unordered bulk writes. SKU uniqueness is enforced by the
+        unique index, so duplicated SKUs are reported per row instead of pre-read.
+        """
+        report = {"rows": 0, "inserted": 0, "error_count": 0, "errors": []}
+
+        def add_error(row_number: int, error: str):
+            report["error_count"] += 1
+            if len(report["errors"]) < MAX_REPORTED_IMPORT_ERRORS:
+                report["errors"].append({"row": row_number, "error": error})
+
+        rows = read_import_rows(file, format)
+        while chunk := await run_in_threadpool(lambda: list(islice(rows, IMPORT_CHUNK_SIZE))):
+            first_row = report["rows"] + 1
+            report["rows"] += len(chunk)
+            # Row numbers are 1-based and do not count the CSV header.
+            parsed = [(first_row + i, row) for i, row in enumerate(chunk)]
+            for row_number, row in parsed:
+                if isinstance(row, str):
+                    add_error(row_number, row)
+            parsed = [(row_number, row) for row_number, row in parsed if isinstance(row, dict)]
+
+            try:
+                products = list_adapter(BaseProduct).validate_python([row for _, row in parsed])
+                valid = [(row_number, product) for (row_number, _), product in zip(parsed, products)]
+            except ValidationError:
+                # Only pay for per-row validation in chunks with invalid rows.
+                valid = []
+                for row_number, row in parsed:
+                    try:
+                        valid.append((row_number, BaseProduct.model_validate(row)))
+                    except ValidationError as e:
+                        add_error(row_number, f"Validation error: {e}")
+            if not valid:
+                continue
+
+            now = datetime.now()
+            documents = [{**product.model_dump(), "staff_id": staff_id, "created_at": now} for _, product in valid]
+            operations = [InsertOne(document) for document in documents]
+            try:
+                result = await cls.collection.bulk_write(operations, ordered=False)
+                report["inserted"] += result.inserted_count
+            except BulkWriteError as e:
+                report["inserted"] += e.details.get("nInserted", 0)
+                for write_error in e.details.get("writeErrors", []):
+                    row_number, product = valid[write_error["index"]]
+                    add_error(
+                        row_number,
+                        f"El producto {product.sku} ya existe."
+                        if write_error.get("code") == 11000
+                        else write_error.get("errmsg", "Error de escritura"),
+                    )
+            # bulk_write sets the _id of every document; ids that failed are not found and skipped.
+            product_search.refresh(document["_id"] for document in documents)
+        if report["inserted"]:
+            cls.catalog_version += 1
+        return report
 
     @classmethod
-    def update_one(cls, id: PydanticObjectId, product: ProductUpdateData):
+    async def update_one(cls, id: PydanticObjectId, product: ProductUpdateData):
         modified_product: dict = product.model_dump(exclude_unset=True)
         modified_product.update(modified_at=datetime.now())
 
-        if document := cls.collection.find_one_and_update(
+        document = await cls.collection.find_one_and_update(
             {"_id": id},
             {"$set": modified_product},
             return_document=True,
-        ):
+        )
+        cls.invalidate([id])
+        product_search.refresh([id])
+        if document:
             return ProductFromDB.model_validate(document).model_dump()
         else:
             raise HTTPException(
@@ -121,8 +568,11 @@ class ProductsService:
             )
 
     @classmethod
-    def delete_one(cls, id: PydanticObjectId):
-        if document := cls.collection.find_one_and_delete({"_id": id}):
+    async def delete_one(cls, id: PydanticObjectId):
+        document = await cls.collection.find_one_and_delete({"_id": id})
+        cls.invalidate([id])
+        product_search.refresh([id])
+        if document:
             return ProductFromDB.model_validate(document).model_dump()
         else:
             raise HTTPException(
@@ -130,38 +580,292 @@ class ProductsService:
                 detail=f"Producto {id} no encontrado",
             )
 
-    @classmethod
-    def check_stock(cls, order_products: list[OrderProduct]) -> None:
+    @staticmethod
+    def merge_quantities(order_products: list[OrderProduct]) -> dict[PydanticObjectId, int]:
+        quantities: dict[PydanticObjectId, int] = {}
         for product in order_products:
-            existing_product = cls.get_one(product.product_id)
-            if existing_product.stock < product.quantity:
-                raise HTTPException(
-                    status_code=status.HTTP_409_CONFLICT,
-                    detail=f"Producto {product.product_id} sin stock",
+            quantities[product.product_id] = quantities.get(product.product_id, 0) + product.quantity
+        return quantities
+
+    @staticmethod
+    def has_available(quantity: int, held: int = 0) -> dict:
+        """
+        `$expr` matching products with `quantity` units not reserved by other
+        orders. `held` units are reserved by the order asking, so they count.
+        """
+        available = {"$subtract": ["$stock", {"$ifNull": ["$reserved", 0]}]}
+        return {"$gte": [{"$add": [available, held]}, quantity]}
+
+    @classmethod
+    def stock_decrement(
+        cls, product_id: PydanticObjectId, quantity: int, now: datetime, held: int = 0
+    ) -> tuple[dict, list]:
+        """
+        Filter and update taking `quantity` units and releasing the `held` ones.
+        It only matches while there is enough available stock, so the check and
+        the decrement are one atomic operation. The `held` units must still be
+        reserved, so `$inc` of them is the exact revert.
+        """
+        reserved = {"$ifNull": ["$reserved", 0]}
+        available = cls.has_available(quantity, held)
+        return (
+            {
+                "_id": product_id,
+                "$expr": {"$and": [available, {"$gte": [reserved, held]}]} if held else available,
+            },
+            [
+                {
+                    "$set": {
+                        "stock": {"$subtract": ["$stock", quantity]},
+                        "reserved": {"$subtract": [reserved, held]},
+                        "sales_count": {"$add": [{"$ifNull": ["$sales_count", 0]}, quantity]},
+                        "modified_at": now,
+                    }
+                }
+            ],
+        )
+
+    @classmethod
+    async def update_all_or_nothing(
+        cls,
+        operations: dict[PydanticObjectId, tuple],
+        reverts: dict,
+        session: AsyncIOMotorClientSession | None = None,
+        listed: bool = True,
+    ) -> bool:
+        """
+        Applies one conditional (filter, update) of STOCK_FIELDS per product.
+        Returns False, with nothing applied, if any of them did not match.
+
+        Uses one bulk write inside a transaction when the deployment supports
+        them (the caller's, with a `session` in a transaction). Otherwise the
+        updates run concurrently and the applied ones are undone with their
+        `reverts` update. `listed` is False for updates of only HOLD_FIELDS.
+        """
+        if not operations:
+            return True
+        try:
+            return await cls.apply_all_or_nothing(operations, reverts, session)
+        finally:
+            cls.invalidate(operations, listed, searched=False)
+            if listed:
+                # Autocomplete ranks by sales_count.
+                product_search.refresh(operations, ranks_only=True)
+
+    @classmethod
+    async def apply_all_or_nothing(
+        cls,
+        operations: dict[PydanticObjectId, tuple],
+        reverts: dict,
+        session: AsyncIOMotorClientSession | None = None,
+    ) -> bool:
+        if session is not None:
+            # The caller aborts its transaction when this returns False.
+            requests = [UpdateOne(*operation) for operation in operations.values()]
+            result = await cls.collection.bulk_write(requests, session=session)
+            return result.matched_count == len(requests)
+        if await mongo.transactions_supported():
+            requests = [UpdateOne(*operation) for operation in operations.values()]
+
+            async def apply(session):
+                result = await cls.collection.bulk_write(requests, session=session)
+                if result.matched_count < len(requests):
+                    raise OutOfStock()
+
+            try:
+                async with await mongo.client.start_session() as session:
+                    await session.with_transaction(apply)
+            except OutOfStock:
+                return False
+            return True
+
+        results = await asyncio.gather(
+            *(cls.collection.update_one(*operation) for operation in operations.values()),
+            return_exceptions=True,
+        )
+        applied = [
+            id for id, result in zip(operations, results)
+            if not isinstance(result, BaseException) and result.matched_count
+        ]
+        if len(applied) < len(operations):
+            if applied:
+                # Undoing is a write too, for the ETag and Last-Modified.
+                undone_at = datetime.now()
+                await cls.collection.bulk_write(
+                    [UpdateOne({"_id": id}, {**reverts[id], "$set": {"modified_at": undone_at}}) for id in applied]
                 )
+            # Raised once the updates that did apply are undone.
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+            return False
+        return True
 
     @classmethod
-    def check_and_update_stock(cls, order_products: list[OrderProduct]) -> None:
-        for product in order_products:
-            existing_product = cls.get_one(product.product_id)
-            if existing_product.stock < product.quantity:
-                raise HTTPException(
-                    status_code=status.HTTP_409_CONFLICT,
-                    detail=f"Producto {product.product_id} sin stock",
+    async def raise_out_of_stock(
+        cls,
+        quantities: dict[PydanticObjectId, int],
+        loader: ProductLoader,
+        held: dict[PydanticObjectId, int] | None = None,
+    ):
+        held = held or {}
+        loader.clear(quantities)
+        found = await loader.load_many(quantities)
+        missing = [
+            id
+            for (id, quantity), product in zip(quantities.items(), found)
+            if product is None or product.available_stock + held.get(id, 0) < quantity
+        ]
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Producto {missing[0] if missing else ''} sin stock",
+        )
+
+    @classmethod
+    async def check_and_update_stock(
+        cls,
+        order_products: list[OrderProduct],
+        loader: ProductLoader | None = None,
+        held: dict[PydanticObjectId, int] | None = None,
+        session: AsyncIOMotorClientSession | None = None,
+    ) -> None:
+        """
+        Decrements stock and increments sales_count for every line, all or nothing.
+
+        `held` are the units the order had reserved, which are released in the
+        same update (see ReservationsService.consume).
+        """
+        loader = loader or ProductLoader()
+        held = held or {}
+        quantities = cls.merge_quantities(order_products)
+        # Units held for products no longer in the order are released too.
+        lines = {**dict.fromkeys(held, 0), **quantities}
+        now = datetime.now()
+        operations = {
+            id: cls.stock_decrement(id, quantity, now, held.get(id, 0))
+            for id, quantity in lines.items()
+        }
+        reverts = {
+            id: {"$inc": {"stock": quantity, "sales_count": -quantity, "reserved": held.get(id, 0)}}
+            for id, quantity in lines.items()
+        }
+        if not await cls.update_all_or_nothing(operations, reverts, session):
+            await cls.raise_out_of_stock(quantities, loader, held)
+        loader.clear(quantities)
+
+    @classmethod
+    async def release_stock(
+        cls, quantities: dict[PydanticObjectId, int], held: dict[PydanticObjectId, int] | None = None
+    ) -> None:
+        """
+        Gives back stock taken by `check_and_update_stock` (see `merge_quantities`),
+        and reserves the `held` units it released again.
+        """
+        held = held or {}
+        quantities = {**dict.fromkeys(held, 0), **quantities}
+        now = datetime.now()
+        await cls.collection.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": id},
+                    {
+                        "$inc": {"stock": quantity, "sales_count": -quantity, "reserved": held.get(id, 0)},
+                        "$set": {"modified_at": now},
+                    },
                 )
-            product_to_update = ProductUpdateData(
-                stock=existing_product.stock - product.quantity,
-                sales_count=(
-                    existing_product.sales_count + product.quantity
-                    if existing_product.sales_count
-                    else product.quantity
-                ),
-                modified_at=datetime.now(),
+                for id, quantity in quantities.items()
+            ]
+        )
+        cls.invalidate(quantities, searched=False)
+        product_search.refresh(quantities, ranks_only=True)
+
+    @classmethod
+    async def reserve_stock(
+        cls,
+        changes: dict[PydanticObjectId, int],
+        loader: ProductLoader | None = None,
+        hold_token: ObjectId | None = None,
+        session: AsyncIOMotorClientSession | None = None,
+    ) -> None:
+        """
+        Adds `changes` to the reserved units of each product, all or nothing.
+        Positive changes only apply while that many units are available.
+
+        With a `hold_token`, every updated product keeps it in `pending_holds`
+        until `settle_reserve`, so `undo_reserve` knows where it was applied.
+        """
+        loader = loader or ProductLoader()
+        now = datetime.now()
+        tag = {"$addToSet": {"pending_holds": hold_token}} if hold_token else {}
+        untag = {"$pull": {"pending_holds": hold_token}} if hold_token else {}
+        operations = {
+            id: (
+                {"_id": id, "$expr": cls.has_available(change)} if change > 0 else {"_id": id},
+                {"$inc": {"reserved": change}, "$set": {"modified_at": now}, **tag},
             )
-            cls.update_one(
-                product.product_id,
-                product_to_update,
+            for id, change in changes.items()
+            if change
+        }
+        reverts = {id: {"$inc": {"reserved": -change}, **untag} for id, change in changes.items()}
+        if not await cls.update_all_or_nothing(operations, reverts, session, listed=False):
+            await cls.raise_out_of_stock({id: change for id, change in changes.items() if change > 0}, loader)
+        loader.clear(changes)
+
+    @classmethod
+    async def undo_reserve(cls, changes: dict[PydanticObjectId, int], hold_token: ObjectId) -> None:
+        """
+        Undoes the `reserve_stock` tagged with `hold_token`, only on the
+        products it was applied to and only once, whoever calls it.
+        """
+        now = datetime.now()
+        requests = [
+            UpdateOne(
+                {"_id": id, "pending_holds": hold_token},
+                {"$inc": {"reserved": -change}, "$pull": {"pending_holds": hold_token}, "$set": {"modified_at": now}},
             )
+            for id, change in changes.items()
+            if change
+        ]
+        if requests:
+            await cls.collection.bulk_write(requests)
+            cls.invalidate(changes, listed=False)
+
+    @classmethod
+    async def settle_reserve(cls, ids: Iterable[PydanticObjectId], hold_token: ObjectId) -> None:
+        """
+        Drops the tag of a `reserve_stock` whose hold was recorded.
+        """
+        requests = [UpdateOne({"_id": id}, {"$pull": {"pending_holds": hold_token}}) for id in ids]
+        if requests:
+            await cls.collection.bulk_write(requests)
+
+    @classmethod
+    async def adjust_reserved(cls, changes: dict[PydanticObjectId, int]) -> None:
+        """
+        Adds `changes` to the reserved units without checking availability, to
+        release holds or undo `reserve_stock`.
+        """
+        if changes:
+            now = datetime.now()
+            await cls.collection.bulk_write(
+                [
+                    UpdateOne({"_id": id}, {"$inc": {"reserved": change}, "$set": {"modified_at": now}})
+                    for id, change in changes.items()
+                ]
+            )
+            cls.invalidate(changes, listed=False)
+
+@on_change("products")
+def invalidate_cached_product(id: PydanticObjectId | None, fields: frozenset[str] | None):
+    if id is None:
+        ProductsService.clear_cache()
+    else:
+        ProductsService.invalidate(
+            [id],
+            listed=fields is None or not fields <= HOLD_FIELDS,
+            searched=fields is None or not fields <= STOCK_FIELDS,
+        )
 
 
 ProductsServiceDependency = Annotated[ProductsService, Depends()]
+ProductLoaderDependency = Annotated[ProductLoader, Depends()]
@@ -0,0 +1,322 @@
+__all__ = ["ReservationsServiceDependency", "ReservationsService"]
+
+import asyncio
+from bson import ObjectId
+from fastapi import Depends, HTTPException, status
+from motor.motor_asyncio import AsyncIOMotorClientSession
+from pydantic_mongo import PydanticObjectId
+from pymongo.errors import DuplicateKeyError
+from typing import Annotated
+from datetime import datetime, timedelta
+
+from ..config import (
+    MongoCollection,
+    mongo,
+    RESERVATION_TTL_SECONDS,
+    RESERVATION_SWEEP_SECONDS,
+    logger,
+)
+from ..models import OrderProduct, ReservationStatus
+from .products import ProductsService, ProductLoader
+
+# Holds still pending after this long were left halfway by a failed request.
+PENDING_HOLD_SECONDS = 60
+# A new hold only reuses the document of a released one. A consumed hold
+# means the order was completed, so holding for it again is refused.
+REUSABLE = ReservationStatus.released
+
+
+class ReservationsService:
+    """
+    Stock held by pending orders.
+
+    One document per order (`_id` is the order id) lists the held quantities,
+    and every product keeps the total held in its `reserved` counter, so its
+    available stock is `stock - reserved` in a single read. Holds are taken
+    when the order is created, consumed when it is completed and released when
+    it is cancelled or `expires_at` passes (see `sweep_forever`).
+
+    Without transactions, a hold is first recorded as pending with the
+    changes it is about to make, so if the request dies before recording the
+    result the sweeper can undo them (see `reconcile_pending`).
+    """
+
+    collection = MongoCollection("reservations")
+
+    @staticmethod
+    def held_quantities(reservation: dict | None) -> dict[PydanticObjectId, int]:
+        if reservation is None:
+            return {}
+        return {line["product_id"]: line["quantity"] for line in reservation["products"]}
+
+    @staticmethod
+    def changed_hold(order_id: PydanticObjectId) -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"La reserva de la orden {order_id} cambió, intentá de nuevo.",
+        )
+
+    @classmethod
+    async def hold(
+        cls,
+        order_id: PydanticObjectId,
+        order_products: list[OrderProduct],
+        loader: ProductLoader | None = None,
+    ) -> datetime:
+        """
+        Holds the stock of the order lines, replacing what the order held
+        before, and returns until when. Raises 409 if some product does not
+        have enough available stock.
+        """
+        quantities = ProductsService.merge_quantities(order_products)
+        if not await mongo.transactions_supported():
+            return await cls.hold_pending(order_id, quantities, loader)
+        async with await mongo.client.start_session() as session:
+            return await session.with_transaction(
+                lambda session: cls.hold_in_transaction(order_id, quantities, loader, session)
+            )
+
+    @classmethod
+    async def hold_in_transaction(
+        cls,
+        order_id: PydanticObjectId,
+        quantities: dict[PydanticObjectId, int],
+        loader: ProductLoader | None,
+        session: AsyncIOMotorClientSession,
+    ) -> datetime:
+        """
+        `hold` with the stock and the reservation written in one transaction,
+        aborted by any exception.
+        """
+        now = datetime.now()
+        current = await cls.collection.find_one(
+            {"_id": order_id, "status": ReservationStatus.active}, session=session
+        )
+        held = cls.held_quantities(current)
+        changes = {id: quantities.get(id, 0) - held.get(id, 0) for id in quantities | held}
+        await ProductsService.reserve_stock(changes, loader, session=session)
+
+        expires_at = current["expires_at"] if current else now + timedelta(seconds=RESERVATION_TTL_SECONDS)
+        lines = [{"product_id": id, "quantity": quantity} for id, quantity in quantities.items()]
+        try:
+            # Reuses the document of a released hold, if any.
+            result = await cls.collection.update_one(
+                {"_id": order_id, "status": ReservationStatus.active if current else REUSABLE},
+                {
+                    "$set": {
+                        "products": lines,
+                        "status": ReservationStatus.active,
+                        "expires_at": expires_at,
+                        "modified_at": now,
+                        **({} if current else {"created_at": now}),
+                    },
+                    "$unset": {"released_at": ""},
+                },
+                upsert=not current,
+                session=session,
+            )
+        except DuplicateKeyError:
+            raise cls.changed_hold(order_id)
+        if not (result.matched_count or result.upserted_id):
+            raise cls.changed_hold(order_id)
+        return expires_at
+
+    @classmethod
+    async def hold_pending(
+        cls,
+        order_id: PydanticObjectId,
+        quantities: dict[PydanticObjectId, int],
+        loader: ProductLoader | None,
+    ) -> datetime:
+        """
+        `hold` without transactions: the reservation is marked pending with
+        the changes to make before touching the stock, and made active with
+        the new lines after.
+        """
+        now = datetime.now()
+        current = await cls.collection.find_one({"_id": order_id, "status": ReservationStatus.active})
+        held = cls.held_quantities(current)
+        changes = {id: quantities.get(id, 0) - held.get(id, 0) for id in quantities | held}
+        expires_at = current["expires_at"] if current else now + timedelta(seconds=RESERVATION_TTL_SECONDS)
+        token = ObjectId()
+        pending = {
+            "status": ReservationStatus.pending,
+            "pending_token": token,
+            "pending_changes": [{"product_id": id, "quantity": change} for id, change in changes.items() if change],
+            "modified_at": now,
+        }
+        try:
+            if current:
+                # Same lines as read, so the changes are still the right ones.
+                result = await cls.collection.update_one(
+                    {"_id": order_id, "status": ReservationStatus.active, "products": current["products"]},
+                    {"$set": pending},
+                )
+            else:
+                # Reuses the document of a released hold, if any.
+                result = await cls.collection.update_one(
+                    {"_id": order_id, "status": REUSABLE},
+                    {
+                        "$set": {**pending, "products": [], "expires_at": expires_at, "created_at": now},
+                        "$unset": {"released_at": ""},
+                    },
+                    upsert=True,
+                )
+        except DuplicateKeyError:
+            raise cls.changed_hold(order_id)
+        if not (result.matched_count or result.upserted_id):
+            raise cls.changed_hold(order_id)
+
+        try:
+            await ProductsService.reserve_stock(changes, loader, hold_token=token)
+        except HTTPException:
+            # Out of stock, nothing was reserved: back to what it held.
+            await cls.finish_pending(order_id, token, now)
+            raise
+        lines = [{"product_id": id, "quantity": quantity} for id, quantity in quantities.items()]
+        result = await cls.collection.update_one(
+            {"_id": order_id, "status": ReservationStatus.pending, "pending_token": token, "modified_at": now},
+            {
+                "$set": {"status": ReservationStatus.active, "products": lines},
+                "$unset": {"pending_token": "", "pending_changes": ""},
+            },
+        )
+        if not result.matched_count:
+            # Taken as abandoned by the sweeper, which undoes it too.
+            await ProductsService.undo_reserve(changes, token)
+            raise cls.changed_hold(order_id)
+        await ProductsService.settle_reserve(changes, token)
+        return expires_at
+
+    @classmethod
+    async def finish_pending(cls, order_id: PydanticObjectId, token: ObjectId, modified_at: datetime) -> bool:
+        """
+        Puts a pending hold back to what it held before (released if it held
+        nothing). Returns False if it is not pending since `modified_at` anymore.
+        """
+        reservation = await cls.collection.find_one(
+            {"_id": order_id, "status": ReservationStatus.pending, "pending_token": token, "modified_at": modified_at},
+            {"products": 1},
+        )
+        if reservation is None:
+            return False
+        held = {"status": ReservationStatus.active} if reservation["products"] else {
+            "status": ReservationStatus.released,
+            "released_at": datetime.now(),
+        }
+        result = await cls.collection.update_one(
+            {"_id": order_id, "status": ReservationStatus.pending, "pending_token": token, "modified_at": modified_at},
+            {"$set": held, "$unset": {"pending_token": "", "pending_changes": ""}},
+        )
+        return bool(result.matched_count)
+
+    @classmethod
+    async def reconcile_pending(cls, limit: int = 500) -> int:
+        """
+        Undoes the holds left pending by requests that failed halfway, and
+        returns how many. Each one is first claimed by moving its
+        `modified_at`, so its request can no longer make it active, and is
+        only put back once its stock changes are undone: if this fails in
+        between, the next sweep finds it pending again.
+        """
+        stale = datetime.now() - timedelta(seconds=PENDING_HOLD_SECONDS)
+        cursor = cls.collection.find(
+            {"status": ReservationStatus.pending, "modified_at": {"$lte": stale}},
+            {"pending_token": 1, "pending_changes": 1, "modified_at": 1},
+        ).limit(limit)
+        reconciled = 0
+        async for reservation in cursor:
+            claimed_at = datetime.now()
+            token = reservation["pending_token"]
+            result = await cls.collection.update_one(
+                {"_id": reservation["_id"], "pending_token": token, "modified_at": reservation["modified_at"]},
+                {"$set": {"modified_at": claimed_at}},
+            )
+            if not result.matched_count:
+                continue
+            changes = cls.held_quantities({"products": reservation["pending_changes"]})
+            await ProductsService.undo_reserve(changes, token)
+            reconciled += await cls.finish_pending(reservation["_id"], token, claimed_at)
+        return reconciled
+
+    @classmethod
+    async def claim(
+        cls,
+        order_id: PydanticObjectId,
+        new_status: ReservationStatus,
+        filter: dict | None = None,
+        session: AsyncIOMotorClientSession | None = None,
+    ) -> dict | None:
+        """
+        Atomically ends the active hold of an order, so only one caller (a
+        request or any worker's sweeper) gets to act on it.
+        """
+        return await cls.collection.find_one_and_update(
+            {"_id": order_id, "status": ReservationStatus.active, **(filter or {})},
+            {"$set": {"status": new_status, "released_at": datetime.now()}},
+            session=session,
+        )
+
+    @classmethod
+    async def release(cls, order_id: PydanticObjectId, filter: dict | None = None) -> bool:
+        """
+        Gives the held stock back. Returns False if the order held nothing.
+        """
+        reservation = await cls.claim(order_id, ReservationStatus.released, filter)
+        if reservation is None:
+            return False
+        await ProductsService.adjust_reserved(
+            {id: -quantity for id, quantity in cls.held_quantities(reservation).items()}
+        )
+        return True
+
+    @classmethod
+    async def consume(
+        cls, order_id: PydanticObjectId, session: AsyncIOMotorClientSession | None = None
+    ) -> dict[PydanticObjectId, int]:
+        """
+        Claims the hold of an order being completed and returns the held
+        quantities, to be released by the stock decrement itself (see
+        `ProductsService.check_and_update_stock`). Empty if the hold expired.
+        """
+        return cls.held_quantities(await cls.claim(order_id, ReservationStatus.consumed, session=session))
+
+    @classmethod
+    async def restore(cls, order_id: PydanticObjectId):
+        """
+        Undoes `consume` when the completion fails before taking the stock.
+        """
+        await cls.collection.update_one(
+            {"_id": order_id, "status": ReservationStatus.consumed},
+            {"$set": {"status": ReservationStatus.active}, "$unset": {"released_at": ""}},
+        )
+
+    @classmethod
+    async def sweep_expired(cls, limit: int = 500) -> int:
+        now = datetime.now()
+        expired = {"expires_at": {"$lte": now}}
+        cursor = cls.collection.find({"status": ReservationStatus.active, **expired}, {"_id": 1}).limit(limit)
+        released = 0
+        async for reservation in cursor:
+            released += await cls.release(reservation["_id"], expired)
+        return released
+
+    @classmethod
+    async def sweep_forever(cls):
+        """
+        Releases expired holds, and undoes abandoned pending ones, every
+        RESERVATION_SWEEP_SECONDS. Started in the app lifespan; safe to run in
+        every worker at once.
+        """
+        while True:
+            try:
+                if released := await cls.sweep_expired():
+                    logger.info(f"Released {released} expired stock reservations.")
+                if reconciled := await cls.reconcile_pending():
+                    logger.warning(f"Undid {reconciled} stock reservations left pending.")
+            except Exception as e:
+                logger.error(f"Stock reservation sweep failed: {e}")
+            await asyncio.sleep(RESERVATION_SWEEP_SECONDS)
+
+
+ReservationsServiceDependency = Annotated[ReservationsService, Depends()]
@@ -1,36 +1,66 @@
 __all__ = ["UsersServiceDependency", "UsersService"]
 
 
+import asyncio
 from fastapi import Depends, HTTPException, status
 from pydantic import EmailStr
 from pydantic_mongo import PydanticObjectId
 from pydantic_core import ValidationError
-from typing import Annotated
+from pymongo.errors import DuplicateKeyError
+from typing import Annotated, AsyncIterator
 from datetime import datetime
 
-from ..config import COLLECTIONS, db
-from ..models import UserRegisterData, PrivateUserFromDB, UserFromDB, UserUpdateData, AdminUpdateData
+from ..config import MongoCollection
+from ..models import UserRegisterData, PrivateUserFromDB, UserFromDB, UserUpdateData, AdminUpdateData, validate_batch
 from ..__common_deps import QueryParamsDependency
+from ..responses import json_dumps
 
 class UsersService:
-    assert (collection_name := "users") in COLLECTIONS
-    collection = db[collection_name]
+    collection = MongoCollection("users")
 
     @classmethod
-    def get_all(cls, params: QueryParamsDependency):
+    async def get_all(cls, params: QueryParamsDependency):
         response_dict = {"users": [], "errors": []}
         results = params.query_collection(cls.collection)
-        for user in results:
-            try:
-               response_dict["users"].append(
-                   UserFromDB.model_validate(user).model_dump()
-                   ) 
-            except ValidationError as e:
-                response_dict["errors"].append(f"Validation error: {e}")
+        # Runs alongside the page query.
+        total = (
+            asyncio.create_task(params.count_documents(cls.collection))
+            if params.count
+            else None
+        )
+        documents = await results.to_list(length=None)
+        response_dict["users"], response_dict["errors"] = validate_batch(
+            UserFromDB, documents
+        )
+        if params.pagination == "cursor":
+            response_dict["next_cursor"] = params.next_cursor(
+                documents[-1] if documents else None, len(documents)
+            )
+        if total:
+            response_dict["total"] = await total
         return response_dict
 
     @classmethod
-    def get_one(
+    def stream_all(cls, params: QueryParamsDependency) -> AsyncIterator[bytes]:
+        """
+        Yields the listing as NDJSON lines while the cursor is iterated,
+        so memory does not grow with the number of documents.
+        The cursor is built right away: an invalid filter is a 400, not a
+        response that breaks after it started.
+        """
+        cursor = params.stream_collection(cls.collection)
+
+        async def lines():
+            async for document in cursor:
+                try:
+                    yield json_dumps(UserFromDB.model_validate(document)) + b"\n"
+                except ValidationError as e:
+                    yield json_dumps({"error": f"Validation error: {e}"}) + b"\n"
+
+        return lines()
+
+    @classmethod
+    async def get_one(
         cls,
         *,
         id: PydanticObjectId | None = None,
@@ -50,7 +80,7 @@ class UsersService:
                 {"email": email},
             ]
         }
-        if user_from_db := cls.collection.find_one(filter):
+        if user_from_db := await cls.collection.find_one(filter):
             return (
                 PrivateUserFromDB.model_validate(user_from_db)
                 if with_password
@@ -60,8 +90,12 @@ class UsersService:
             return None
 
     @classmethod
-    def create_one(cls, user: UserRegisterData, hash_password: str, make_it_admin: bool = False):
-        existing_user = cls.get_one(
+    async def find_version(cls, id: PydanticObjectId) -> dict | None:
+        return await cls.collection.find_one({"_id": id}, {"created_at": 1, "modified_at": 1})
+
+    @classmethod
+    async def create_one(cls, user: UserRegisterData, hash_password: str, make_it_admin: bool = False):
+        existing_user = await cls.get_one(
             username=user.username,
             email=user.email,
         )  
@@ -76,14 +110,19 @@ class UsersService:
             is_active=True if make_it_admin else False,
             role="admin" if make_it_admin else new_user["role"]
         )
-        return cls.collection.insert_one(new_user) or None
+        try:
+            return await cls.collection.insert_one(new_user) or None
+        except DuplicateKeyError:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT, detail="Esta cuenta ya existe."
+            )
 
     @classmethod
-    def update_one(cls, id: PydanticObjectId, user: UserUpdateData | AdminUpdateData):
+    async def update_one(cls, id: PydanticObjectId, user: UserUpdateData | AdminUpdateData):
         modified_user = user.model_dump(exclude={"password", "username", "email"}, exclude_unset=True)
         modified_user.update(modified_at=datetime.now())
 
-        if document := cls.collection.find_one_and_update(
+        if document := await cls.collection.find_one_and_update(
             {"_id": id},
             {"$set": modified_user},
             return_document=True,
@@ -96,8 +135,8 @@ class UsersService:
             )
     
     @classmethod
-    def update_password(cls, id: PydanticObjectId, hash_password: str):
-        if document := cls.collection.find_one_and_update(
+    async def update_password(cls, id: PydanticObjectId, hash_password: str):
+        if document := await cls.collection.find_one_and_update(
             {"_id": id},
             {"$set": {"hash_password": hash_password, "modified_at": datetime.now()}},
             return_document=True,
@@ -110,8 +149,8 @@ class UsersService:
             )
 
     @classmethod
-    def delete_one(cls, id: PydanticObjectId):
-        document = cls.collection.find_one_and_delete({"_id": id})
+    async def delete_one(cls, id: PydanticObjectId):
+        document = await cls.collection.find_one_and_delete({"_id": id})
         if document:
             return UserFromDB.model_validate(document).model_dump()
         else:
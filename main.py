@@ -1,13 +1,53 @@
+import asyncio
 import logging
+from contextlib import asynccontextmanager, suppress
 from fastapi import FastAPI, Request
-from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.templating import Jinja2Templates
 
-from .api.config import allowed_origins, APP_TITLE
+from .api.config import (
+    allowed_origins,
+    APP_TITLE,
+    connect_to_mongo,
+    close_mongo_connection,
+    sync_indexes,
+    log_index_report,
+    CHANGE_STREAMS_ENABLED,
+)
+from .api.__change_streams import change_listener
+from .api.__static import CompressedStaticFiles
+from .api.search import product_search
 from .api.routes import api_router, auth_router
+from .api.services import ReservationsService
+from .api.responses import MongoJSONResponse
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await connect_to_mongo()
+    log_index_report(await sync_indexes())
+    # Compresses and fingerprints the text assets.
+    await run_in_threadpool(static_files.prepare)
+    sweeper = asyncio.create_task(ReservationsService.sweep_forever())
+    search_builder = product_search.start()
+    listener = asyncio.create_task(change_listener.run()) if CHANGE_STREAMS_ENABLED else None
+    yield
+    sweeper.cancel()
+    search_builder.cancel()
+    if listener:
+        listener.cancel()
+        # Lets it store its last resume token before the client closes.
+        with suppress(asyncio.CancelledError):
+            await listener
+    close_mongo_connection()
 
-app = FastAPI(title=APP_TITLE)
+
+app = FastAPI(
+    title=APP_TITLE,
+    lifespan=lifespan,
+    default_response_class=MongoJSONResponse,
+)
 
 # Include our API routes
 app.include_router(api_router)
@@ -23,9 +63,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
-app.mount("/images", StaticFiles(directory="static/images"), name="images")
+# Uploaded images get random names and are never rewritten, so they are cached for good.
+static_files = CompressedStaticFiles(directory="static", immutable_paths=("images/products", "images/users"))
+app.mount("/static", static_files, name="static")
+app.mount(
+    "/images",
+    CompressedStaticFiles(directory="static/images", immutable_paths=("products", "users")),
+    name="images",
+)
 templates = Jinja2Templates(directory="templates")
+templates.env.globals["static_path"] = static_files.fingerprinted
 
 
 @app.get("/", include_in_schema=False)
@@ -0,0 +1,32 @@
+"""
+Rebuilds the sales rollups (`sales_rollups`, see api/services/analytics.py)
+from every completed order. Safe to run repeatedly: run it once after
+deploying, and again to reconcile the rollups if some completion could not
+update them. Orders completed while it runs may be counted twice or missed,
+so prefer a quiet moment.
+
+    python -m scripts.backfill_sales_rollups
+"""
+
+import argparse
+import asyncio
+import time
+
+from api.config import connect_to_mongo, close_mongo_connection
+from api.services import SalesRollupsService
+
+
+async def main():
+    await connect_to_mongo()
+    try:
+        start = time.perf_counter()
+        count = await SalesRollupsService.backfill()
+    finally:
+        close_mongo_connection()
+    print(f"{count} sales rollups rebuilt in {time.perf_counter() - start:.2f} s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+    asyncio.run(main())
@@ -0,0 +1,67 @@
+"""
+Concurrent-request throughput benchmark.
+
+Fires TOTAL requests at a running instance of the API, keeping CONCURRENCY of them
+in flight at any time, and reports requests per second and latency percentiles.
+Run it once against the synchronous data layer and once against the async one
+(same database, same worker count) to compare both:
+
+    fastapi run --workers 1 &
+    python -m scripts.bench_concurrency --url http://127.0.0.1:8000/api/products/ -c 64 -n 2000
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def worker(client: httpx.AsyncClient, url: str, queue: asyncio.Queue, latencies: list, errors: list):
+    while True:
+        try:
+            queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        start = time.perf_counter()
+        try:
+            response = await client.get(url)
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+        latencies.append(time.perf_counter() - start)
+
+
+async def main(url: str, concurrency: int, total: int):
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(worker(client, url, queue, latencies, errors) for _ in range(concurrency))
+        )
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"URL:          {url}")
+    print(f"Requests:     {total} ({len(errors)} errors), concurrency {concurrency}")
+    print(f"Elapsed:      {elapsed:.2f} s")
+    print(f"Throughput:   {total / elapsed:.1f} req/s")
+    print(f"Latency p50:  {quantiles[49] * 1000:.1f} ms")
+    print(f"Latency p95:  {quantiles[94] * 1000:.1f} ms")
+    print(f"Latency p99:  {quantiles[98] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000/api/products/")
+    parser.add_argument("-c", "--concurrency", type=int, default=64)
+    parser.add_argument("-n", "--total", type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(main(args.url, args.concurrency, args.total))
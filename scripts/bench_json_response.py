@@ -0,0 +1,78 @@
+"""
+Compares rendering a 100-product page with FastAPI's default path
+(`model_dump()` per product, `jsonable_encoder`, `JSONResponse`) against
+`validate_batch` plus `MongoJSONResponse` (orjson).
+
+Needs the same environment variables as the API (see .env.example), no database.
+
+    python -m scripts.bench_json_response -n 500
+"""
+
+import argparse
+import random
+import timeit
+from datetime import datetime
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from api.config import Category, Size
+from api.models import ProductFromDB, validate_batch
+from api.responses import MongoJSONResponse
+
+
+def fake_product(i: int) -> dict:
+    return {
+        "_id": ObjectId(),
+        "name": f"Producto {i}",
+        "description": "Descripción de ejemplo " * 4,
+        "price": round(random.uniform(1, 1000), 2),
+        "old_price": round(random.uniform(1, 1000), 2),
+        "stock": random.randint(0, 500),
+        "sku": f"SKU-{i:06d}",
+        "image": f"https://example.com/static/images/products/{i}.jpg",
+        "category": random.choice(list(Category)).value,
+        "details": {
+            "image_list": [f"https://example.com/static/images/products/{i}-{j}.jpg" for j in range(3)],
+            "sizes": [size.value for size in random.sample(list(Size), 3)],
+            "long_description": "Texto largo " * 20,
+        },
+        "tags": ["oferta", "nuevo", f"tag{i % 10}"],
+        "staff_id": ObjectId(),
+        "sales_count": random.randint(0, 1000),
+        "created_at": datetime.now(),
+        "modified_at": datetime.now(),
+    }
+
+
+def current_path(documents: list[dict]) -> bytes:
+    content = {
+        "product_list": [ProductFromDB.model_validate(doc).model_dump() for doc in documents],
+        "errors": [],
+    }
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def new_path(documents: list[dict], trusted: bool = False) -> bytes:
+    product_list, errors = validate_batch(ProductFromDB, documents, trusted=trusted)
+    return MongoJSONResponse({"product_list": product_list, "errors": errors}).body
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--number", type=int, default=500, help="pages rendered per case")
+    parser.add_argument("-p", "--page-size", type=int, default=100)
+    args = parser.parse_args()
+
+    documents = [fake_product(i) for i in range(args.page_size)]
+    cases = {
+        "jsonable_encoder + JSONResponse": lambda: current_path(documents),
+        "validate_batch + MongoJSONResponse": lambda: new_path(documents),
+        "validate_batch(trusted) + MongoJSONResponse": lambda: new_path(documents, trusted=True),
+    }
+    baseline = None
+    for name, case in cases.items():
+        seconds = min(timeit.repeat(case, number=args.number, repeat=3)) / args.number
+        baseline = baseline or seconds
+        print(f"{name:<45} {seconds * 1000:8.3f} ms/page  x{baseline / seconds:.2f}")
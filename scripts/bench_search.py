@@ -0,0 +1,131 @@
+"""
+Latency and recall of the in-process product search and autocomplete indexes
+(api/search) on a synthetic catalog, without a database.
+
+Queries are single words, pairs of words, words with one typo and common
+words. Recall@k of the typo queries is measured against the results of the
+same query spelled right. Autocomplete is timed for prefixes of 1 to 5 letters.
+
+Needs the same environment variables as the API (see .env.example).
+
+    python -m scripts.bench_search -n 100000 -q 1000
+"""
+
+import argparse
+import random
+import statistics
+import time
+import tracemalloc
+
+from api.config import Category
+from api.search import InvertedIndex, PrefixIndex
+from api.search.products import SEARCH_FIELDS
+
+SYLLABLES = ["ca", "mi", "sa", "re", "ra", "to", "zo", "pa", "ti", "lla", "al", "go", "don", "bu", "jo", "ne", "gro", "ver", "de", "lar"]
+COMMON_WORDS = ["de", "para", "con", "la", "el"]
+
+
+def make_vocabulary(size: int) -> list[str]:
+    words = set()
+    while len(words) < size:
+        words.add("".join(random.choices(SYLLABLES, k=random.randint(2, 4))))
+    return sorted(words)
+
+
+def fake_product(vocabulary: list[str]) -> dict:
+    return {
+        "name": " ".join(random.sample(vocabulary, 3)).capitalize(),
+        "description": " ".join(random.choices(vocabulary, k=12) + random.sample(COMMON_WORDS, 3)),
+        "tags": random.sample(vocabulary, 3),
+        "category": random.choice(list(Category)).value,
+    }
+
+
+def with_typo(word: str) -> str:
+    i = random.randrange(1, len(word) - 1)
+    typo = random.choice(["delete", "replace", "swap"])
+    if typo == "delete":
+        return word[:i] + word[i + 1 :]
+    if typo == "replace":
+        return word[:i] + random.choice("aeiourstln") + word[i + 1 :]
+    return word[:i] + word[i + 1] + word[i] + word[i + 2 :]
+
+
+def percentiles(samples: list[float]) -> str:
+    quantiles = statistics.quantiles(samples, n=100)
+    return f"p50 {quantiles[49] * 1000:7.3f} ms  p95 {quantiles[94] * 1000:7.3f} ms  p99 {quantiles[98] * 1000:7.3f} ms"
+
+
+def timed(index: InvertedIndex | PrefixIndex, queries: list[str], limit: int) -> tuple[list[float], list[list]]:
+    samples, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append([key for key, _ in index.search(query, limit)])
+        samples.append(time.perf_counter() - start)
+    return samples, results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--products", type=int, default=100_000)
+    parser.add_argument("-q", "--queries", type=int, default=1000, help="queries per kind")
+    parser.add_argument("-k", "--limit", type=int, default=10)
+    parser.add_argument("--vocabulary", type=int, default=20_000, help="distinct words in the catalog")
+    parser.add_argument("--memory", action="store_true", help="trace the index memory (slower build)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    vocabulary = make_vocabulary(args.vocabulary)
+    products = [fake_product(vocabulary) for _ in range(args.products)]
+
+    if args.memory:
+        tracemalloc.start()
+    index = InvertedIndex(SEARCH_FIELDS)
+    start = time.perf_counter()
+    for i, product in enumerate(products):
+        index.add(i, product)
+    build_seconds = time.perf_counter() - start
+    print(f"build: {build_seconds:.2f} s for {len(index)} products, {index.stats()}")
+    if args.memory:
+        print(f"index memory: {tracemalloc.get_traced_memory()[0] / 2**20:.1f} MiB")
+        tracemalloc.stop()
+
+    long_words = [word for word in vocabulary if len(word) >= 6]
+    words = random.choices(vocabulary, k=args.queries)
+    right = random.choices(long_words, k=args.queries)
+    cases = {
+        "one word": words,
+        "two words": [f"{a} {b}" for a, b in zip(words, reversed(words))],
+        "one typo": [with_typo(word) for word in right],
+        "common words": [" ".join(random.sample(COMMON_WORDS, 2)) for _ in range(args.queries)],
+    }
+    results = {}
+    for name, queries in cases.items():
+        samples, results[name] = timed(index, queries, args.limit)
+        print(f"{name:<14} {percentiles(samples)}")
+
+    _, expected = timed(index, right, args.limit)
+    recalls = [
+        len(set(found) & set(wanted)) / len(wanted)
+        for found, wanted in zip(results["one typo"], expected)
+        if wanted
+    ]
+    print(f"recall@{args.limit} of typo queries: {statistics.mean(recalls):.3f}")
+
+    names = PrefixIndex()
+    start = time.perf_counter()
+    names.add_many((i, product["name"], random.randint(0, 10_000)) for i, product in enumerate(products))
+    print(f"autocomplete build: {time.perf_counter() - start:.2f} s for {len(names.entries)} entries")
+    for length in range(1, 6):
+        prefixes = [product["name"][:length] for product in random.choices(products, k=args.queries)]
+        samples, _ = timed(names, prefixes, args.limit)
+        print(f"prefix of {length:<5} {percentiles(samples)}")
+    # A sale of a product in the cached tops, then the same prefixes again.
+    samples = []
+    for i, product in enumerate(random.choices(products, k=args.queries)):
+        key = names.search(product["name"][:1], 1)[0][0]
+        start = time.perf_counter()
+        names.add(key, names.values[key][0], names.values[key][1] + 1)
+        samples.append(time.perf_counter() - start)
+    print(f"rank update   {percentiles(samples)}")
@@ -0,0 +1,75 @@
+"""
+Contention benchmark for order completion stock updates.
+
+Creates a throwaway product with STOCK units and lets CONCURRENCY coroutines try
+to buy QUANTITY units each through `ProductsService.check_and_update_stock`,
+all at once. Exactly STOCK // QUANTITY of them must succeed and the final stock
+must never go negative. The product is deleted afterwards.
+
+    python -m scripts.bench_stock_contention --stock 100 -c 500
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from fastapi import HTTPException
+
+from api.config import connect_to_mongo, close_mongo_connection, mongo
+from api.models import OrderProduct
+from api.services import ProductsService
+
+
+async def buy(product_id, quantity: int) -> bool:
+    try:
+        await ProductsService.check_and_update_stock(
+            [OrderProduct(product_id=product_id, quantity=quantity)]
+        )
+        return True
+    except HTTPException:
+        return False
+
+
+async def main(stock: int, concurrency: int, quantity: int):
+    await connect_to_mongo()
+    print(f"Transactions: {'yes' if await mongo.transactions_supported() else 'no (compensating updates)'}")
+    result = await ProductsService.collection.insert_one(
+        {
+            "name": "bench_stock_contention",
+            "description": "Temporary product",
+            "price": 1,
+            "stock": stock,
+            "staff_id": None,
+            "created_at": datetime.now(),
+        }
+    )
+    product_id = result.inserted_id
+    try:
+        start = time.perf_counter()
+        outcomes = await asyncio.gather(
+            *(buy(product_id, quantity) for _ in range(concurrency))
+        )
+        elapsed = time.perf_counter() - start
+        product = await ProductsService.collection.find_one({"_id": product_id})
+    finally:
+        await ProductsService.collection.delete_one({"_id": product_id})
+        close_mongo_connection()
+
+    sold = sum(outcomes)
+    expected = min(concurrency, stock // quantity)
+    print(f"Attempts:     {concurrency} x {quantity} units on {stock} in stock")
+    print(f"Elapsed:      {elapsed:.2f} s ({concurrency / elapsed:.1f} attempts/s)")
+    print(f"Succeeded:    {sold} (expected {expected})")
+    print(f"Final stock:  {product['stock']}  sales_count: {product.get('sales_count')}")
+    oversold = product["stock"] < 0 or sold != expected
+    print("RESULT:       " + ("OVERSOLD OR LOST UPDATES" if oversold else "consistent"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stock", type=int, default=100)
+    parser.add_argument("-c", "--concurrency", type=int, default=500)
+    parser.add_argument("-q", "--quantity", type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(main(args.stock, args.concurrency, args.quantity))
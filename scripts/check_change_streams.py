@@ -0,0 +1,88 @@
+"""
+End-to-end check of the cache invalidation change stream against a real
+deployment. Change streams need a replica set; a local single-node one is enough:
+
+    docker run -d --name mongo-rs -p 27017:27017 mongo:7 --replSet rs0
+    docker exec mongo-rs mongosh --quiet --eval "rs.initiate()"
+    MONGODB_CONNECTION_STRING="mongodb://localhost:27017/?replicaSet=rs0&directConnection=true" \\
+        python -m scripts.check_change_streams
+
+It caches a throwaway product, changes it directly in the database (as another
+worker would) and measures how long the cached entry survives. It then stops the
+listener, changes the product again and checks that a new listener resumes from
+the stored token and still sees that change. The product is deleted afterwards.
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from api.__change_streams import ChangeStreamListener
+from api.config import connect_to_mongo, close_mongo_connection
+from api.services import ProductsService
+
+
+async def wait_until_evicted(product_id, timeout: float) -> float | None:
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if ProductsService.cache.get(product_id) is None:
+            return time.perf_counter() - start
+        await asyncio.sleep(0.005)
+    return None
+
+
+async def start(listener: ChangeStreamListener) -> asyncio.Task:
+    task = asyncio.create_task(listener.run())
+    while listener.state != "watching":
+        if task.done():
+            raise SystemExit(f"Listener stopped: {listener.state}. Is the server a replica set?")
+        await asyncio.sleep(0.05)
+    return task
+
+
+async def main(timeout: float):
+    await connect_to_mongo()
+    collection = ProductsService.collection
+    product_id = (
+        await collection.insert_one(
+            {
+                "name": "check_change_streams",
+                "description": "Temporary product",
+                "price": 1,
+                "stock": 1,
+                "staff_id": None,
+                "created_at": datetime.now(),
+            }
+        )
+    ).inserted_id
+    name = f"check_change_streams_{product_id}"
+    try:
+        listener = ChangeStreamListener(["products"], name=name)
+        task = await start(listener)
+        await ProductsService.fetch_one(product_id, store=True)
+        await collection.update_one({"_id": product_id}, {"$inc": {"stock": 1}})
+        elapsed = await wait_until_evicted(product_id, timeout)
+        print(f"Live invalidation:    {'FAILED' if elapsed is None else f'{elapsed * 1000:.1f} ms'}")
+
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await collection.update_one({"_id": product_id}, {"$inc": {"stock": 1}})
+        await ProductsService.fetch_one(product_id, store=True)
+        listener = ChangeStreamListener(["products"], name=name)
+        task = await start(listener)
+        elapsed = await wait_until_evicted(product_id, timeout)
+        print(f"Resumed invalidation: {'FAILED' if elapsed is None else f'{elapsed * 1000:.1f} ms'}")
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    finally:
+        await collection.delete_one({"_id": product_id})
+        await listener.tokens.delete_one({"_id": name})
+        close_mongo_connection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--timeout", type=float, default=5, help="seconds to wait for each invalidation")
+    args = parser.parse_args()
+    asyncio.run(main(args.timeout))
@@ -3,8 +3,10 @@ This script requires the file ADMIN_USER_CONF to be in the same directory as the
 script. Or you can set the username, email and password environment variables.
 """
 
+import asyncio
 import os
 
+from api.config import connect_to_mongo, close_mongo_connection
 from api.models import UserRegisterData
 from api.services import AuthService, UsersService
 
@@ -23,7 +25,19 @@ except FileNotFoundError:
 insertion_user = UserRegisterData.model_validate(data)
 hash_password = AuthService.get_password_hash(insertion_user.password)
 
+
+
+async def create_super_user():
+    await connect_to_mongo()
+    try:
+        return await UsersService.create_one(
+            insertion_user, hash_password=hash_password, make_it_admin=True
+        )
+    finally:
+        close_mongo_connection()
+
+
 print("Creating super user...")
-result = UsersService.create_one(insertion_user, hash_password=hash_password, make_it_admin=True)
+result = asyncio.run(create_super_user())
 
 print(f"Super user: {data["username"]} created with id: {result.inserted_id}")
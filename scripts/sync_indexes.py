@@ -0,0 +1,40 @@
+"""
+Reconciles the index registry (`INDEXES` in api/config/database.py) with the
+database and prints which indexes were created, changed, rebuilt, or are extra.
+
+The app only creates missing indexes at startup. Rebuilding a changed index
+drops it first, so run it with --rebuild once, from one place, when the
+registry changes.
+
+    python -m scripts.sync_indexes               # report changed and extra indexes
+    python -m scripts.sync_indexes --rebuild     # rebuild the changed ones
+    python -m scripts.sync_indexes --drop-extra  # drop the extra ones
+"""
+
+import argparse
+import asyncio
+
+from api.config import connect_to_mongo, close_mongo_connection, sync_indexes
+
+
+async def main(rebuild: bool, drop_extra: bool):
+    await connect_to_mongo()
+    try:
+        report = await sync_indexes(rebuild=rebuild, drop_extra=drop_extra)
+    finally:
+        close_mongo_connection()
+    for collection_name, result in report.items():
+        print(f"{collection_name}:")
+        for status, names in result.items():
+            if names:
+                print(f"  {status}: {', '.join(names)}")
+        if not any(result.values()):
+            print("  up to date")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rebuild", action="store_true", help="rebuild indexes whose definition changed")
+    parser.add_argument("--drop-extra", action="store_true", help="drop indexes not in the registry")
+    args = parser.parse_args()
+    asyncio.run(main(args.rebuild, args.drop_extra))
@@ -0,0 +1,128 @@
+"""
+Tests run against mongomock (through mongomock-motor) instead of a MongoDB
+server, and without the app lifespan: no index sync, search index build,
+sweeper or change stream listener unless a test starts them.
+
+    python -m pytest tests
+"""
+
+import os
+
+# api.config refuses to load without these.
+os.environ.setdefault("MONGODB_CONNECTION_STRING", "mongodb://127.0.0.1:27017")
+os.environ.setdefault("SECRET_KEY", "test-secret-key")
+os.environ.setdefault("REFRESH_KEY", "test-refresh-key")
+os.environ.setdefault("MAIL_FROM", "tests@example.com")
+
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import mongomock
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+
+from ..api.config import mongo
+from ..api.services import ProductsService
+from ..api.services.auth import access_security
+from ..main import app
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(autouse=True)
+def db():
+    """
+    Empty database and caches for every test.
+    """
+    mongo.client = AsyncMongoMockClient()
+    mongo.supports_transactions = False
+    ProductsService.clear_cache()
+    ProductsService.catalog_cache.clear()
+    ProductsService.search_cache.clear()
+    yield mongo.db
+    mongo.client = None
+
+
+class FakeSession:
+    """
+    Session running the transaction callback once, for the code path only:
+    mongomock has no transactions.
+    """
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def with_transaction(self, callback):
+        return await callback(self)
+
+
+@pytest.fixture
+def transactions(monkeypatch):
+    """
+    Takes the deployment for one supporting transactions, and lists the
+    sessions started.
+    """
+    sessions = []
+
+    async def start_session():
+        sessions.append(FakeSession())
+        return sessions[-1]
+
+    monkeypatch.setattr(mongo, "supports_transactions", True)
+    monkeypatch.setattr(mongo.client, "start_session", start_session, raising=False)
+    mongomock.ignore_feature("session")
+    yield sessions
+    mongomock.warn_on_feature("session")
+
+
+@asynccontextmanager
+async def no_lifespan(app):
+    yield
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app.router, "lifespan_context", no_lifespan)
+    with TestClient(app) as client:
+        yield client
+
+
+def auth_headers(role: str = "admin", id: ObjectId | None = None) -> dict[str, str]:
+    """
+    Bearer header of a user with `role`, as the login would sign it.
+    """
+    token = access_security.create_access_token(
+        subject={
+            "id": str(id or ObjectId()),
+            "username": "test",
+            "role": role,
+            "created_at": datetime.now().isoformat(),
+            "modified_at": None,
+            "is_active": True,
+        }
+    )
+    return {"Authorization": f"Bearer {token}"}
+
+
+def product(**fields) -> dict:
+    """
+    Product document as stored, with `fields` overriding the defaults.
+    """
+    return {
+        "_id": ObjectId(),
+        "name": "Remera",
+        "description": "Remera de algodón",
+        "price": 100.0,
+        "stock": 10,
+        "staff_id": ObjectId(),
+        "created_at": datetime.now(),
+        **fields,
+    }
@@ -0,0 +1,50 @@
+from datetime import date, datetime
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from ..api.services import SalesRollupsService
+from .conftest import auth_headers
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_days_without_sales_are_zero(db):
+    updated_at = datetime(2024, 8, 2, 12)
+    await db.sales_rollups.insert_one(
+        {"_id": {"by": "day", "key": "2024-08-02"}, "revenue": 300.0, "units": 3, "orders": 2, "updated_at": updated_at}
+    )
+
+    days = await SalesRollupsService.get_days(date(2024, 8, 1), date(2024, 8, 3))
+
+    assert [(day["key"], day["revenue"], day["units"], day["orders"]) for day in days] == [
+        ("2024-08-01", 0, 0, 0),
+        ("2024-08-02", 300.0, 3, 2),
+        ("2024-08-03", 0, 0, 0),
+    ]
+
+
+@pytest.mark.parametrize("start, end", [(date(2024, 8, 2), date(2024, 8, 1)), (date(2023, 1, 1), date(2024, 8, 1))])
+async def test_day_ranges_are_limited(start, end):
+    with pytest.raises(HTTPException) as error:
+        await SalesRollupsService.get_days(start, end)
+    assert error.value.status_code == 400
+
+
+async def test_every_category_is_listed(db):
+    await db.sales_rollups.insert_one({"_id": {"by": "category", "key": "calzado"}, "revenue": 50.0, "units": 1, "orders": 1})
+
+    categories = {rollup["key"]: rollup["revenue"] for rollup in await SalesRollupsService.get_categories()}
+
+    assert categories["calzado"] == 50.0
+    assert set(categories.values()) == {0, 50.0}
+
+
+def test_product_sales_are_staff_only(client):
+    id = ObjectId()
+
+    assert client.get(f"/api/analytics/sales/products/{id}", headers=auth_headers("customer")).status_code == 401
+    response = client.get(f"/api/analytics/sales/products/{id}", headers=auth_headers("staff"))
+    assert response.status_code == 200
+    assert response.json() == {"by": "product", "key": str(id), "revenue": 0, "units": 0, "orders": 0, "updated_at": None}
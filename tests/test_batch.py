@@ -0,0 +1,49 @@
+from datetime import datetime
+
+from bson import ObjectId
+
+from ..api.models import OrderFromDB, ProductFromDB, validate_batch
+from ..api.responses import json_dumps
+from .conftest import product
+
+
+def test_trusted_reads_match_validated_reads():
+    documents = [
+        product(price=100, details={"sizes": ["m"]}, category="calzado", tags=["verano"]),
+        product(price=99.5, old_price=120, reserved=2),
+    ]
+
+    trusted = validate_batch(ProductFromDB, documents, trusted=True, sample_rate=0)
+    validated = validate_batch(ProductFromDB, documents, trusted=False)
+
+    assert json_dumps(trusted) == json_dumps(validated)
+    assert trusted[0][0]["price"] == 100.0 and isinstance(trusted[0][0]["price"], float)
+    assert trusted[0][0]["details"] == {"image_list": None, "sizes": ["m"], "long_description": None}
+
+
+def test_trusted_order_lines_keep_their_model():
+    order = {
+        "_id": ObjectId(),
+        "customer_id": ObjectId(),
+        "status": "completed",
+        "total_price": 10,
+        "created_at": datetime(2024, 8, 1),
+        "products": [
+            {"product_id": ObjectId(), "quantity": 1, "name": "Remera", "price": 5},
+            {"product_id": ObjectId(), "quantity": 2},
+        ],
+    }
+
+    trusted = validate_batch(OrderFromDB, [order], trusted=True, sample_rate=0)
+
+    assert json_dumps(trusted) == json_dumps(validate_batch(OrderFromDB, [order], trusted=False))
+
+
+def test_unsampled_documents_that_cannot_be_built_fall_back_to_validation():
+    broken = product()
+    del broken["stock"]
+
+    documents, errors = validate_batch(ProductFromDB, [product(), broken], trusted=True, sample_rate=0)
+
+    assert len(documents) == 1
+    assert len(errors) == 1 and errors[0].startswith("Validation error: ")
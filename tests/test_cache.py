@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+from ..api.__change_streams import change_listener
+from ..api.models import OrderProduct, ProductUpdateData
+from ..api.services import ProductsService, ReservationsService
+from .conftest import product
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def product_id(db):
+    return (await db.products.insert_one(product(stock=5))).inserted_id
+
+
+def update(id, **fields) -> dict:
+    return {
+        "operationType": "update",
+        "ns": {"db": "test", "coll": "products"},
+        "documentKey": {"_id": id},
+        "updateDescription": {"updatedFields": fields, "removedFields": []},
+    }
+
+
+async def test_holds_keep_catalog_pages_but_not_products(product_id):
+    version = ProductsService.catalog_version
+    await ProductsService.get_one(product_id)
+
+    await ReservationsService.hold(ObjectId(), [OrderProduct(product_id=product_id, quantity=2)])
+
+    assert ProductsService.catalog_version == version
+    assert (await ProductsService.get_one(product_id)).available_stock == 3
+
+
+async def test_listed_writes_evict_catalog_pages(product_id):
+    version = ProductsService.catalog_version
+
+    await ProductsService.update_one(product_id, ProductUpdateData(price=80.0))
+
+    assert ProductsService.catalog_version > version
+
+
+async def test_orders_keep_search_results(product_id):
+    version = ProductsService.search_version
+    order = [OrderProduct(product_id=product_id, quantity=2)]
+
+    await ProductsService.check_and_update_stock(order)
+    await ProductsService.release_stock({product_id: 2})
+    assert ProductsService.search_version == version
+
+    await ProductsService.update_one(product_id, ProductUpdateData(name="Buzo"))
+    assert ProductsService.search_version > version
+
+
+async def test_catalog_pages_are_reused_across_holds(client, product_id):
+    client.get("/api/products/")
+    hits = ProductsService.catalog_cache.hits
+
+    await ReservationsService.hold(ObjectId(), [OrderProduct(product_id=product_id, quantity=1)])
+    client.get("/api/products/")
+
+    assert ProductsService.catalog_cache.hits == hits + 1
+
+
+async def test_released_stock_is_not_answered_as_not_modified(client, db):
+    # Last-Modified has whole seconds, so the product was last written before.
+    written_at = datetime.now() - timedelta(minutes=1)
+    product_id = (await db.products.insert_one(product(stock=5, modified_at=written_at))).inserted_id
+    order_id = ObjectId()
+    await ReservationsService.hold(order_id, [OrderProduct(product_id=product_id, quantity=2)])
+    await db.products.update_one({"_id": product_id}, {"$set": {"modified_at": written_at}})
+    held = client.get(f"/api/products/{product_id}")
+
+    await ReservationsService.release(order_id)
+
+    since = client.get(f"/api/products/{product_id}", headers={"If-Modified-Since": held.headers["Last-Modified"]})
+    match = client.get(f"/api/products/{product_id}", headers={"If-None-Match": held.headers["ETag"]})
+    assert since.status_code == match.status_code == 200
+    assert since.json()["available_stock"] == 5
+
+
+@pytest.mark.parametrize(
+    "change, evicts",
+    [
+        (update(ObjectId(), reserved=3, modified_at=None), False),
+        (update(ObjectId(), **{"pending_holds.0": ObjectId()}), False),
+        (update(ObjectId(), price=80.0, modified_at=None), True),
+        (update(ObjectId(), **{"details.sizes": ["m"]}), True),
+        ({"operationType": "insert", "ns": {"coll": "products"}, "documentKey": {"_id": ObjectId()}}, True),
+    ],
+)
+async def test_other_workers_holds_keep_catalog_pages(change, evicts):
+    version = ProductsService.catalog_version
+
+    change_listener.handle(change)
+
+    assert (ProductsService.catalog_version > version) is evicts
+
+
+@pytest.mark.parametrize(
+    "change, evicts",
+    [
+        (update(ObjectId(), stock=3, sales_count=2, modified_at=None), False),
+        (update(ObjectId(), name="Buzo", modified_at=None), True),
+    ],
+)
+async def test_other_workers_orders_keep_search_results(change, evicts):
+    version = ProductsService.search_version
+
+    change_listener.handle(change)
+
+    assert (ProductsService.search_version > version) is evicts
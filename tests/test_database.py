@@ -0,0 +1,108 @@
+import logging
+from types import SimpleNamespace
+
+import pytest
+from pymongo.errors import OperationFailure, ServerSelectionTimeoutError
+
+from ..api.config import database, mongo
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeClient:
+    """
+    Client whose `hello` fails as many times as `failures` before answering.
+    """
+
+    def __init__(self, hello: dict, failures: int = 0):
+        self.hello = hello
+        self.failures = failures
+        self.admin = SimpleNamespace(command=self.command)
+
+    async def command(self, name: str):
+        assert name == "hello"
+        if self.failures:
+            self.failures -= 1
+            raise ServerSelectionTimeoutError("no servers found")
+        return self.hello
+
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    def install(hello: dict, failures: int = 0) -> FakeClient:
+        client = FakeClient(hello, failures)
+        monkeypatch.setattr(database, "AsyncIOMotorClient", lambda *args, **kwargs: client)
+        return client
+
+    return install
+
+
+async def test_replica_sets_support_transactions(fake_client):
+    fake_client({"setName": "rs0"})
+    await database.connect_to_mongo()
+    assert mongo.supports_transactions is True
+
+
+async def test_standalone_servers_do_not(fake_client):
+    fake_client({"isWritablePrimary": True})
+    await database.connect_to_mongo()
+    assert mongo.supports_transactions is False
+
+
+async def test_failed_hello_is_logged_and_checked_again(fake_client, caplog):
+    fake_client({"msg": "isdbgrid"}, failures=1)
+    with caplog.at_level(logging.ERROR, logger="uvicorn"):
+        await database.connect_to_mongo()
+
+    assert "Could not reach MongoDB" in caplog.text
+    assert mongo.supports_transactions is None
+    assert await mongo.transactions_supported() is True
+
+
+async def test_missing_indexes_are_created_once(db):
+    report = await database.sync_indexes()
+
+    assert report["users"]["created"] == ["username_unique", "email_unique"]
+    assert "username_unique" in await db.users.index_information()
+    # mongomock keeps no partialFilterExpression, so products.sku_unique always differs.
+    report = await database.sync_indexes()
+    assert not any(report["users"].values()) and not any(report["orders"].values())
+
+
+async def test_changed_indexes_are_only_reported_by_default(db):
+    await db.orders.create_index("customer_id", name="customer_id", unique=True)
+
+    report = await database.sync_indexes()
+
+    assert report["orders"]["changed"] == ["customer_id"]
+    assert (await db.orders.index_information())["customer_id"].get("unique")
+    report = await database.sync_indexes(rebuild=True)
+    assert report["orders"]["rebuilt"] == ["customer_id"]
+    assert not (await db.orders.index_information())["customer_id"].get("unique")
+
+
+async def test_failed_rebuilds_restore_the_old_index(db):
+    await db.users.insert_many([{"username": "ana"}, {"username": "ana"}])
+    await db.users.create_index("username", name="username_unique")
+
+    report = await database.sync_indexes(rebuild=True)
+
+    assert report["users"]["failed"][0].startswith("username_unique: ")
+    index = (await db.users.index_information())["username_unique"]
+    assert list(index["key"]) == [("username", 1)] and not index.get("unique")
+
+
+async def test_extra_indexes_another_process_dropped_are_reported(db, monkeypatch):
+    await db.orders.create_index("status", name="status")
+
+    async def drop_index(name):
+        raise OperationFailure(f"index not found with name [{name}]")
+
+    orders = db.orders
+    monkeypatch.setattr(orders, "drop_index", drop_index, raising=False)
+    get_collection = type(db).__getitem__
+    monkeypatch.setattr(type(db), "__getitem__", lambda self, name: orders if name == "orders" else get_collection(self, name))
+    report = await database.sync_indexes(drop_extra=True)
+
+    assert report["orders"]["dropped"] == []
+    assert report["orders"]["failed"] == ["status: index not found with name [status]"]
@@ -0,0 +1,54 @@
+import pytest
+
+from ..api.search import ProductSearchIndex
+from ..api.services import products as products_service
+from .conftest import product
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def catalog(db, monkeypatch):
+    await db.products.insert_many(
+        [
+            product(category="calzado", price=30000.0, tags=["running", "hombre"], details={"sizes": ["m", "l"]}),
+            product(category="calzado", price=60000.0, tags=["running"], details={"sizes": ["l"]}),
+            product(category="indumentaria", price=8000.0, tags=["hombre"], details={"sizes": ["m"]}),
+            product(category="accesorios", price=1000.0),
+        ]
+    )
+    search = ProductSearchIndex()
+    await search.start()
+    monkeypatch.setattr(products_service, "product_search", search)
+
+
+def facets(client, **params) -> dict:
+    response = client.get("/api/products/facets", params=params)
+    assert response.status_code == 200
+    return response.json()
+
+
+def counts(listed: list[dict], key: str = "value") -> dict:
+    return {facet[key]: facet["count"] for facet in listed if facet["count"]}
+
+
+async def test_filtered_facets_count_the_matching_products(client, catalog):
+    filtered = facets(client, filter="category=calzado", sort_by="price", sort_dir="desc")
+
+    assert filtered["total"] == 2
+    assert [item["price"] for item in filtered["product_list"]] == [60000.0, 30000.0]
+    assert counts(filtered["facets"]["category"]) == {"calzado": 2}
+    assert counts(filtered["facets"]["sizes"]) == {"l": 2, "m": 1}
+    assert counts(filtered["facets"]["tags"]) == {"running": 2, "hombre": 1}
+    assert counts(filtered["facets"]["price"], "min") == {25000.0: 1, 50000.0: 1}
+
+
+async def test_catalog_facets_match_an_aggregation_over_every_product(client, catalog):
+    # The whole catalog comes from the search index; any filter matching
+    # every product takes the aggregation instead.
+    catalog_wide = facets(client, sort_by="price")
+    aggregated = facets(client, filter="price>=0", sort_by="price")
+
+    assert catalog_wide == aggregated
+    assert catalog_wide["total"] == 4
+    assert counts(catalog_wide["facets"]["category"]) == {"calzado": 2, "indumentaria": 1, "accesorios": 1}
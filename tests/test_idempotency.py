@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo.errors import AutoReconnect
+
+from ..api.services import IdempotencyService
+from ..api.services import idempotency as idempotency_module
+from ..api.services.idempotency import REPLAYED_HEADER, response_cache
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeRequest:
+    method = "POST"
+    url = SimpleNamespace(path="/api/orders/")
+
+    async def body(self) -> bytes:
+        return b'{"products": []}'
+
+
+@pytest.fixture
+def idempotency():
+    return IdempotencyService(FakeRequest(), SimpleNamespace(auth_user_id=ObjectId()), "retry-1")
+
+
+def counting(*outcomes):
+    """
+    `produce` returning (or raising) each outcome in turn, counting its calls.
+    """
+    calls = []
+
+    async def produce():
+        outcome = outcomes[len(calls)]
+        calls.append(outcome)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    return produce, calls
+
+
+async def test_responses_are_replayed(idempotency):
+    produce, calls = counting({"id": 1})
+
+    first = await idempotency.run(produce, 201)
+    retry = await idempotency.run(produce, 201)
+
+    assert len(calls) == 1
+    assert (retry.status_code, retry.body) == (first.status_code, first.body)
+    assert retry.headers[REPLAYED_HEADER] == "true"
+
+
+# Old locks too: the worker may have died after its side effects.
+@pytest.mark.parametrize("age", [timedelta(0), timedelta(hours=1)])
+async def test_retries_while_another_worker_runs_keep_its_lock(db, idempotency, age):
+    created_at = datetime.now() - age
+    other_lock = {"_id": idempotency.key, "lock_id": ObjectId(), "fingerprint": "x", "created_at": created_at}
+    await db.idempotency_keys.insert_one(other_lock)
+    produce, calls = counting({"id": 1})
+
+    with pytest.raises(HTTPException) as error:
+        await idempotency.run(produce)
+
+    assert error.value.status_code == 409
+    assert calls == []
+    assert (await db.idempotency_keys.find_one({"_id": idempotency.key}))["lock_id"] == other_lock["lock_id"]
+
+
+@pytest.mark.parametrize("detail", ["Producto 1 sin stock", "La reserva de la orden 1 cambió, intentá de nuevo."])
+async def test_conflicts_free_the_key_for_a_retry(db, idempotency, detail):
+    produce, calls = counting(HTTPException(409, detail), {"id": 1})
+
+    with pytest.raises(HTTPException):
+        await idempotency.run(produce)
+    assert await db.idempotency_keys.count_documents({}) == 0
+    response = await idempotency.run(produce, 201)
+
+    assert len(calls) == 2
+    assert response.status_code == 201 and REPLAYED_HEADER not in response.headers
+
+
+async def test_other_client_errors_are_replayed(idempotency):
+    produce, calls = counting(HTTPException(404, "Orden no encontrada"))
+
+    first = await idempotency.run(produce)
+    retry = await idempotency.run(produce)
+
+    assert len(calls) == 1
+    assert first.status_code == retry.status_code == 404
+
+
+class FailingWrites:
+    """
+    The idempotency keys collection with every `update_one` failing.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.updates = 0
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    async def update_one(self, *args, **kwargs):
+        self.updates += 1
+        raise AutoReconnect("connection lost")
+
+
+async def test_keys_stay_locked_if_the_response_cannot_be_stored(db, idempotency, monkeypatch):
+    writes = FailingWrites(db.idempotency_keys)
+    monkeypatch.setattr(IdempotencyService, "collection", writes)
+    monkeypatch.setattr(idempotency_module, "STORE_RETRY_SECONDS", 0)
+    produce, calls = counting({"id": 1}, {"id": 2})
+
+    response = await idempotency.run(produce, 201)
+    # As seen by another worker.
+    response_cache.pop(idempotency.key)
+    with pytest.raises(HTTPException) as error:
+        await idempotency.run(produce, 201)
+
+    assert response.status_code == 201 and writes.updates == idempotency_module.STORE_ATTEMPTS
+    assert error.value.status_code == 409 and len(calls) == 1
+    assert "status_code" not in await db.idempotency_keys.find_one({"_id": idempotency.key})
@@ -0,0 +1,107 @@
+import pytest
+from bson import ObjectId
+from pymongo.errors import AutoReconnect
+
+from ..api.models import BaseOrder, OrderProduct, OrderStatus, ReservationStatus
+from ..api.services import OrdersService, ProductsService, ReservationsService
+from .conftest import auth_headers, product
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def product_id(db):
+    return (await db.products.insert_one(product(stock=5, reserved=0, sales_count=0))).inserted_id
+
+
+@pytest.fixture
+async def order_id(product_id):
+    order = BaseOrder(products=[OrderProduct(product_id=product_id, quantity=2)])
+    return (await OrdersService.create_one(order, ObjectId(), ReservationsService)).inserted_id
+
+
+async def complete(order_id):
+    # As `get_completion_summary` prices it; mongomock drops the lines pushed by its `$group`.
+    order = await OrdersService.get_one(order_id)
+    lines = [
+        {"product_id": line.product_id, "quantity": line.quantity, "name": "Remera", "price": 100.0, "image": None}
+        for line in order.products
+    ]
+    summary = {"status": order.status, "products": lines, "total_price": 100.0 * sum(line["quantity"] for line in lines)}
+    return await OrdersService.complete(order_id, summary, ProductsService, ReservationsService)
+
+
+async def state(db, product_id, order_id) -> tuple:
+    stored = await db.products.find_one({"_id": product_id})
+    return (
+        (stored["stock"], stored["reserved"], stored["sales_count"]),
+        (await db.reservations.find_one({"_id": order_id}))["status"],
+        (await db.orders.find_one({"_id": order_id}))["status"],
+    )
+
+
+async def test_completing_consumes_the_hold(db, product_id, order_id):
+    order, _ = await complete(order_id)
+
+    assert order.status == OrderStatus.completed and order.total_price == 200.0
+    assert await state(db, product_id, order_id) == ((3, 0, 2), ReservationStatus.consumed, OrderStatus.completed)
+
+
+@pytest.mark.parametrize("failing", ["check_and_update_stock", "mark_completed"])
+async def test_failed_completions_put_stock_and_hold_back(db, product_id, order_id, monkeypatch, failing):
+    service = ProductsService if failing == "check_and_update_stock" else OrdersService
+
+    async def fail(*args, **kwargs):
+        raise AutoReconnect("connection lost")
+
+    monkeypatch.setattr(service, failing, fail)
+    with pytest.raises(AutoReconnect):
+        await complete(order_id)
+    monkeypatch.undo()
+
+    assert await state(db, product_id, order_id) == ((5, 2, 0), ReservationStatus.active, OrderStatus.pending)
+    # A retry takes the stock once.
+    await complete(order_id)
+    assert await state(db, product_id, order_id) == ((3, 0, 2), ReservationStatus.consumed, OrderStatus.completed)
+
+
+async def test_completions_use_a_transaction_when_supported(db, product_id, order_id, transactions):
+    await complete(order_id)
+
+    assert len(transactions) == 1
+    assert await state(db, product_id, order_id) == ((3, 0, 2), ReservationStatus.consumed, OrderStatus.completed)
+
+
+@pytest.mark.parametrize(
+    "method, path, body",
+    [
+        ("put", "/api/orders/cancel/{}", None),
+        ("put", "/api/orders/update/{}", {"products": []}),
+    ],
+)
+async def test_orders_completed_meanwhile_are_not_changed(client, db, product_id, order_id, monkeypatch, method, path, body):
+    # Read as pending by the request, completed before it writes.
+    pending = await OrdersService.get_one(order_id)
+    await complete(order_id)
+
+    async def get_one(cls, id):
+        return pending
+
+    monkeypatch.setattr(OrdersService, "get_one", classmethod(get_one))
+    response = client.request(method, path.format(order_id), json=body, headers=auth_headers())
+
+    assert response.status_code == 409
+    assert await state(db, product_id, order_id) == ((3, 0, 2), ReservationStatus.consumed, OrderStatus.completed)
+    assert len((await db.orders.find_one({"_id": order_id}))["products"]) == 1
+
+
+async def test_updates_move_the_hold_with_the_lines(client, db, product_id, order_id):
+    other = (await db.products.insert_one(product(stock=5, reserved=0, sales_count=0))).inserted_id
+    body = {"products": [{"product_id": str(other), "quantity": 1}]}
+
+    response = client.put(f"/api/orders/update/{order_id}", json=body, headers=auth_headers())
+    await complete(order_id)
+
+    assert response.status_code == 200
+    assert await state(db, product_id, order_id) == ((5, 0, 0), ReservationStatus.consumed, OrderStatus.completed)
+    assert (await state(db, other, order_id))[0] == (4, 0, 1)
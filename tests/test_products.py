@@ -0,0 +1,109 @@
+import asyncio
+import io
+import json
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from ..api.config.database import INDEXES
+from ..api.models import OrderProduct
+from ..api.services import ProductsService
+from ..api.services import products as products_service
+from .conftest import product
+
+pytestmark = pytest.mark.anyio
+
+STOCK_FIELDS = {"stock": 1, "reserved": 1, "sales_count": 1}
+
+
+async def insert(db, **fields):
+    return (await db.products.insert_one(product(**fields))).inserted_id
+
+
+async def stock_of(db, *ids) -> list[dict]:
+    return [await db.products.find_one({"_id": id}, {"_id": 0, **STOCK_FIELDS}) for id in ids]
+
+
+async def test_failed_lines_leave_every_product_unchanged(db):
+    remera = await insert(db, stock=5, reserved=2, sales_count=1)
+    buzo = await insert(db, stock=1, reserved=0, sales_count=0)
+    before = await stock_of(db, remera, buzo)
+    order = [OrderProduct(product_id=remera, quantity=3), OrderProduct(product_id=buzo, quantity=2)]
+
+    with pytest.raises(HTTPException) as error:
+        await ProductsService.check_and_update_stock(order, held={remera: 2})
+
+    assert error.value.status_code == 409
+    assert await stock_of(db, remera, buzo) == before
+
+
+async def test_held_units_must_still_be_reserved(db):
+    remera = await insert(db, stock=5, reserved=1, sales_count=0)
+
+    with pytest.raises(HTTPException):
+        await ProductsService.check_and_update_stock([OrderProduct(product_id=remera, quantity=2)], held={remera: 2})
+    await ProductsService.check_and_update_stock([OrderProduct(product_id=remera, quantity=2)], held={remera: 1})
+
+    assert await stock_of(db, remera) == [{"stock": 3, "reserved": 0, "sales_count": 2}]
+
+
+async def test_concurrent_orders_never_oversell(db):
+    remera = await insert(db, stock=5, reserved=1)
+    order = [OrderProduct(product_id=remera, quantity=1)]
+
+    results = await asyncio.gather(
+        *(ProductsService.check_and_update_stock(order) for _ in range(10)), return_exceptions=True
+    )
+
+    assert sum(result is None for result in results) == 4
+    assert all(result.status_code == 409 for result in results if result is not None)
+    assert (await stock_of(db, remera))[0]["stock"] == 1
+
+
+def ndjson(*rows) -> io.BytesIO:
+    return io.BytesIO("\n".join(row if isinstance(row, str) else json.dumps(row) for row in rows).encode())
+
+
+async def test_imports_are_written_a_chunk_at_a_time(db, monkeypatch):
+    monkeypatch.setattr(products_service, "IMPORT_CHUNK_SIZE", 2)
+    bulk_writes = []
+    bulk_write = type(db.products).bulk_write
+
+    async def counting_bulk_write(collection, operations, **kwargs):
+        bulk_writes.append(len(operations))
+        return await bulk_write(collection, operations, **kwargs)
+
+    monkeypatch.setattr(type(db.products), "bulk_write", counting_bulk_write)
+    rows = [{"name": f"Remera {i}", "description": "Algodón", "price": 100, "stock": 1} for i in range(5)]
+
+    report = await ProductsService.import_many(ndjson(*rows), "ndjson", ObjectId())
+
+    assert bulk_writes == [2, 2, 1]
+    assert report == {"rows": 5, "inserted": 5, "error_count": 0, "errors": []}
+    assert await db.products.count_documents({}) == 5
+
+
+async def test_import_errors_are_reported_per_row(db, monkeypatch):
+    monkeypatch.setattr(products_service, "IMPORT_CHUNK_SIZE", 2)
+    await db.products.create_indexes(INDEXES["products"])
+    await insert(db, sku="REM-1")
+    row = {"description": "Algodón", "price": 100, "stock": 1}
+
+    report = await ProductsService.import_many(
+        ndjson(
+            {"name": "Remera", "sku": "REM-1", **row},
+            {"name": "Buzo", "sku": "BUZ-1", **row},
+            "{no es json",
+            {"name": "Gorra", "sku": "GOR-1", **row, "price": -1},
+            {"name": "Buzo rojo", "sku": "BUZ-1", **row},
+        ),
+        "ndjson",
+        ObjectId(),
+    )
+
+    assert report["rows"] == 5 and report["inserted"] == 1
+    assert [error["row"] for error in report["errors"]] == [1, 3, 4, 5]
+    assert report["errors"][0]["error"] == "El producto REM-1 ya existe."
+    assert report["errors"][3]["error"] == "El producto BUZ-1 ya existe."
+    assert await db.products.count_documents({"sku": "BUZ-1"}) == 1
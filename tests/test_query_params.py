@@ -0,0 +1,145 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from ..api.__common_deps import FILTERABLE_FIELDS, QueryParams, compile_filter
+from .conftest import auth_headers
+
+pytestmark = pytest.mark.anyio
+
+
+async def page_through(collection, **params) -> list[ObjectId]:
+    """
+    `_id`s of every document, following `next_cursor` page after page.
+    """
+    ids, cursor = [], ""
+    while True:
+        query = QueryParams(pagination="cursor", cursor=cursor, limit=2, **params)
+        page = await query.query_collection(collection).to_list(length=None)
+        ids += [document["_id"] for document in page]
+        if not (cursor := query.next_cursor(page[-1] if page else None, len(page))):
+            return ids
+
+
+@pytest.fixture
+async def products(db, monkeypatch):
+    # A dotted sort key that is not a list.
+    monkeypatch.setitem(FILTERABLE_FIELDS["products"], "details.rank", float)
+    # Nulls and missing values in between, and repeated values across pages.
+    prices = [None, 30.0, 10.0, "missing", 20.0, None, 10.0, "missing", 30.0]
+    documents = [
+        {"_id": ObjectId(), **({} if price == "missing" else {"old_price": price, "details": {"rank": price}})}
+        for price in prices
+    ]
+    await db.products.insert_many(documents)
+    return db.products
+
+
+@pytest.mark.parametrize("sort_by", ["old_price", "details.rank"])
+@pytest.mark.parametrize("sort_dir", ["asc", "desc"])
+async def test_keyset_pages_include_null_and_missing_values(products, sort_by, sort_dir):
+    expected = await products.find().sort([(sort_by, 1 if sort_dir == "asc" else -1), ("_id", 1 if sort_dir == "asc" else -1)]).to_list(length=None)
+
+    ids = await page_through(products, sort_by=sort_by, sort_dir=sort_dir)
+
+    assert ids == [document["_id"] for document in expected]
+    assert len(ids) == 9
+
+
+def test_next_cursor_reads_dotted_sort_keys():
+    query = QueryParams(pagination="cursor", limit=1, sort_by="details.rank")
+    document = {"_id": ObjectId(), "details": {"rank": 3}}
+
+    cursor = QueryParams(pagination="cursor", cursor=query.next_cursor(document, 1), sort_by="details.rank")
+
+    assert cursor.keyset_filter() == {
+        "$or": [{"details.rank": {"$gt": 3}}, {"details.rank": 3, "_id": {"$gt": document["_id"]}}]
+    }
+
+
+@pytest.mark.parametrize(
+    "raw_filter, expected",
+    [
+        ("sku=12345", {"sku": {"$eq": "12345"}}),
+        ("name=inf,description=nan", {"name": {"$eq": "inf"}, "description": {"$eq": "nan"}}),
+        ("price>=10,price<20.5", {"price": {"$gte": 10.0, "$lt": 20.5}}),
+        ("stock=3|4", {"stock": {"$in": [3, 4]}}),
+        ("created_at>=2024-08-01", {"created_at": {"$gte": datetime(2024, 8, 1)}}),
+        ("staff_id=66b0f1b2c3d4e5f6a7b8c9d0", {"staff_id": {"$eq": ObjectId("66b0f1b2c3d4e5f6a7b8c9d0")}}),
+        ("name~^rem", {"name": {"$regex": "^rem", "$options": "i"}}),
+    ],
+)
+def test_values_are_parsed_as_the_field_type(raw_filter, expected):
+    assert compile_filter(raw_filter, "products") == expected
+
+
+def test_user_flags_are_booleans():
+    assert compile_filter("is_active=false", "users") == {"is_active": {"$eq": False}}
+
+
+@pytest.mark.parametrize(
+    "raw_filter",
+    [
+        "price>>3",
+        "price=>3",
+        "price=abc",
+        "price=inf",
+        "stock=1.5",
+        "stock=1|x",
+        "staff_id=123",
+        "created_at>=ayer",
+        "price~^1",
+        "password=x",
+        "price",
+    ],
+)
+def test_malformed_filters_are_rejected(raw_filter):
+    with pytest.raises(HTTPException) as error:
+        compile_filter(raw_filter, "products")
+    assert error.value.status_code == 400
+
+
+def test_malformed_filters_are_bad_requests(client):
+    response = client.get("/api/products/", params={"filter": "price>>3"})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("path", ["/api/Users/", "/api/orders/get_all"])
+@pytest.mark.parametrize("params", [{"filter": "password=x"}, {"pagination": "cursor", "cursor": "x"}])
+def test_bad_streams_fail_before_the_response_starts(client, path, params):
+    response = client.get(path, params={"stream": True, **params}, headers=auth_headers())
+
+    assert response.status_code == 400
+    assert response.headers["content-type"] == "application/json"
+
+
+@pytest.mark.parametrize(
+    "params, sort",
+    [
+        ({"sort_by": "price", "sort_dir": "desc"}, {"price": -1}),
+        ({"sort_by": "price", "pagination": "cursor"}, {"price": 1, "_id": 1}),
+    ],
+)
+def test_aggregations_sort_before_the_facets(params, sort):
+    pipelines = []
+    collection = SimpleNamespace(name="products", aggregate=pipelines.append)
+
+    QueryParams(filter="category=calzado", **params).aggregate_collection(collection, {})
+
+    [pipeline] = pipelines
+    assert [next(iter(stage)) for stage in pipeline] == ["$match", "$sort", "$facet"]
+    assert pipeline[1]["$sort"] == sort
+    assert all("$sort" not in stage for stage in pipeline[2]["$facet"]["results"])
+
+
+@pytest.mark.parametrize("pagination", ["offset", "cursor"])
+def test_only_filterable_fields_can_be_sorted_on(client, pagination):
+    params = {"pagination": pagination, "sort_by": "hash_password"}
+
+    response = client.get("/api/Users/", params=params, headers=auth_headers())
+
+    assert response.status_code == 400
+    assert "next_cursor" not in response.json()
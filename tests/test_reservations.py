@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from ..api.models import OrderProduct, ReservationStatus
+from ..api.services import ProductsService, ReservationsService
+from ..api.services.reservations import PENDING_HOLD_SECONDS
+from .conftest import product
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def product_id(db):
+    return (await db.products.insert_one(product(stock=5, reserved=0))).inserted_id
+
+
+def lines(product_id, quantity: int) -> list[OrderProduct]:
+    return [OrderProduct(product_id=product_id, quantity=quantity)]
+
+
+async def stored(db, product_id) -> dict:
+    return await db.products.find_one({"_id": product_id})
+
+
+async def age_pending_holds(db):
+    stale = datetime.now() - timedelta(seconds=PENDING_HOLD_SECONDS + 1)
+    await db.reservations.update_many({"status": ReservationStatus.pending}, {"$set": {"modified_at": stale}})
+
+
+async def test_hold_reserves_and_records_the_lines(db, product_id):
+    order_id = ObjectId()
+
+    await ReservationsService.hold(order_id, lines(product_id, 2))
+    await ReservationsService.hold(order_id, lines(product_id, 3))
+
+    reservation = await db.reservations.find_one({"_id": order_id})
+    assert reservation["status"] == ReservationStatus.active
+    assert reservation["products"] == [{"product_id": product_id, "quantity": 3}]
+    assert "pending_token" not in reservation
+    product = await stored(db, product_id)
+    assert product["reserved"] == 3 and product["pending_holds"] == []
+
+
+async def test_out_of_stock_holds_leave_nothing_behind(db, product_id):
+    order_id = ObjectId()
+    await ReservationsService.hold(order_id, lines(product_id, 2))
+
+    with pytest.raises(HTTPException) as error:
+        await ReservationsService.hold(order_id, lines(product_id, 6))
+    with pytest.raises(HTTPException):
+        await ReservationsService.hold(ObjectId(), lines(product_id, 4))
+
+    assert error.value.status_code == 409
+    assert (await stored(db, product_id))["reserved"] == 2
+    assert (await db.reservations.find_one({"_id": order_id}))["status"] == ReservationStatus.active
+    assert await db.reservations.count_documents({"status": ReservationStatus.pending}) == 0
+
+
+@pytest.mark.parametrize("dies", ["before", "after"])
+async def test_holds_abandoned_halfway_are_undone_by_the_sweeper(db, product_id, monkeypatch, dies):
+    reserve_stock = ProductsService.reserve_stock
+
+    async def reserve_and_die(*args, **kwargs):
+        if dies == "after":
+            await reserve_stock(*args, **kwargs)
+        raise RuntimeError("worker killed")
+
+    monkeypatch.setattr(ProductsService, "reserve_stock", reserve_and_die)
+    order_id = ObjectId()
+    with pytest.raises(RuntimeError):
+        await ReservationsService.hold(order_id, lines(product_id, 2))
+    assert (await db.reservations.find_one({"_id": order_id}))["status"] == ReservationStatus.pending
+
+    assert await ReservationsService.reconcile_pending() == 0
+    await age_pending_holds(db)
+    assert await ReservationsService.reconcile_pending() == 1
+
+    assert (await stored(db, product_id))["reserved"] == 0
+    assert (await db.reservations.find_one({"_id": order_id}))["status"] == ReservationStatus.released
+    # The order can hold its stock again.
+    monkeypatch.undo()
+    await ReservationsService.hold(order_id, lines(product_id, 5))
+    assert (await stored(db, product_id))["reserved"] == 5
+
+
+async def test_slow_holds_taken_by_the_sweeper_are_undone_once(db, product_id, monkeypatch):
+    reserve_stock = ProductsService.reserve_stock
+
+    async def reserve_slowly(*args, **kwargs):
+        await reserve_stock(*args, **kwargs)
+        await age_pending_holds(db)
+        assert await ReservationsService.reconcile_pending() == 1
+
+    monkeypatch.setattr(ProductsService, "reserve_stock", reserve_slowly)
+    with pytest.raises(HTTPException) as error:
+        await ReservationsService.hold(ObjectId(), lines(product_id, 2))
+
+    assert error.value.status_code == 409
+    assert (await stored(db, product_id))["reserved"] == 0
+
+
+async def test_holds_use_a_transaction_when_supported(db, product_id, transactions):
+    order_id = ObjectId()
+    await ReservationsService.hold(order_id, lines(product_id, 2))
+
+    assert len(transactions) == 1
+    assert (await stored(db, product_id))["reserved"] == 2
+    reservation = await db.reservations.find_one({"_id": order_id})
+    assert reservation["status"] == ReservationStatus.active
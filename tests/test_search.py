@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+
+from ..api.search import InvertedIndex, PrefixIndex, ProductSearchIndex
+from ..api.search import products as search_products
+from ..api.search.products import refresh_searched_product
+from .conftest import product
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def search(db):
+    await db.products.insert_many(
+        [product(name="Zapatilla running"), product(name="Remera de algodón"), product(name="Buzo de algodón")]
+    )
+    search = ProductSearchIndex()
+    await search.start()
+    return search
+
+
+async def test_builds_and_refreshes_the_index(db, search):
+    zapatilla = await db.products.find_one({"name": "Zapatilla running"})
+    buzo = await db.products.find_one({"name": "Buzo de algodón"})
+    await db.products.update_one({"_id": zapatilla["_id"]}, {"$set": {"name": "Zapatilla trekking"}})
+    await db.products.delete_one({"_id": buzo["_id"]})
+
+    search.refresh([zapatilla["_id"], buzo["_id"]])
+    await search.refreshing
+
+    assert search.ready and len(search.index) == 2
+    assert await search.search("trekking") == [zapatilla["_id"]]
+    assert await search.search("running") == []
+    assert await search.autocomplete("zap", "name") == [{"id": str(zapatilla["_id"]), "name": "Zapatilla trekking"}]
+
+
+async def test_queries_are_scored_off_the_event_loop(search, monkeypatch):
+    threads = []
+    score = InvertedIndex.search
+
+    def search_in_thread(index, query, limit=10):
+        threads.append(threading.current_thread())
+        return score(index, query, limit)
+
+    monkeypatch.setattr(InvertedIndex, "search", search_in_thread)
+
+    assert len(await search.search("zapatilla")) == 1
+    assert threads and threading.main_thread() not in threads
+
+
+async def test_autocomplete_is_built_off_the_event_loop(db, monkeypatch):
+    await db.products.insert_one(product(name="Zapatilla running", sku="ZAP-1"))
+    threads = []
+    add_many = PrefixIndex.add_many
+
+    def add_many_in_thread(index, items):
+        threads.append(threading.current_thread())
+        return add_many(index, items)
+
+    monkeypatch.setattr(PrefixIndex, "add_many", add_many_in_thread)
+    search = ProductSearchIndex()
+    await search.start()
+
+    assert len(threads) == 2 and threading.main_thread() not in threads
+    assert await search.autocomplete("zap", "sku") == [{"id": str(search.index.keys[0]), "sku": "ZAP-1"}]
+
+
+async def test_sales_only_rerank_autocomplete(db, search, monkeypatch):
+    version = search.version
+    for name, sales_count in [("Buzo de algodón", 3), ("Remera de algodón", 5)]:
+        found = await db.products.find_one_and_update({"name": name}, {"$set": {"sales_count": sales_count}})
+        search.refresh([found["_id"]], ranks_only=True)
+        await search.refreshing
+        assert (await search.autocomplete("algodon", "name"))[0]["name"] == name
+
+    monkeypatch.setattr(search_products, "product_search", search)
+    refresh_searched_product(found["_id"], frozenset({"reserved", "modified_at"}))
+    assert search.version == version and not (search.pending or search.pending_ranks)
@@ -0,0 +1,46 @@
+import os
+
+import pytest
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.testclient import TestClient
+
+from ..api.__static import CompressedStaticFiles
+
+CSS = b"body { color: black; }\n" * 50
+
+
+@pytest.fixture
+def static(tmp_path):
+    (tmp_path / "css").mkdir()
+    (tmp_path / "css" / "index.css").write_bytes(CSS)
+    return CompressedStaticFiles(directory=str(tmp_path))
+
+
+def serve(static: CompressedStaticFiles) -> TestClient:
+    return TestClient(Starlette(routes=[Mount("/static", static)]))
+
+
+def test_variants_are_only_served_compressed(static):
+    static.prepare()
+    static.prepare()
+    client = serve(static)
+
+    compressed = client.get("/static/css/index.css", headers={"Accept-Encoding": "gzip"})
+
+    assert list(static.fingerprints) == ["css/index.css"]
+    assert compressed.headers["content-encoding"] == "gzip" and compressed.content == CSS
+    assert client.get("/static/css/index.css.gz").status_code == 404
+    assert client.get("/static/" + static.fingerprinted("css/index.css")).content == CSS
+
+
+def test_read_only_directories_are_served_uncompressed(static, monkeypatch):
+    def read_only(*args):
+        raise OSError(30, "Read-only file system")
+
+    monkeypatch.setattr(os, "replace", read_only)
+    static.prepare()
+    response = serve(static).get("/static/css/index.css", headers={"Accept-Encoding": "gzip"})
+
+    assert "css/index.css" in static.fingerprints
+    assert "content-encoding" not in response.headers and response.content == CSS